@@ -0,0 +1,195 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Almacen_Precios.py
+
+import os
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_Cache import DIRECTORIO_CACHE
+
+# --- ALMACÉN COLUMNAR DE CIERRES (NumPy memmap) ---
+# Una matriz (tickers x fechas) de cierres alineados en una rejilla común de fechas, más metadatos:
+#   <directorio>/ACTUAL                -> nombre de la versión vigente (se cambia de forma atómica)
+#   <directorio>/v<ns>/cierres.npy     -> float64 (N, D); NaN donde el ticker no cotiza
+#   <directorio>/v<ns>/fechas.npy      -> datetime64[ns] (D,)
+#   <directorio>/v<ns>/tickers.npy     -> str (N,), ordenados (búsqueda binaria, sin diccionario)
+#   <directorio>/v<ns>/rangos.npy      -> int64 (N, 2): [primera, última+1] posición con dato
+# Los lectores abren los .npy con mmap_mode='r': nada se deserializa, las páginas se comparten
+# entre procesos a través de la caché del sistema operativo y una fila (ticker) es contigua en disco.
+
+DIRECTORIO_PRECIOS = os.path.join(DIRECTORIO_CACHE, "precios")
+VERSIONES_CONSERVADAS = 2  # La anterior se mantiene para los lectores que aún la tengan abierta
+
+_almacenes_abiertos = {}  # (directorio, versión) -> almacén ya mapeado en este proceso
+
+
+def _cierres_de(historico):
+    """
+    (fechas datetime64[ns] sin zona horaria ni hora, cierres float64) de un DataFrame de yf.history o una Serie.
+    """
+    serie = historico['Close'] if isinstance(historico, pd.DataFrame) else historico
+    serie = serie.dropna()
+    indice = pd.DatetimeIndex(serie.index)
+    if indice.tz is not None:
+        indice = indice.tz_localize(None)  # Hora local del mercado: la fecha de la sesión no cambia
+    fechas = indice.to_numpy().astype("datetime64[D]").astype("datetime64[ns]")
+    return fechas, serie.to_numpy(dtype="float64")
+
+
+def _rangos_validos(cierres):
+    validos = np.isfinite(cierres)
+    con_dato = validos.any(axis=1)
+    primera = np.where(con_dato, validos.argmax(axis=1), 0)
+    ultima = np.where(con_dato, cierres.shape[1] - validos[:, ::-1].argmax(axis=1), 0)
+    return np.stack([primera, ultima], axis=1).astype("int64")
+
+
+def guardar_historicos(historicos, directorio=DIRECTORIO_PRECIOS):
+    """
+    Fusiona 'historicos' (dict ticker -> DataFrame de yf.history o Serie de cierres) con el almacén existente
+    y publica una versión nueva. Los tickers que ya estaban se sustituyen; el resto se conserva.
+    Pensado para llamarse una vez por ejecución (reescribe la matriz completa).
+    """
+    nuevos = {t: _cierres_de(h) for t, h in historicos.items() if h is not None and len(h)}
+    if not nuevos:
+        return None
+
+    previo = abrir_almacen(directorio)
+    if previo is not None:
+        conservados = np.array([t not in nuevos for t in previo['tickers']], dtype=bool)
+        tickers_previos = previo['tickers'][conservados]
+        fechas = previo['fechas']
+    else:
+        tickers_previos, fechas = np.array([], dtype=str), np.array([], dtype="datetime64[ns]")
+
+    # Rejilla común = unión de todas las fechas
+    fechas = np.unique(np.concatenate([fechas] + [f for f, _ in nuevos.values()]))
+    tickers = np.sort(np.concatenate([tickers_previos, np.array(list(nuevos), dtype=str)]))
+    cierres = np.full((len(tickers), len(fechas)), np.nan)
+
+    if previo is not None and len(tickers_previos):
+        filas_destino = np.searchsorted(tickers, tickers_previos)
+        columnas_destino = np.searchsorted(fechas, previo['fechas'])
+        cierres[np.ix_(filas_destino, columnas_destino)] = previo['cierres'][conservados]
+    for t, (fechas_t, valores_t) in nuevos.items():
+        cierres[np.searchsorted(tickers, t), np.searchsorted(fechas, fechas_t)] = valores_t
+
+    # Publicación: se escribe la versión completa y después se apunta ACTUAL a ella (os.replace es atómico)
+    version = f"v{time.time_ns()}"
+    ruta_version = os.path.join(directorio, version)
+    os.makedirs(ruta_version)
+    np.save(os.path.join(ruta_version, "cierres.npy"), cierres)
+    np.save(os.path.join(ruta_version, "fechas.npy"), fechas)
+    np.save(os.path.join(ruta_version, "tickers.npy"), tickers)
+    np.save(os.path.join(ruta_version, "rangos.npy"), _rangos_validos(cierres))
+
+    descriptor, ruta_tmp = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(descriptor, "w") as f:
+        f.write(version)
+    os.replace(ruta_tmp, os.path.join(directorio, "ACTUAL"))
+
+    # Limpieza de versiones antiguas (en Windows puede fallar si otro proceso las tiene mapeadas: se ignora)
+    versiones = sorted(v for v in os.listdir(directorio) if v.startswith("v"))
+    for antigua in versiones[:-VERSIONES_CONSERVADAS]:
+        shutil.rmtree(os.path.join(directorio, antigua), ignore_errors=True)
+    return version
+
+
+def abrir_almacen(directorio=DIRECTORIO_PRECIOS):
+    """
+    Mapea en memoria la versión vigente del almacén (o None si no existe). No lee los datos:
+    el coste es el mismo con 20 o con 20.000 tickers. La misma versión se reutiliza dentro del proceso.
+    """
+    try:
+        with open(os.path.join(directorio, "ACTUAL")) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    clave = (directorio, version)
+    if clave not in _almacenes_abiertos:
+        ruta_version = os.path.join(directorio, version)
+        fechas = np.load(os.path.join(ruta_version, "fechas.npy"), mmap_mode="r")
+        _almacenes_abiertos.clear()  # Solo interesa la última versión
+        _almacenes_abiertos[clave] = {
+            "version": version,
+            "cierres": np.load(os.path.join(ruta_version, "cierres.npy"), mmap_mode="r"),
+            "fechas": fechas,
+            "indice_fechas": pd.DatetimeIndex(fechas),
+            "tickers": np.load(os.path.join(ruta_version, "tickers.npy"), mmap_mode="r"),
+            "rangos": np.load(os.path.join(ruta_version, "rangos.npy"), mmap_mode="r"),
+        }
+    return _almacenes_abiertos[clave]
+
+
+def _posicion(almacen, ticker):
+    i = int(np.searchsorted(almacen['tickers'], ticker))
+    if i < len(almacen['tickers']) and almacen['tickers'][i] == ticker:
+        return i
+    return None
+
+
+def serie_cierres(almacen, ticker):
+    """
+    Cierres de un ticker como pd.Series (vista sobre el memmap, sin copia), recortada a su primer y último dato.
+    Puede contener NaN en fechas en las que cotizan otros tickers pero no este. None si no está en el almacén.
+    """
+    i = None if almacen is None else _posicion(almacen, ticker)
+    if i is None:
+        return None
+    inicio, fin = almacen['rangos'][i]
+    return pd.Series(almacen['cierres'][i, inicio:fin], index=almacen['indice_fechas'][inicio:fin],
+                     name="Close", copy=False)
+
+
+def matriz_cierres(almacen, tickers=None):
+    """
+    Matriz (N, D) de cierres alineados para análisis en bloque y la lista de tickers de sus filas.
+    Sin 'tickers' devuelve la vista completa (sin copia); con una lista, copia solo esas filas.
+    """
+    if tickers is None:
+        return almacen['cierres'], list(almacen['tickers'])
+    posiciones = [(t, _posicion(almacen, t)) for t in tickers]
+    posiciones = [(t, i) for t, i in posiciones if i is not None]
+    return almacen['cierres'][[i for _, i in posiciones]], [t for t, _ in posiciones]
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    directorio_prueba = tempfile.mkdtemp()
+    fechas_prueba = pd.bdate_range("2021-01-01", periods=1260)
+    rng = np.random.default_rng(0)
+
+    for n_tickers in (100, 5_000):
+        historicos = {
+            f"T{k:05d}": pd.DataFrame({"Close": 50 * np.exp(np.cumsum(rng.normal(0, 0.01, len(fechas_prueba))))},
+                                      index=fechas_prueba)
+            for k in range(n_tickers)
+        }
+        t0 = time.perf_counter()
+        guardar_historicos(historicos, directorio_prueba)
+        escritura = time.perf_counter() - t0
+
+        aperturas = []
+        for _ in range(20):
+            _almacenes_abiertos.clear()  # Apertura en frío: sin la versión ya mapeada en el proceso
+            t0 = time.perf_counter()
+            almacen = abrir_almacen(directorio_prueba)
+            aperturas.append(time.perf_counter() - t0)
+        apertura = float(np.median(aperturas))
+
+        t0 = time.perf_counter()
+        for k in range(1000):
+            serie = serie_cierres(almacen, f"T{rng.integers(n_tickers):05d}")
+        lectura = (time.perf_counter() - t0) / 1000
+
+        print(f"--- {n_tickers} tickers x {len(fechas_prueba)} fechas ---")
+        print(f"   > Escritura: {escritura:.3f}s | Apertura (en frío): {apertura * 1e3:.3f} ms | "
+              f"Serie de un ticker: {lectura * 1e6:.1f} µs | Sin copia: {np.shares_memory(serie.to_numpy(), almacen['cierres'])}")
+
+    shutil.rmtree(directorio_prueba, ignore_errors=True)
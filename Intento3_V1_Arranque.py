@@ -0,0 +1,150 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Arranque.py
+
+import os
+import re
+import sys
+import json
+import statistics
+import subprocess
+
+import pandas as pd
+
+# --- BANCO DE PRUEBAS DEL ARRANQUE ---
+# Todas las medidas se toman en intérpretes nuevos (arranque en frío, como una sesión nueva o un contenedor recién creado):
+#   1. Coste de importar cada módulo (acumulado, con sus dependencias) según 'python -X importtime'.
+#   2. Tiempo hasta el primer pintado: primera ejecución completa del script de la app sin pulsar nada
+#      (barra lateral, selector y botones), con streamlit ya importado como en el servidor.
+# Además se comprueba que las librerías de MODULOS_DIFERIDOS no se cargan durante ese primer pintado.
+
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+RUTA_APP = os.path.join(DIRECTORIO_APP, "Intento3_V1_app.py")
+
+# Solo deben cargarse al lanzar una ejecución, llegar a la fase de IA o pintar un gráfico
+MODULOS_DIFERIDOS = ("yfinance", "google.generativeai", "plotly.graph_objects")
+MODULOS_MEDIDOS = ("streamlit", "pandas", "openpyxl") + MODULOS_DIFERIDOS + (
+    "Intento3_V1_Obtener_Datos", "Intento3_V1_Gestor_IA", "Intento3_V1_Embudo", "Intento3_V1_Sensibilidad")
+
+LIMITE_PRIMER_PINTADO = 3.0   # Segundos; por encima se considera una regresión
+TOLERANCIA_REFERENCIA = 0.25  # +25% sobre una medida de referencia guardada también es regresión
+
+_LINEA_IMPORTTIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)")
+
+_CODIGO_PRIMER_PINTADO = """
+import json, sys, time
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+importado = time.perf_counter()
+previos = set(sys.modules)  # Lo que ya trae streamlit no es responsabilidad de la app
+at = AppTest.from_file({ruta!r}, default_timeout=120)
+at.run()
+fin = time.perf_counter()
+print(json.dumps({{"importar_streamlit": importado - inicio, "primer_pintado": fin - importado,
+                  "cargados": [m for m in {diferidos!r} if m in sys.modules and m not in previos],
+                  "de_streamlit": [m for m in {diferidos!r} if m in previos],
+                  "errores": [str(e.value) for e in at.exception]}}))
+"""
+
+
+def _ejecutar_en_limpio(argumentos):
+    """Lanza un intérprete nuevo en la carpeta de la app (para que encuentre Referencias.xlsx y los módulos)."""
+    return subprocess.run([sys.executable, *argumentos], cwd=DIRECTORIO_APP, capture_output=True, text=True)
+
+
+def coste_importacion(modulo):
+    """Segundos que cuesta importar 'modulo' en frío (incluidas sus dependencias). None si no se puede importar."""
+    proceso = _ejecutar_en_limpio(["-X", "importtime", "-c", f"import {modulo}"])
+    if proceso.returncode != 0:
+        return None
+    for linea in proceso.stderr.splitlines():
+        coincidencia = _LINEA_IMPORTTIME.match(linea)
+        # Sin sangría = importado directamente por el -c (el acumulado incluye todo lo que arrastra)
+        if coincidencia and not coincidencia.group(2) and coincidencia.group(3) == modulo:
+            return int(coincidencia.group(1)) / 1e6
+    return None
+
+
+def costes_importacion(modulos=MODULOS_MEDIDOS, repeticiones=3):
+    """DataFrame Módulo / Segundos (mediana de 'repeticiones' arranques en frío), del más caro al más barato."""
+    filas = []
+    for modulo in modulos:
+        medidas = [m for m in (coste_importacion(modulo) for _ in range(repeticiones)) if m is not None]
+        filas.append({"Módulo": modulo, "Segundos": round(statistics.median(medidas), 3) if medidas else None})
+    return pd.DataFrame(filas).sort_values("Segundos", ascending=False, na_position="last").reset_index(drop=True)
+
+
+def tiempo_primer_pintado(ruta_app=RUTA_APP, repeticiones=3):
+    """
+    Mide la primera ejecución del script de la app en 'repeticiones' intérpretes nuevos. Devuelve un dict:
+      - 'segundos': mediana del primer pintado (sin contar la importación de streamlit)
+      - 'importar_streamlit': mediana de la importación de streamlit (la paga el servidor una vez)
+      - 'modulos_diferidos_cargados': librerías de MODULOS_DIFERIDOS que la app cargó igualmente
+      - 'modulos_de_streamlit': librerías de MODULOS_DIFERIDOS que ya importa el propio streamlit (no evitables)
+      - 'errores': excepciones de la app durante el primer pintado
+    """
+    codigo = _CODIGO_PRIMER_PINTADO.format(ruta=os.path.abspath(ruta_app), diferidos=MODULOS_DIFERIDOS)
+    medidas = []
+    for _ in range(repeticiones):
+        proceso = _ejecutar_en_limpio(["-c", codigo])
+        if proceso.returncode != 0:
+            raise RuntimeError(f"La app no arrancó: {proceso.stderr.strip()[-500:]}")
+        medidas.append(json.loads(proceso.stdout.strip().splitlines()[-1]))
+    return {
+        "segundos": statistics.median(m["primer_pintado"] for m in medidas),
+        "importar_streamlit": statistics.median(m["importar_streamlit"] for m in medidas),
+        "modulos_diferidos_cargados": sorted({c for m in medidas for c in m["cargados"]}),
+        "modulos_de_streamlit": sorted({c for m in medidas for c in m["de_streamlit"]}),
+        "errores": sorted({e for m in medidas for e in m["errores"]}),
+    }
+
+
+def detectar_regresiones(pintado, limite=LIMITE_PRIMER_PINTADO, referencia=None):
+    """Lista de problemas del arranque (vacía si todo está bien). 'referencia' = dict guardado de una medida anterior."""
+    problemas = [f"Error en la app: {e}" for e in pintado["errores"]]
+    if pintado["modulos_diferidos_cargados"]:
+        problemas.append(f"Se importan en el arranque: {', '.join(pintado['modulos_diferidos_cargados'])}")
+    if pintado["segundos"] > limite:
+        problemas.append(f"Primer pintado de {pintado['segundos']:.2f}s (límite {limite:.2f}s)")
+    if referencia and pintado["segundos"] > referencia["segundos"] * (1 + TOLERANCIA_REFERENCIA):
+        problemas.append(f"Primer pintado de {pintado['segundos']:.2f}s frente a {referencia['segundos']:.2f}s de referencia "
+                         f"(+{pintado['segundos'] / referencia['segundos'] - 1:.0%})")
+    return problemas
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de la app y detecta regresiones")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--limite", type=float, default=LIMITE_PRIMER_PINTADO, help="Segundos máximos de primer pintado")
+    parser.add_argument("--referencia", help="JSON de una medida anterior con la que comparar")
+    parser.add_argument("--guardar", help="JSON donde guardar esta medida (para usarla como referencia)")
+    args = parser.parse_args()
+
+    print(f"\n--- ⏱️ COSTE DE IMPORTACIÓN EN FRÍO (mediana de {args.repeticiones}) ---")
+    print(costes_importacion(repeticiones=args.repeticiones).to_string(index=False))
+
+    print("\n--- 🖥️ PRIMER PINTADO DE LA APP ---")
+    pintado = tiempo_primer_pintado(repeticiones=args.repeticiones)
+    print(f"   > Importar streamlit: {pintado['importar_streamlit']:.2f}s (una vez por proceso del servidor)")
+    print(f"   > Primer pintado: {pintado['segundos']:.2f}s")
+    print(f"   > Librerías diferidas cargadas por la app: {', '.join(pintado['modulos_diferidos_cargados']) or 'ninguna'}")
+    if pintado['modulos_de_streamlit']:
+        print(f"   > Ya las importa streamlit: {', '.join(pintado['modulos_de_streamlit'])}")
+
+    referencia = None
+    if args.referencia:
+        with open(args.referencia, encoding="utf-8") as f:
+            referencia = json.load(f)
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(pintado, f, indent=2)
+
+    problemas = detectar_regresiones(pintado, args.limite, referencia)
+    for problema in problemas:
+        print(f"   ❌ {problema}")
+    if not problemas:
+        print("   ✅ Sin regresiones en el arranque.")
+    sys.exit(1 if problemas else 0)
@@ -0,0 +1,69 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Cache.py
+
+import os
+import time
+import pickle
+import shutil
+import tempfile
+from urllib.parse import quote
+
+# Carpeta local de la caché (configurable para despliegues con varios procesos o contenedores)
+DIRECTORIO_CACHE = os.environ.get("TFM_CACHE_DIR", ".cache_tfm")
+
+
+def _ruta(espacio, clave):
+    # quote() convierte tickers como "BRK.B" o "^GSPC" en nombres de fichero válidos y reversibles
+    return os.path.join(DIRECTORIO_CACHE, espacio, quote(str(clave), safe="") + ".pkl")
+
+
+def guardar_en_cache(espacio, clave, valor):
+    """
+    Guarda 'valor' en disco bajo 'espacio/clave' junto con la marca de tiempo.
+    La escritura es atómica (fichero temporal + os.replace), así que varios procesos pueden leer y escribir a la vez.
+    """
+    ruta = _ruta(espacio, clave)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    descriptor, ruta_tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            pickle.dump({"guardado": time.time(), "valor": valor}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta_tmp, ruta)
+    except Exception:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+        raise
+
+
+def leer_de_cache(espacio, clave, ttl=None):
+    """
+    Devuelve (valor, antigüedad en segundos) o (None, None) si no existe, está corrupta o ha caducado ('ttl' en segundos).
+    """
+    ruta = _ruta(espacio, clave)
+    try:
+        with open(ruta, "rb") as f:
+            entrada = pickle.load(f)
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        print(f"Aviso: entrada de caché ilegible ({ruta}): {e}")
+        return None, None
+
+    antiguedad = time.time() - entrada["guardado"]
+    if ttl is not None and antiguedad > ttl:
+        return None, None
+    return entrada["valor"], antiguedad
+
+
+def borrar_cache(espacio=None):
+    """Borra un espacio concreto de la caché o la caché completa."""
+    ruta = os.path.join(DIRECTORIO_CACHE, espacio) if espacio else DIRECTORIO_CACHE
+    shutil.rmtree(ruta, ignore_errors=True)
+
+
+def describir_antiguedad(segundos):
+    """Texto corto para la interfaz: 'hace 5 min', 'hace 3 h', 'hace 2 días'."""
+    if segundos < 3600:
+        return f"hace {max(1, int(segundos // 60))} min"
+    if segundos < 86400:
+        return f"hace {int(segundos // 3600)} h"
+    return f"hace {int(segundos // 86400)} días"
@@ -0,0 +1,295 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Carga.py
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import Intento3_V1_Cache
+from Intento3_V1_Obtener_Datos import obtener_datos_financieros, obtener_datos_precalentados
+from Intento3_V1_GateKeeper import ejecutar_gatekeeper
+from Intento3_V1_Gestor_IA import generar_analisis_gemini
+from Intento3_V1_Noticias import lanzar_descarga_noticias
+from Intento3_V1_Incremental import evaluar_cambios, guardar_analisis
+from Intento3_V1_Precalentado import PRECALENTADO_TTL_SEGUNDOS
+from Intento3_V1_Stubs import iniciar_stub_gemini, instalar_stub_yahoo, desinstalar_stub_yahoo
+
+# --- PRUEBA DE CARGA CON SESIONES CONCURRENTES ---
+# Reproduce el recorrido de "Ejecutar Análisis" de Intento3_V1_app.py (datos -> Gatekeeper -> noticias -> IA)
+# desde N sesiones simuladas a la vez. Streamlit ejecuta cada sesión en un hilo del mismo proceso, así que aquí
+# cada sesión es un hilo: comparten el GIL, la caché en disco y el ejecutor de noticias, como en el servidor.
+# Yahoo y Gemini se sustituyen por los stubs locales de Intento3_V1_Stubs.py con un perfil de latencia,
+# errores y límite de peticiones; la caché va a una carpeta temporal para no tocar la real.
+# No se mide el pintado de Streamlit ni la pausa de 1 s entre tickers de la app.
+
+PERFILES_CARGA = {
+    # Latencias (mediana, s) del orden de las observadas con Yahoo y Gemini Flash
+    "nominal": {"yahoo": {"latencia": 0.15, "dispersion": 0.3},
+                "gemini": {"retardo_peticion": 1.5, "dispersion_retardo": 0.3}},
+    "lento": {"yahoo": {"latencia": 0.6, "dispersion": 0.8},
+              "gemini": {"retardo_peticion": 4.0, "dispersion_retardo": 0.6}},
+    "inestable": {"yahoo": {"latencia": 0.15, "dispersion": 0.3, "probabilidad_error": 0.05},
+                  "gemini": {"retardo_peticion": 1.5, "dispersion_retardo": 0.3, "probabilidad_error": 0.05}},
+    "limitado": {"yahoo": {"latencia": 0.15, "dispersion": 0.3, "limite_por_segundo": 30},
+                 "gemini": {"retardo_peticion": 1.5, "dispersion_retardo": 0.3, "limite_por_segundo": 2}},
+}
+PERCENTILES = (50, 95, 99)
+FASES = ("Total", "Datos", "Gatekeeper", "IA")
+API_KEY_CARGA = "clave-prueba-carga"
+
+
+# --- 1. UNIVERSO Y MEMORIA ---
+def universo_sintetico(df_referencias, n_tickers):
+    """'n_tickers' filas de referencias: las reales y, si no llegan, copias con sufijo (KO-2, KO-3...)."""
+    filas = []
+    for k in range(n_tickers):
+        fila = df_referencias.iloc[k % len(df_referencias)].copy()
+        vuelta = k // len(df_referencias)
+        if vuelta:
+            fila['Ticker'] = f"{fila['Ticker']}-{vuelta + 1}"
+        filas.append(fila)
+    return pd.DataFrame(filas).reset_index(drop=True)
+
+
+def _rss_actual_mb():
+    """Memoria residente actual del proceso en MB (psutil o /proc; None si no se puede leer)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def _vigilar_memoria(parar, picos, intervalo=0.05):
+    while not parar.wait(intervalo):
+        rss = _rss_actual_mb()
+        if rss is not None:
+            picos.append(max(picos.pop() if picos else 0.0, rss))
+
+
+def _escalar(perfil, clave_latencia, escala):
+    escalado = dict(perfil, **{clave_latencia: perfil[clave_latencia] * escala})
+    if escalado.get("limite_por_segundo"):
+        escalado["limite_por_segundo"] = max(1, round(escalado["limite_por_segundo"] / escala))
+    return escalado
+
+
+# --- 2. UNA SESIÓN SIMULADA ---
+def _analizar_ticker(ticker, fila_ref, opciones):
+    """Mismo recorrido que un ticker del bucle de la app, con la duración de cada fase."""
+    medida = {"Ticker": ticker, "Caché": False, "Decisión": "", "Decisión IA": "", "Error": "",
+              "Datos": np.nan, "Gatekeeper": np.nan, "IA": np.nan}
+    inicio = time.perf_counter()
+
+    datos = None
+    if opciones["usar_cache"]:
+        datos = obtener_datos_precalentados([ticker], ttl=PRECALENTADO_TTL_SEGUNDOS).get(ticker)
+        medida["Caché"] = datos is not None
+    if datos is None:
+        datos = obtener_datos_financieros(ticker)
+    marca = time.perf_counter()
+    medida["Datos"] = marca - inicio
+    if not datos:
+        medida["Error"] = "Datos"
+        medida["Total"] = marca - inicio
+        return medida
+
+    informe = ejecutar_gatekeeper(datos, fila_ref)
+    medida["Decisión"] = informe['decision']
+    medida["Gatekeeper"] = time.perf_counter() - marca
+    marca = time.perf_counter()
+
+    if informe['decision'] != "DESCARTAR":
+        datos['noticias'] = lanzar_descarga_noticias(ticker).result()
+        cambios = evaluar_cambios(ticker, datos, informe) if opciones["incremental"] else None
+        if cambios and not cambios['reanalizar']:
+            decision_ia = cambios['analisis'][2]
+        else:
+            analisis = generar_analisis_gemini(API_KEY_CARGA, ticker, datos, informe,
+                                               modo_estructurado=opciones["modo_estructurado"],
+                                               al_recibir_fragmento=(lambda _: None) if opciones["streaming"] else None)
+            decision_ia = analisis[2]
+            if decision_ia != "ERROR":
+                guardar_analisis(ticker, datos, informe, analisis)
+            else:
+                medida["Error"] = "IA"
+        medida["Decisión IA"] = decision_ia
+        medida["IA"] = time.perf_counter() - marca
+
+    medida["Total"] = time.perf_counter() - inicio
+    return medida
+
+
+def _sesion(id_sesion, tickers, referencias, opciones, retraso):
+    time.sleep(retraso)
+    medidas = []
+    for ticker in tickers:
+        medida = _analizar_ticker(ticker, referencias[ticker], opciones)
+        medida["Sesión"] = id_sesion
+        medidas.append(medida)
+    return medidas
+
+
+# --- 3. PRUEBA COMPLETA ---
+def ejecutar_carga(df_referencias, n_sesiones=20, tickers_por_sesion=50, perfil="nominal", n_universo=200,
+                   usar_cache=False, incremental=False, modo_estructurado=False, streaming=True, escala_latencia=1.0,
+                   rampa_segundos=0.0, semilla=0, al_progresar=None):
+    """
+    Lanza 'n_sesiones' sesiones simultáneas; cada una analiza 'tickers_por_sesion' tickers elegidos al azar
+    (reproducible con 'semilla') de un universo de 'n_universo' tickers construido a partir de 'df_referencias'.
+    'perfil' es una clave de PERFILES_CARGA (o un dict con el mismo formato); 'escala_latencia' multiplica
+    sus latencias y divide sus límites por segundo (p.ej. 0.1 para una prueba 10 veces más rápida con el mismo
+    comportamiento relativo). Las sesiones arrancan repartidas en 'rampa_segundos'.
+    'usar_cache' e 'incremental' equivalen a las opciones de precalentado y reanálisis incremental de la app
+    (por defecto desactivadas: cada ticker paga la descarga y la llamada a la IA, el peor caso).
+
+    Devuelve un dict:
+      - 'medidas': DataFrame con una fila por ticker analizado (sesión, segundos por fase, decisión, error)
+      - 'latencias': DataFrame de percentiles PERCENTILES por fase
+      - 'resumen': dict con duración, tickers por segundo, errores, pico de RSS y llamadas a Yahoo y Gemini
+    """
+    avisar = al_progresar or (lambda _: None)
+    perfil = PERFILES_CARGA[perfil] if isinstance(perfil, str) else perfil
+    perfil_yahoo = _escalar(perfil["yahoo"], "latencia", escala_latencia)
+    perfil_gemini = _escalar(perfil["gemini"], "retardo_peticion", escala_latencia)
+    opciones = {"usar_cache": usar_cache, "incremental": incremental, "modo_estructurado": modo_estructurado,
+                "streaming": streaming}
+
+    universo = universo_sintetico(df_referencias, n_universo)
+    referencias = {fila['Ticker']: fila for _, fila in universo.iterrows()}
+    aleatorio = random.Random(semilla)
+    selecciones = [aleatorio.sample(list(referencias), min(tickers_por_sesion, len(referencias)))
+                   for _ in range(n_sesiones)]
+
+    # Entorno aislado: caché temporal y stubs locales (se restaura todo al terminar)
+    directorio_cache_previo = Intento3_V1_Cache.DIRECTORIO_CACHE
+    endpoint_previo = os.environ.get("GEMINI_API_ENDPOINT")
+    Intento3_V1_Cache.DIRECTORIO_CACHE = tempfile.mkdtemp(prefix="carga_tfm_")
+    stub_yahoo = instalar_stub_yahoo(semilla=semilla, **perfil_yahoo)
+    servidor, url = iniciar_stub_gemini(retardo_fragmento=0, semilla=semilla, **perfil_gemini)
+    os.environ["GEMINI_API_ENDPOINT"] = url
+
+    parar, picos_rss = threading.Event(), []
+    vigilante = threading.Thread(target=_vigilar_memoria, args=(parar, picos_rss), daemon=True)
+    try:
+        rss_inicial = _rss_actual_mb()
+        vigilante.start()
+        avisar(f"{n_sesiones} sesiones x {len(selecciones[0])} tickers (universo de {len(referencias)})...")
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_sesiones, thread_name_prefix="sesion") as ejecutor:
+            futuros = [ejecutor.submit(_sesion, k, seleccion, referencias, opciones,
+                                       rampa_segundos * k / max(1, n_sesiones - 1) if n_sesiones > 1 else 0.0)
+                       for k, seleccion in enumerate(selecciones)]
+            medidas = [m for futuro in futuros for m in futuro.result()]
+        duracion = time.perf_counter() - inicio
+    finally:
+        parar.set()
+        vigilante.join()
+        servidor.shutdown()
+        desinstalar_stub_yahoo(stub_yahoo)
+        shutil.rmtree(Intento3_V1_Cache.DIRECTORIO_CACHE, ignore_errors=True)
+        Intento3_V1_Cache.DIRECTORIO_CACHE = directorio_cache_previo
+        if endpoint_previo is None:
+            os.environ.pop("GEMINI_API_ENDPOINT", None)
+        else:
+            os.environ["GEMINI_API_ENDPOINT"] = endpoint_previo
+
+    df_medidas = pd.DataFrame(medidas)[["Sesión", "Ticker", *FASES, "Caché", "Decisión", "Decisión IA", "Error"]]
+    resumen = {
+        "sesiones": n_sesiones,
+        "tickers": len(df_medidas),
+        "segundos": round(duracion, 2),
+        "tickers_por_segundo": round(len(df_medidas) / duracion, 2) if duracion else None,
+        "errores_datos": int((df_medidas["Error"] == "Datos").sum()),
+        "errores_ia": int((df_medidas["Error"] == "IA").sum()),
+        "servidos_de_cache": int(df_medidas["Caché"].sum()),
+        "rss_inicial_mb": round(rss_inicial, 1) if rss_inicial is not None else None,
+        "pico_rss_mb": round(picos_rss[0], 1) if picos_rss else None,
+        "llamadas_yahoo": dict(stub_yahoo.llamadas),
+        "rechazos_yahoo": dict(stub_yahoo.rechazos),
+        "llamadas_gemini": dict(servidor.llamadas),
+        "rechazos_gemini": dict(servidor.rechazos),
+    }
+    return {"medidas": df_medidas, "latencias": resumen_latencias(df_medidas), "resumen": resumen}
+
+
+def resumen_latencias(medidas):
+    """Percentiles (PERCENTILES) y máximo de los segundos por ticker de cada fase."""
+    filas = []
+    for fase in FASES:
+        valores = medidas[fase].dropna().to_numpy()
+        fila = {"Fase": fase, "N": len(valores)}
+        for p in PERCENTILES:
+            fila[f"p{p}"] = round(float(np.percentile(valores, p)), 3) if len(valores) else None
+        fila["Máx"] = round(float(valores.max()), 3) if len(valores) else None
+        filas.append(fila)
+    return pd.DataFrame(filas)
+
+
+def fila_capacidad(resultado):
+    """Una fila de la tabla de capacidad (un nivel de concurrencia) a partir del resultado de ejecutar_carga."""
+    r, total = resultado["resumen"], resultado["latencias"].set_index("Fase").loc["Total"]
+    return {"Sesiones": r["sesiones"], "Tickers": r["tickers"], "Segundos": r["segundos"],
+            "Tickers/s": r["tickers_por_segundo"], **{f"p{p} (s)": total[f"p{p}"] for p in PERCENTILES},
+            "Errores": r["errores_datos"] + r["errores_ia"], "Pico RSS (MB)": r["pico_rss_mb"],
+            "Llamadas Yahoo": sum(r["llamadas_yahoo"].values()),
+            "Llamadas Gemini": r["llamadas_gemini"].get("generateContent", 0) + r["llamadas_gemini"].get("streamGenerateContent", 0),
+            "Rechazos (429)": r["rechazos_yahoo"]["limite"] + r["rechazos_gemini"]["limite"]}
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import argparse
+    from Intento3_V1_Embudo import cargar_universo
+
+    parser = argparse.ArgumentParser(description="Prueba de carga del recorrido de la app con sesiones concurrentes")
+    parser.add_argument("--sesiones", default="1,5,20", help="Sesiones simultáneas; varios niveles separados por comas")
+    parser.add_argument("--tickers", type=int, default=50, help="Tickers por sesión")
+    parser.add_argument("--universo", type=int, default=200, help="Tickers distintos entre todas las sesiones")
+    parser.add_argument("--referencias", default="Referencias_Ampliado.xlsx")
+    parser.add_argument("--perfil", choices=sorted(PERFILES_CARGA), default="nominal")
+    parser.add_argument("--escala", type=float, default=1.0, help="Multiplica las latencias del perfil (0.1 = prueba rápida)")
+    parser.add_argument("--rampa", type=float, default=0.0, help="Segundos en los que se reparten los arranques de sesión")
+    parser.add_argument("--con-cache", action="store_true", help="Servir de la caché los tickers ya descargados")
+    parser.add_argument("--incremental", action="store_true", help="Reutilizar análisis IA sin cambios")
+    parser.add_argument("--estructurado", action="store_true", help="Respuesta IA en JSON")
+    parser.add_argument("--sin-streaming", action="store_true")
+    parser.add_argument("--salida", help="CSV con la tabla de capacidad")
+    args = parser.parse_args()
+
+    df_refs = cargar_universo(args.referencias)
+    capacidad = []
+    for n in (int(x) for x in args.sesiones.split(",")):
+        print(f"\n--- 🏋️ CARGA: {n} sesiones x {args.tickers} tickers, perfil '{args.perfil}' (escala {args.escala}) ---")
+        resultado = ejecutar_carga(df_refs, n_sesiones=n, tickers_por_sesion=args.tickers, perfil=args.perfil,
+                                   n_universo=args.universo, usar_cache=args.con_cache, incremental=args.incremental,
+                                   modo_estructurado=args.estructurado, streaming=not args.sin_streaming,
+                                   escala_latencia=args.escala, rampa_segundos=args.rampa)
+        r = resultado["resumen"]
+        print(resultado["latencias"].to_string(index=False))
+        print(f"   > {r['tickers']} tickers en {r['segundos']}s ({r['tickers_por_segundo']} tickers/s), "
+              f"errores: {r['errores_datos']} datos / {r['errores_ia']} IA, servidos de caché: {r['servidos_de_cache']}")
+        print(f"   > RSS: {r['rss_inicial_mb']} MB al empezar, pico {r['pico_rss_mb']} MB")
+        print(f"   > Yahoo: {r['llamadas_yahoo']} rechazos {r['rechazos_yahoo']}")
+        print(f"   > Gemini: {r['llamadas_gemini']} rechazos {r['rechazos_gemini']}")
+        capacidad.append(fila_capacidad(resultado))
+
+    tabla = pd.DataFrame(capacidad)
+    print("\n--- 📈 CAPACIDAD ---")
+    print(tabla.to_string(index=False))
+    if args.salida:
+        tabla.to_csv(args.salida, index=False)
+        print(f"   > Tabla guardada en {args.salida}")
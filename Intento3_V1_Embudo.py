@@ -0,0 +1,214 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Embudo.py
+
+import time
+
+import pandas as pd
+
+from Intento3_V1_Obtener_Datos import obtener_cotizaciones_basicas_lote, obtener_datos_financieros_lote
+from Intento3_V1_GateKeeper import ejecutar_gatekeeper, prefiltro_cotizacion
+from Intento3_V1_Gestor_IA import generar_analisis_gemini
+from Intento3_V1_Noticias import obtener_noticias_lote
+from Intento3_V1_Almacen_Precios import guardar_historicos
+from Intento3_V1_Exportacion import fila_exportacion
+from Intento3_V1_Pares import nuevo_registro_pares, actualizar_pares, referencias_pares
+from Intento3_V1_Memo import guardar_memo
+from Intento3_V1_Historial import fila_historial, anadir_ejecucion
+
+# --- EMBUDO DE CRIBADO EN TRES NIVELES ---
+# Nivel 1: cotización básica de todo el universo en bloque + prefiltro (descarta lo evidente)
+# Nivel 2: estados financieros trimestrales + Gatekeeper completo solo para los supervivientes
+# Nivel 3: noticias + análisis Gemini solo para COMPRAR / NEUTRAL
+# Cada nivel solo paga el coste del siguiente por los tickers que lo merecen.
+
+NIVELES = ("1. Cotización + prefiltro", "2. Estados financieros + Gatekeeper", "3. Análisis IA")
+
+
+def cargar_universo(ruta):
+    """
+    Lee el universo a cribar (CSV o Excel) con, al menos, la columna 'Ticker'.
+    Las columnas Ref_* que falten se rellenan con NaN (el prefiltro no descarta por referencias desconocidas).
+    """
+    if str(ruta).lower().endswith(".csv"):
+        df = pd.read_csv(ruta)
+    else:
+        df = pd.read_excel(ruta)
+
+    if 'Ticker' not in df.columns:
+        raise ValueError("El universo debe tener una columna 'Ticker'.")
+
+    df['Ticker'] = df['Ticker'].astype(str).str.strip().str.upper()
+    df = df[df['Ticker'] != ""].drop_duplicates(subset='Ticker').reset_index(drop=True)
+    for campo in ('Ref_PER_LTM_Mediana', 'Ref_PER_NTM_Mediana', 'Ref_Total_Yield',
+                  'Ref_FCF_Yield_Mediana', 'Ref_Solvencia_Mediana'):
+        if campo not in df.columns:
+            df[campo] = float("nan")
+    df['Ref_Total_Yield'] = df['Ref_Total_Yield'].fillna(3)  # Mismo valor por defecto que el Gatekeeper
+    return df
+
+
+def _fila_embudo(nivel, entrada, salida, segundos):
+    return {"Nivel": nivel, "Entran": entrada, "Pasan": salida, "Descartados": entrada - salida,
+            "Segundos": round(segundos, 2)}
+
+
+def ejecutar_embudo(df_universo, api_key=None, max_hilos=8, modo_estructurado=True, parametros=None,
+                    al_progresar=None, proveedor="yahoo", opciones_proveedor=None, al_completar_ticker=None,
+                    modo_pares=False):
+    """
+    Criba el universo (DataFrame con 'Ticker' y columnas Ref_*) en tres niveles.
+    Los estados financieros del nivel 2 salen de 'proveedor' (ver Intento3_V1_Proveedores.py).
+    'al_progresar(texto)' es opcional y recibe mensajes de avance (para la interfaz o la consola).
+    'al_completar_ticker(fila)' es opcional y recibe la fila de exportación de cada ticker en cuanto
+    termina su recorrido (ver Intento3_V1_Exportacion.py), sin esperar al resto del universo.
+    Con 'modo_pares' el Gatekeeper del nivel 2 compara cada ticker con las medianas de sus pares de subsector/sector
+    entre los snapshots del propio nivel 2 (ver Intento3_V1_Pares.py), en lugar de con las columnas Ref_*.
+
+    Devuelve un dict:
+      - 'resultados': DataFrame con una fila por ticker y el nivel en el que terminó
+      - 'embudo': DataFrame con los tickers que entran / pasan cada nivel y los segundos empleados
+      - 'datos': dict ticker -> snapshot completo (solo los que superan el nivel 1)
+      - 'informes': dict ticker -> informe del Gatekeeper
+    """
+    avisar = al_progresar or (lambda _: None)
+    referencias = {fila['Ticker']: fila for _, fila in df_universo.iterrows()}
+    tickers = list(referencias)
+    resultados = {t: {"Ticker": t, "Nivel alcanzado": 1, "Decisión Algoritmo": "", "Decisión IA": "",
+                      "Motivo": ""} for t in tickers}
+    embudo = []
+
+    def completar(t, datos=None, informe=None, justificacion_ia=None):
+        if al_completar_ticker:
+            r = resultados[t]
+            al_completar_ticker(fila_exportacion(t, referencias[t], datos, informe, r["Decisión IA"], justificacion_ia,
+                                                 nivel=r["Nivel alcanzado"], decision_algoritmo=r["Decisión Algoritmo"],
+                                                 motivo=r["Motivo"]))
+
+    # --- NIVEL 1: COTIZACIÓN BÁSICA EN BLOQUE ---
+    avisar(f"Nivel 1: cotizaciones de {len(tickers)} tickers...")
+    inicio = time.perf_counter()
+    cotizaciones = obtener_cotizaciones_basicas_lote(tickers, max_hilos=max_hilos)
+    supervivientes_1 = []
+    for t in tickers:
+        if t not in cotizaciones:
+            resultados[t]["Motivo"] = "Sin cotización disponible."
+            completar(t)
+            continue
+        descartar, motivo = prefiltro_cotizacion(cotizaciones[t], referencias[t], parametros)
+        if descartar:
+            resultados[t].update({"Decisión Algoritmo": "DESCARTAR", "Motivo": motivo})
+            completar(t, cotizaciones[t])
+        else:
+            supervivientes_1.append(t)
+    embudo.append(_fila_embudo(NIVELES[0], len(tickers), len(supervivientes_1), time.perf_counter() - inicio))
+
+    # --- NIVEL 2: ESTADOS FINANCIEROS + GATEKEEPER ---
+    avisar(f"Nivel 2: estados financieros de {len(supervivientes_1)} tickers...")
+    inicio = time.perf_counter()
+    datos_por_ticker, informes = {}, {}
+    opciones_proveedor = dict(opciones_proveedor or {})
+    if proveedor == "yahoo":
+        opciones_proveedor.setdefault("max_hilos", max_hilos)
+    lote = obtener_datos_financieros_lote(supervivientes_1, proveedor=proveedor, **opciones_proveedor) if supervivientes_1 else {}
+    if modo_pares:
+        # Un solo recálculo de pares para todo el lote; las referencias del ticker pasan a ser las de sus pares
+        registro_pares = nuevo_registro_pares(df_universo)
+        actualizar_pares(registro_pares, lote)
+        referencias.update({t: referencias_pares(registro_pares, referencias[t]) for t in supervivientes_1 if lote.get(t)})
+    for t in supervivientes_1:
+        datos = lote.get(t)
+        resultados[t]["Nivel alcanzado"] = 2
+        if not datos:
+            resultados[t]["Motivo"] = "Error al descargar los estados financieros."
+            completar(t, cotizaciones[t])
+            continue
+        datos_por_ticker[t] = datos
+        informes[t] = ejecutar_gatekeeper(datos, referencias[t], parametros)
+        resultados[t]["Decisión Algoritmo"] = informes[t]['decision']
+        resultados[t]["Motivo"] = " | ".join(informes[t]['alertas_criticas'][:1])
+        # Sin IA (descartado o sin API key) el recorrido del ticker termina aquí
+        if informes[t]['decision'] == "DESCARTAR" or not api_key:
+            completar(t, datos, informes[t])
+
+    if datos_por_ticker and proveedor == "yahoo":
+        try:
+            guardar_historicos({t: d['history'] for t, d in datos_por_ticker.items()})
+        except Exception as e:
+            print(f"Aviso: no se pudo actualizar el almacén de precios: {e}")
+    guardar_memo()  # TTM del nivel 2: el próximo cribado solo recalcula lo que cambie
+
+    supervivientes_2 = [t for t, inf in informes.items() if inf['decision'] != "DESCARTAR"]
+    embudo.append(_fila_embudo(NIVELES[1], len(supervivientes_1), len(supervivientes_2), time.perf_counter() - inicio))
+
+    # --- NIVEL 3: NOTICIAS + ANÁLISIS IA ---
+    inicio = time.perf_counter()
+    analizados = 0
+    if api_key and supervivientes_2:
+        avisar(f"Nivel 3: análisis IA de {len(supervivientes_2)} tickers...")
+        noticias = obtener_noticias_lote(supervivientes_2, max_hilos=max_hilos)
+        for t in supervivientes_2:
+            datos_por_ticker[t]['noticias'] = noticias.get(t, [])
+            _, _, decision_ia, justificacion_ia = generar_analisis_gemini(
+                api_key, t, datos_por_ticker[t], informes[t], modo_estructurado=modo_estructurado)
+            resultados[t].update({"Nivel alcanzado": 3, "Decisión IA": decision_ia, "Motivo": justificacion_ia})
+            completar(t, datos_por_ticker[t], informes[t], justificacion_ia)
+            analizados += 1
+    embudo.append(_fila_embudo(NIVELES[2], len(supervivientes_2), analizados, time.perf_counter() - inicio))
+
+    # Historial: los tickers con snapshot (nivel 2 o 3) quedan registrados igual que en una ejecución de la app
+    try:
+        anadir_ejecucion([fila_historial(t, d, informes[t], resultados[t]["Decisión IA"]) for t, d in datos_por_ticker.items()])
+    except Exception as e:
+        print(f"Aviso: no se pudo actualizar el historial: {e}")
+
+    return {
+        "resultados": pd.DataFrame(list(resultados.values())),
+        "embudo": pd.DataFrame(embudo),
+        "datos": datos_por_ticker,
+        "informes": informes,
+    }
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import os
+    import argparse
+    from Intento3_V1_Exportacion import abrir_exportacion, exportar_fila, cerrar_exportacion
+    from Intento3_V1_Perfilado import iniciar_perfilado, detener_perfilado, ruta_perfil_nueva
+
+    parser = argparse.ArgumentParser(description="Cribado en embudo de un universo de tickers")
+    parser.add_argument("universo", nargs="?", default="Referencias.xlsx", help="CSV o Excel con columna 'Ticker'")
+    parser.add_argument("--hilos", type=int, default=8)
+    parser.add_argument("--salida", help="CSV donde guardar los resultados por ticker")
+    parser.add_argument("--volcado", help="Carpeta de un volcado local (CSV/Parquet) para los estados financieros")
+    parser.add_argument("--exportar", help="Ruta base (sin extensión) del Excel/Parquet con el detalle por ticker")
+    parser.add_argument("--perfilar", action="store_true", help="Perfil de CPU y memoria de la ejecución (ver Intento3_V1_Perfilado.py)")
+    parser.add_argument("--pares", action="store_true", help="Referencias en vivo de los pares de sector/subsector (ver Intento3_V1_Pares.py)")
+    args = parser.parse_args()
+
+    print(f"\n--- 🔻 EMBUDO SOBRE {args.universo} ---")
+    perfilador = iniciar_perfilado() if args.perfilar else None
+    exportador = abrir_exportacion(args.exportar) if args.exportar else None
+    try:
+        resultado = ejecutar_embudo(cargar_universo(args.universo), api_key=os.environ.get("GEMINI_API_KEY"),
+                                    max_hilos=args.hilos, al_progresar=lambda texto: print(f"   > {texto}"),
+                                    proveedor="ficheros" if args.volcado else "yahoo",
+                                    opciones_proveedor={"directorio": args.volcado} if args.volcado else None,
+                                    al_completar_ticker=(lambda fila: exportar_fila(exportador, fila)) if exportador else None,
+                                    modo_pares=args.pares)
+    finally:
+        # También si se interrumpe: los ficheros quedan válidos con los tickers ya terminados
+        if exportador:
+            print(f"   > Detalle exportado a: {', '.join(cerrar_exportacion(exportador))}")
+    print(resultado["embudo"].to_string(index=False))
+    print(resultado["resultados"]["Nivel alcanzado"].value_counts().sort_index().to_string())
+    if perfilador:
+        perfil = detener_perfilado(perfilador, ruta_perfil_nueva("embudo"))
+        print(f"\n--- 🔬 PERFIL ({perfil['segundos']}s, pico de memoria trazada {perfil['pico_memoria_mb']} MB) ---")
+        print(perfil["cpu"].to_string(index=False))
+        print(perfil["memoria"].to_string(index=False))
+        print(f"   > Guardado en: {', '.join(perfil['rutas'])}")
+    if args.salida:
+        resultado["resultados"].to_csv(args.salida, index=False)
+        print(f"   > Resultados guardados en {args.salida}")
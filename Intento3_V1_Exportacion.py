@@ -0,0 +1,251 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Exportacion.py
+
+import os
+import sys
+import math
+import time
+import numbers
+
+# --- EXPORTACIÓN EN STREAMING DE LOS RESULTADOS ---
+# Una fila por ticker en cuanto termina (ratios, diferencias con las referencias, listas del Gatekeeper y análisis IA),
+# escrita a la vez en:
+#   - Excel con xlsxwriter en modo 'constant_memory' (cada fila se vuelca a disco al pasar a la siguiente)
+#   - Parquet con un ParquetWriter de pyarrow (un row group cada 'filas_por_grupo' filas)
+# La memoria no crece con el número de filas. Quien abre la exportación la cierra en un 'finally':
+# si la ejecución se interrumpe (error, st.stop, rerun de Streamlit), los ficheros quedan válidos con lo ya escrito.
+
+DIRECTORIO_EXPORTACIONES = os.environ.get("TFM_EXPORTACIONES_DIR", "exportaciones")
+FILAS_POR_GRUPO = 500
+
+# (columna, tipo): el tipo fija el esquema Parquet y el formato de la celda Excel
+COLUMNAS_EXPORTACION = [
+    ("Ticker", "texto"), ("Nombre", "texto"), ("Sector", "texto"), ("Subsector", "texto"),
+    ("Nivel alcanzado", "entero"),
+    ("Precio", "numero"), ("Market Cap", "numero"),
+    ("PER LTM", "ratio"), ("PER NTM", "ratio"), ("Solvencia", "ratio"),
+    ("Div Yield", "porcentaje"), ("Buyback Yield", "porcentaje"), ("Total Yield", "porcentaje"),
+    ("FCF Yield EV", "porcentaje"), ("FCF Yield MC", "porcentaje"), ("Payout", "porcentaje"),
+    ("Δ PER LTM vs Ref", "ratio"), ("Δ PER NTM vs Ref", "ratio"), ("Δ Solvencia vs Ref", "ratio"),
+    ("Δ Div Yield vs Ref", "porcentaje"), ("Δ Buyback Yield vs Ref", "porcentaje"),
+    ("Δ Total Yield vs Ref", "porcentaje"), ("Δ FCF Yield EV vs Ref", "porcentaje"),
+    ("Decisión Algoritmo", "texto"), ("Motivo", "texto"), ("Puntos Fuertes", "texto"), ("Alertas", "texto"),
+    ("Alertas Críticas", "texto"), ("Decisión IA", "texto"), ("Justificación IA", "texto"),
+]
+
+# Columna -> campo del snapshot
+CAMPOS_SNAPSHOT = {
+    "Precio": 'precio', "Market Cap": 'market_cap', "PER LTM": 'per_ltm', "PER NTM": 'per_ntm',
+    "Solvencia": 'ratio_solvencia', "Div Yield": 'div_yield', "Buyback Yield": 'buyback_yield',
+    "Total Yield": 'total_yield', "FCF Yield EV": 'fcf_yield_ev', "FCF Yield MC": 'fcf_yield_mc',
+    "Payout": 'payout_ratio',
+}
+
+# Columna -> (campo del snapshot, columna de referencia, divisor de la referencia: las Ref_* de yields están en %)
+DIFERENCIAS_REFERENCIA = {
+    "Δ PER LTM vs Ref": ('per_ltm', 'Ref_PER_LTM_Mediana', 1),
+    "Δ PER NTM vs Ref": ('per_ntm', 'Ref_PER_NTM_Mediana', 1),
+    "Δ Solvencia vs Ref": ('ratio_solvencia', 'Ref_Solvencia_Mediana', 1),
+    "Δ Div Yield vs Ref": ('div_yield', 'Ref_Div_Yield_Mediana', 100),
+    "Δ Buyback Yield vs Ref": ('buyback_yield', 'Ref_Buyback_Yield_Mediana', 100),
+    "Δ Total Yield vs Ref": ('total_yield', 'Ref_Total_Yield', 100),
+    "Δ FCF Yield EV vs Ref": ('fcf_yield_ev', 'Ref_FCF_Yield_Mediana', 100),
+}
+
+_ANCHOS_EXCEL = {"texto": 18, "entero": 8, "numero": 14, "ratio": 10, "porcentaje": 10}
+
+
+def valor_numerico(valor, defecto=None):
+    """
+    float finito o 'defecto' ('N/A', NaN y el centinela sys.float_info.max de la solvencia no son datos).
+    Criterio común de la exportación, el historial y los pares.
+    """
+    if isinstance(valor, bool) or not isinstance(valor, numbers.Real):
+        return defecto
+    valor = float(valor)
+    if not math.isfinite(valor) or valor == sys.float_info.max:
+        return defecto
+    return valor
+
+
+def _texto(valor):
+    if valor is None or valor == "" or (isinstance(valor, float) and math.isnan(valor)):
+        return None
+    return str(valor)
+
+
+def fila_exportacion(ticker, referencia=None, datos=None, informe=None, decision_ia=None, justificacion_ia=None,
+                     nivel=None, decision_algoritmo=None, motivo=None):
+    """
+    Fila plana de un ticker con el esquema de COLUMNAS_EXPORTACION.
+    'datos' puede ser el snapshot completo o solo la cotización básica (los ratios que falten quedan vacíos).
+    'decision_algoritmo' y 'motivo' se usan cuando no hay informe del Gatekeeper (p.ej. descartes del prefiltro).
+    """
+    referencia = referencia if referencia is not None else {}
+    datos = datos or {}
+    fila = {"Ticker": ticker, "Nombre": _texto(referencia.get('Nombre')), "Sector": _texto(referencia.get('Sector')),
+            "Subsector": _texto(referencia.get('Subsector')), "Nivel alcanzado": nivel}
+
+    for columna, campo in CAMPOS_SNAPSHOT.items():
+        fila[columna] = valor_numerico(datos.get(campo))
+    for columna, (campo, columna_ref, divisor) in DIFERENCIAS_REFERENCIA.items():
+        valor, ref = valor_numerico(datos.get(campo)), valor_numerico(referencia.get(columna_ref))
+        fila[columna] = valor - ref / divisor if valor is not None and ref is not None else None
+
+    if informe:
+        fila.update({
+            "Decisión Algoritmo": informe['decision'],
+            "Motivo": informe['motivo_principal'],
+            "Puntos Fuertes": " | ".join(informe['puntos_fuertes']),
+            "Alertas": " | ".join(informe['alertas']),
+            "Alertas Críticas": " | ".join(informe['alertas_criticas']),
+        })
+    else:
+        fila.update({"Decisión Algoritmo": _texto(decision_algoritmo), "Motivo": _texto(motivo), "Puntos Fuertes": None,
+                     "Alertas": None, "Alertas Críticas": None})
+    fila["Decisión IA"] = _texto(decision_ia)
+    fila["Justificación IA"] = _texto(justificacion_ia)
+    return fila
+
+
+def ruta_exportacion_nueva(prefijo="resultados", directorio=DIRECTORIO_EXPORTACIONES):
+    """Ruta base (sin extensión) con marca de tiempo, para no pisar exportaciones anteriores."""
+    os.makedirs(directorio, exist_ok=True)
+    return os.path.join(directorio, f"{prefijo}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+
+def abrir_exportacion(ruta_base, formatos=("xlsx", "parquet"), filas_por_grupo=FILAS_POR_GRUPO):
+    """
+    Abre los ficheros '<ruta_base>.xlsx' y/o '<ruta_base>.parquet' y devuelve el exportador (dict) para
+    exportar_fila / cerrar_exportacion. Si pyarrow no está instalado se exporta solo a Excel (con aviso).
+    """
+    exportador = {"filas": 0, "rutas": [], "libro": None, "hoja": None, "escritor_parquet": None,
+                  "pendientes": [], "filas_por_grupo": filas_por_grupo}
+
+    if "xlsx" in formatos:
+        import xlsxwriter
+
+        ruta = f"{ruta_base}.xlsx"
+        libro = xlsxwriter.Workbook(ruta, {'constant_memory': True})
+        hoja = libro.add_worksheet("Resultados")
+        formatos_celda = {"numero": libro.add_format({'num_format': '#,##0.00'}),
+                          "ratio": libro.add_format({'num_format': '0.00"x"'}),
+                          "porcentaje": libro.add_format({'num_format': '0.00%'})}
+        cabecera = libro.add_format({'bold': True, 'bg_color': '#DDEBF7', 'border': 1})
+        for j, (columna, tipo) in enumerate(COLUMNAS_EXPORTACION):
+            # En constant_memory el formato de columna se fija antes de escribir filas
+            hoja.set_column(j, j, _ANCHOS_EXCEL[tipo], formatos_celda.get(tipo))
+        hoja.write_row(0, 0, [columna for columna, _ in COLUMNAS_EXPORTACION], cabecera)
+        hoja.freeze_panes(1, 1)
+        exportador.update({"libro": libro, "hoja": hoja, "formatos_celda": formatos_celda})
+        exportador["rutas"].append(ruta)
+
+    if "parquet" in formatos:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("Aviso: pyarrow no está instalado; se exporta solo a Excel.")
+        else:
+            tipos = {"texto": pa.string(), "entero": pa.int64()}
+            esquema = pa.schema([(columna, tipos.get(tipo, pa.float64())) for columna, tipo in COLUMNAS_EXPORTACION])
+            ruta = f"{ruta_base}.parquet"
+            exportador.update({"escritor_parquet": pq.ParquetWriter(ruta, esquema), "esquema": esquema, "pa": pa})
+            exportador["rutas"].append(ruta)
+
+    return exportador
+
+
+def _volcar_grupo_parquet(exportador):
+    if exportador["pendientes"]:
+        tabla = exportador["pa"].Table.from_pylist(exportador["pendientes"], schema=exportador["esquema"])
+        exportador["escritor_parquet"].write_table(tabla)
+        exportador["pendientes"] = []
+
+
+def exportar_fila(exportador, fila):
+    """Escribe una fila (dict de fila_exportacion). Las filas se escriben en el orden en que llegan."""
+    exportador["filas"] += 1
+    if exportador["hoja"] is not None:
+        hoja, formatos_celda = exportador["hoja"], exportador["formatos_celda"]
+        for j, (columna, tipo) in enumerate(COLUMNAS_EXPORTACION):
+            valor = fila.get(columna)
+            if valor is not None:  # Celdas vacías: no se escribe nada
+                hoja.write(exportador["filas"], j, valor, formatos_celda.get(tipo))
+    if exportador["escritor_parquet"] is not None:
+        exportador["pendientes"].append(fila)
+        if len(exportador["pendientes"]) >= exportador["filas_por_grupo"]:
+            _volcar_grupo_parquet(exportador)
+
+
+def cerrar_exportacion(exportador):
+    """Vuelca lo pendiente y cierra los ficheros. Se puede llamar más de una vez. Devuelve las rutas escritas."""
+    if exportador["libro"] is not None:
+        exportador["hoja"].autofilter(0, 0, exportador["filas"], len(COLUMNAS_EXPORTACION) - 1)
+        exportador["libro"].close()
+        exportador["libro"] = exportador["hoja"] = None
+    if exportador["escritor_parquet"] is not None:
+        _volcar_grupo_parquet(exportador)
+        exportador["escritor_parquet"].close()
+        exportador["escritor_parquet"] = None
+    return exportador["rutas"]
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    import tracemalloc
+
+    import numpy as np
+    import pandas as pd
+
+    directorio_prueba = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    informe_prueba = {'decision': "NEUTRAL/PRECAUCIÓN", 'motivo_principal': "Valoración en línea con el histórico.",
+                      'puntos_fuertes': ["FCF Yield superior a la referencia"], 'alertas': ["PER LTM por encima de la mediana"],
+                      'alertas_criticas': []}
+    referencia_prueba = {'Nombre': "Empresa de prueba", 'Sector': "Consumo", 'Subsector': "Alimentación",
+                         'Ref_PER_LTM_Mediana': 18.0, 'Ref_PER_NTM_Mediana': 16.0, 'Ref_Div_Yield_Mediana': 2.5,
+                         'Ref_Buyback_Yield_Mediana': 1.0, 'Ref_Total_Yield': 3.5, 'Ref_FCF_Yield_Mediana': 4.0,
+                         'Ref_Solvencia_Mediana': 2.0}
+
+    # Ratios aleatorios generados antes de medir (solo cuenta la memoria de la exportación)
+    campos_prueba = list(CAMPOS_SNAPSHOT.values())
+    valores_prueba = rng.uniform(0, 1, (10_000, len(campos_prueba))) * 40
+    import xlsxwriter, pyarrow.parquet  # Importaciones fuera de la medida
+
+    print("\n--- 💾 EXPORTACIÓN EN STREAMING (pico de memoria de Python por nº de filas) ---")
+    for n_filas in (1_000, 10_000):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        exportador = abrir_exportacion(os.path.join(directorio_prueba, f"prueba_{n_filas}"))
+        try:
+            for k in range(n_filas):
+                datos_prueba = dict(zip(campos_prueba, valores_prueba[k].tolist()))
+                exportar_fila(exportador, fila_exportacion(f"T{k:05d}", referencia_prueba, datos_prueba, informe_prueba,
+                                                           "COMPRAR", "Justificación de prueba " * 10, nivel=3))
+        finally:
+            rutas = cerrar_exportacion(exportador)
+        duracion = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        tamanos = " | ".join(f"{os.path.basename(r)} {os.path.getsize(r) / 1e6:.1f} MB" for r in rutas)
+        print(f"   > {n_filas:>6} filas: pico {pico / 1e6:.1f} MB en {duracion:.1f}s (con tracemalloc) | {tamanos}")
+
+    # Ejecución interrumpida a mitad: los ficheros se cierran en el finally y se pueden leer
+    ruta_parcial = os.path.join(directorio_prueba, "interrumpida")
+    exportador = abrir_exportacion(ruta_parcial)
+    try:
+        for k in range(1_234):
+            exportar_fila(exportador, fila_exportacion(f"T{k:05d}", referencia_prueba, {'precio': 10.0}, informe_prueba))
+            if k == 1_233:
+                raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cerrar_exportacion(exportador)
+    print(f"   > Interrumpida: {len(pd.read_excel(ruta_parcial + '.xlsx'))} filas en Excel, "
+          f"{len(pd.read_parquet(ruta_parcial + '.parquet'))} en Parquet")
+    shutil.rmtree(directorio_prueba, ignore_errors=True)
@@ -1,11 +1,53 @@
 # NOMBRE DEL FICHERO: Intento3_V1_GateKeeper.py
 
-def ejecutar_gatekeeper(datos_reales, referencias_historicas):
+import math
+
+
+# --- UMBRALES DEL GATEKEEPER (VALORES POR DEFECTO) ---
+# Centralizados aquí para poder estudiar su sensibilidad (ver Intento3_V1_Sensibilidad.py)
+PARAMETROS_GATEKEEPER = {
+    # Fase 1: Solvencia
+    "solvencia_mult_historico": 1.3,   # Deuda creciente si supera en un 30% su referencia...
+    "solvencia_min_alerta": 2.5,       # ...y además está por encima de 2.5x
+    "solvencia_max_absoluta": 5.0,     # Deuda absoluta muy alta
+    "solvencia_balance_fuerte": 1.5,   # Balance fuerte por debajo de este ratio
+    # Fase 2: Calidad del beneficio (P/FCF vs PER LTM de Ref)
+    "calidad_mult_alerta": 1.2,
+    "calidad_mult_fuerte": 0.95,
+    # Fase 3: Valoración
+    "per_mult_descuento": 0.95,        # Infravalorada si PER <= Ref * 0.95
+    "per_mult_prima": 1.05,            # Cara si PER > Ref * 1.05
+    "fcf_mult_caro": 0.95,             # Cara por FCF si FCF Yield < Ref * 0.95
+    "crecimiento_mult": 0.95,          # Crecimiento esperado si PER NTM < PER LTM * 0.95
+    "deterioro_mult": 1.1,             # Deterioro esperado si PER NTM > PER LTM * 1.1
+    # Fase 4: Retorno al accionista
+    "yield_margen_superior": 0.01,     # 1% mejor que la historia
+    "yield_mult_bajo": 0.75,
+    "payout_saludable": 0.6,
+    "payout_insostenible": 1.0,
+    # Fase 5: Posición frente a los pares (solo con 'Percentil_Pares' en las referencias, ver Intento3_V1_Pares.py)
+    "pares_percentil_fuerte": 75.0,    # Punto fuerte si está en el cuartil superior de su sector/subsector
+    "pares_percentil_debil": 25.0,     # Alerta si está en el cuartil inferior
+    # Semáforo final
+    "comprar_max_alertas": 1,
+    "comprar_min_fuertes": 4,
+    "neutral_max_alertas": 2,
+    "neutral_min_fuertes": 3,
+    "neutral_ampliado_max_alertas": 3,
+    "neutral_ampliado_min_fuertes": 4,
+}
+
+def ejecutar_gatekeeper(datos_reales, referencias_historicas, parametros=None):
     """
     Recibe los datos de Yahoo y las referencias del Excel.
     Aplica lógica 'Quality Value' avanzada con detección de trampas de valor.
     Devuelve la decisión final y los motivos detallados.
+    'parametros' permite sobrescribir cualquiera de los umbrales de PARAMETROS_GATEKEEPER.
     """
+    p = dict(PARAMETROS_GATEKEEPER)
+    if parametros:
+        p.update(parametros)
+
     resultados = {
         "decision": "",
         "color_logico": "", 
@@ -45,13 +87,13 @@ def ejecutar_gatekeeper(datos_reales, referencias_historicas):
     if datos_reales['debug_ebitda_ttm'] - datos_reales['debug_capex_ttm'] > 0:
     
         # A. Comparación Histórica (¿Está más endeudada de lo habitual?)
-        if datos_reales['ratio_solvencia'] > (ref_solvencia * 1.3) and datos_reales['ratio_solvencia'] > 2.5:
+        if datos_reales['ratio_solvencia'] > (ref_solvencia * p['solvencia_mult_historico']) and datos_reales['ratio_solvencia'] > p['solvencia_min_alerta']:
             resultados['alertas'].append(f"⚠️ Deuda Creciente: Net Debt / (EBITDA - Capex) (LTM): {datos_reales['ratio_solvencia']:.1f}x (Histórico: {ref_solvencia:.1f}x)")
         
         # B. Límite Absoluto (¿Es demasiada deuda para cualquiera?)
-        if datos_reales['ratio_solvencia'] > 5.0:
-            resultados['alertas'].append(f"⚠️ Deuda Absoluta Muy Alta: Net Debt / (EBITDA - Capex) (LTM): {datos_reales['ratio_solvencia']:.1f}x (>5x es arriesgado).")
-        elif datos_reales['ratio_solvencia'] < 1.5:
+        if datos_reales['ratio_solvencia'] > p['solvencia_max_absoluta']:
+            resultados['alertas'].append(f"⚠️ Deuda Absoluta Muy Alta: Net Debt / (EBITDA - Capex) (LTM): {datos_reales['ratio_solvencia']:.1f}x (>{p['solvencia_max_absoluta']:g}x es arriesgado).")
+        elif datos_reales['ratio_solvencia'] < p['solvencia_balance_fuerte']:
             resultados['puntos_fuertes'].append(f"✅ Balance Fuerte: posee un ratio de endeudamiento Net Debt / (EBITDA - Capex) (LTM) reducido ({datos_reales['ratio_solvencia']:.1f}x).")
 
     # Si EBITDA - Capex es cero o negativo, no podemos calcular ratio de solvencia fiable
@@ -72,25 +114,25 @@ def ejecutar_gatekeeper(datos_reales, referencias_historicas):
     p_fcf_implicito = 1 / datos_reales['fcf_yield_mc'] if datos_reales['fcf_yield_mc'] > 0 else 99
     
     # Si el PER es 15x pero el P/FCF es 30x, el beneficio es "de papel", no entra caja.
-    if p_fcf_implicito > (ref_per_ltm * 1.2):
+    if p_fcf_implicito > (ref_per_ltm * p['calidad_mult_alerta']):
         resultados['alertas'].append(f"⚠️ Calidad Baja del Beneficio contable por generación de caja mermada, es decir, P/FCF caro ({p_fcf_implicito:.1f}x) vs PER NTM de Ref: ({ref_per_ltm:.1f}).")
-    elif p_fcf_implicito < (ref_per_ltm * 0.95):
+    elif p_fcf_implicito < (ref_per_ltm * p['calidad_mult_fuerte']):
         resultados['puntos_fuertes'].append(f"✅ Calidad Alta de Beneficio contable: mejor generacion de caja real P/FCF ({p_fcf_implicito:.1f}x) vs PER LTM de Ref: ({ref_per_ltm:.1f}).")
 
     # --- FASE 3: FILTRO DE VALORACIÓN (PRECIO) ---
     
     # A.1 PER NTM vs PER NTM Histórico
-    if datos_reales['per_ntm'] <= ref_per_ntm * 0.95:
+    if datos_reales['per_ntm'] <= ref_per_ntm * p['per_mult_descuento']:
         descuento = (1 - (datos_reales['per_ntm'] / ref_per_ntm)) * 100
         resultados['puntos_fuertes'].append(f"✅ Infravalorada por PER NTM: {datos_reales['per_ntm']:.1f}x (Descuento {descuento:.0f}%) respecto al PER NTM de Ref: {ref_per_ntm:.1f}x.")
-    elif datos_reales['per_ntm'] > ref_per_ntm * 1.05:
+    elif datos_reales['per_ntm'] > ref_per_ntm * p['per_mult_prima']:
         resultados['alertas'].append(f"PER NTM Elevado: {datos_reales['per_ntm']:.1f}x vs PER NTM de Ref: {ref_per_ntm:.1f}x.")
 
     # A.2 PER LTM vs PER LTM Histórico
-    if datos_reales['per_ltm'] <= ref_per_ltm * 0.95 and datos_reales['per_ltm'] > 0: # Evitamos punto fuerte si PER LTM es negativo
+    if datos_reales['per_ltm'] <= ref_per_ltm * p['per_mult_descuento'] and datos_reales['per_ltm'] > 0: # Evitamos punto fuerte si PER LTM es negativo
         descuento = (1 - (datos_reales['per_ltm'] / ref_per_ltm)) * 100
         resultados['puntos_fuertes'].append(f"✅ Infravalorada por PER LTM: {datos_reales['per_ltm']:.1f}x (Descuento {descuento:.0f}%) respecto al PER LTM de Ref: {ref_per_ltm:.1f}x.")
-    elif datos_reales['per_ltm'] > ref_per_ltm * 1.05 and datos_reales['per_ltm'] > 0: # Evitamos alerta si PER LTM es negativo (ya avisamos antes)
+    elif datos_reales['per_ltm'] > ref_per_ltm * p['per_mult_prima'] and datos_reales['per_ltm'] > 0: # Evitamos alerta si PER LTM es negativo (ya avisamos antes)
         resultados['alertas'].append(f"PER LTM Elevado: {datos_reales['per_ltm']:.1f}x vs PER LTM de Ref: {ref_per_ltm:.1f}x.")
 
     # B. FCF Yield vs Histórico
@@ -99,10 +141,10 @@ def ejecutar_gatekeeper(datos_reales, referencias_historicas):
     
     # C. Crecimiento (Forward vs Trailing)
     # Si PER NTM es menor que LTM, el mercado espera crecimiento de beneficios
-    if datos_reales['per_ntm'] < (datos_reales['per_ltm'] * 0.95):
+    if datos_reales['per_ntm'] < (datos_reales['per_ltm'] * p['crecimiento_mult']):
          crecimiento = ((datos_reales['per_ltm'] - datos_reales['per_ntm']) / datos_reales['per_ltm']) * 100
          resultados['puntos_fuertes'].append(f"✅ Crecimiento Esperado: Analistas prevén aumento de beneficios del {crecimiento:.0f}% en los próximos 12 meses.")
-    elif datos_reales['per_ntm'] > (datos_reales['per_ltm'] * 1.1) and datos_reales['per_ltm'] > 0: # Evitamos alerta si PER LTM es negativo (ya avisamos antes)
+    elif datos_reales['per_ntm'] > (datos_reales['per_ltm'] * p['deterioro_mult']) and datos_reales['per_ltm'] > 0: # Evitamos alerta si PER LTM es negativo (ya avisamos antes)
          resultados['alertas'].append("⚠️ Posible Deterioro Esperado: Analistas prevén caída de beneficios.")
 
     # --- FASE 4: FILTRO DE RETORNO (SHAREHOLDER YIELD) ---
@@ -111,27 +153,37 @@ def ejecutar_gatekeeper(datos_reales, referencias_historicas):
     total_yield = datos_reales['div_yield'] + datos_reales['buyback_yield']
     ref_yield = referencias_historicas.get('Ref_Total_Yield', 3)/100  # Pasamos de % a decimal
     
-    if total_yield > (ref_yield + 0.01): # 1% mejor que la historia
+    if total_yield > (ref_yield + p['yield_margen_superior']): # 1% mejor que la historia
         resultados['puntos_fuertes'].append(f"✅ Retorno Total Superior: {total_yield:.1%} (Div + Recompras) vs Histórico {ref_yield:.1%}.")
-    elif total_yield < (ref_yield * 0.75):
+    elif total_yield < (ref_yield * p['yield_mult_bajo']):
         resultados['alertas'].append(f"Retorno Bajo: {total_yield:.1%} (Div + Recompras)vs Histórico {ref_yield:.1%}.")
 
     # B. Payout Ratio: Sostenibilidad del dividendo
     if datos_reales['payout_ratio'] != "N/A":
-        if datos_reales['payout_ratio'] < 0.6:
+        if datos_reales['payout_ratio'] < p['payout_saludable']:
             resultados['puntos_fuertes'].append(f"✅ Payout Ratio Saludable: {datos_reales['payout_ratio']:.1%}, lo que indica sostenibilidad en el dividendo.")
-        elif datos_reales['payout_ratio'] > 1.0:
+        elif datos_reales['payout_ratio'] > p['payout_insostenible']:
             resultados['alertas'].append(f"⚠️ Payout Ratio Insostenible para los últimos 12 meses: {datos_reales['payout_ratio']:.1%}, la empresa paga más en dividendos de lo que genera en FCF.")
 
+    # --- FASE 5: POSICIÓN FRENTE A LOS PARES (SECTOR / SUBSECTOR) ---
+    # Percentil compuesto de PER, FCF Yield, Yield total y solvencia entre los pares (100 = la mejor del grupo)
+    percentil_pares = referencias_historicas.get('Percentil_Pares', float("nan"))
+    if isinstance(percentil_pares, float) and not math.isnan(percentil_pares):
+        grupo_pares = referencias_historicas.get('Grupo_Pares', "sus pares")
+        if percentil_pares >= p['pares_percentil_fuerte']:
+            resultados['puntos_fuertes'].append(f"✅ Mejor que sus Pares: percentil {percentil_pares:.0f} en valoración, caja, retorno y solvencia frente al {grupo_pares}.")
+        elif percentil_pares <= p['pares_percentil_debil']:
+            resultados['alertas'].append(f"⚠️ Peor que sus Pares: percentil {percentil_pares:.0f} en valoración, caja, retorno y solvencia frente al {grupo_pares}.")
+
     # --- DECISIÓN FINAL Y LÓGICA DE SEMÁFORO ---
     num_puntos_fuertes = len(resultados['puntos_fuertes'])
     num_alertas = len(resultados['alertas'])
     num_alertas_criticas = len(resultados['alertas_criticas'])
     
     # Regla de Descarte por Valoración Pura (Si está cara por todos lados)
-    esta_cara_per_ltm = datos_reales['per_ltm'] > (ref_per_ltm * 1.05) or datos_reales['per_ltm'] <= 0
-    esta_cara_per_ntm = datos_reales['per_ntm'] > (ref_per_ntm * 1.05) or datos_reales['per_ntm'] <= 0
-    esta_cara_fcf = datos_reales['fcf_yield_ev'] < (ref_fcf_ev * 0.95) or datos_reales['fcf_yield_ev'] <= 0
+    esta_cara_per_ltm = datos_reales['per_ltm'] > (ref_per_ltm * p['per_mult_prima']) or datos_reales['per_ltm'] <= 0
+    esta_cara_per_ntm = datos_reales['per_ntm'] > (ref_per_ntm * p['per_mult_prima']) or datos_reales['per_ntm'] <= 0
+    esta_cara_fcf = datos_reales['fcf_yield_ev'] < (ref_fcf_ev * p['fcf_mult_caro']) or datos_reales['fcf_yield_ev'] <= 0
     no_crece = datos_reales['per_ntm'] >= datos_reales['per_ltm'] or datos_reales['per_ntm'] <= 0
     
     if esta_cara_per_ltm and esta_cara_per_ntm and esta_cara_fcf and no_crece:
@@ -141,17 +193,17 @@ def ejecutar_gatekeeper(datos_reales, referencias_historicas):
         return resultados
 
     # Evaluación de Riesgo vs Recompensa
-    if num_alertas_criticas == 0 and num_alertas <= 1 and num_puntos_fuertes >= 4:
+    if num_alertas_criticas == 0 and num_alertas <= p['comprar_max_alertas'] and num_puntos_fuertes >= p['comprar_min_fuertes']:
         resultados['decision'] = "COMPRAR"
         resultados['color_logico'] = "green"
         resultados['motivo_principal'] = "Buena combinación de Calidad Y Precio."
 
-    elif num_alertas_criticas == 0 and num_alertas <= 2 and num_puntos_fuertes >= 3:
+    elif num_alertas_criticas == 0 and num_alertas <= p['neutral_max_alertas'] and num_puntos_fuertes >= p['neutral_min_fuertes']:
         resultados['decision'] = "NEUTRAL/PRECAUCIÓN" # Es buena, pero tiene alguna "pega"
         resultados['color_logico'] = "orange"
         resultados['motivo_principal'] = "Valoración neutral o con riesgos moderados (ver alertas)."
 
-    elif num_alertas_criticas == 0 and num_alertas <= 3 and num_puntos_fuertes >= 4:
+    elif num_alertas_criticas == 0 and num_alertas <= p['neutral_ampliado_max_alertas'] and num_puntos_fuertes >= p['neutral_ampliado_min_fuertes']:
         resultados['decision'] = "NEUTRAL/PRECAUCIÓN" # Es buena, pero tiene alguna "pega"
         resultados['color_logico'] = "orange"
         resultados['motivo_principal'] = "Valoración neutral o con riesgos moderados (ver alertas)."
@@ -163,3 +215,77 @@ def ejecutar_gatekeeper(datos_reales, referencias_historicas):
         
 
     return resultados
+
+
+def prefiltro_cotizacion(cotizacion, referencias_historicas, parametros=None):
+    """
+    Nivel 1 del embudo (ver Intento3_V1_Embudo.py): con solo la cotización básica (precio, PER NTM,
+    PER LTM de Yahoo y Dividend Yield) descarta únicamente lo que el Gatekeeper completo descartaría
+    sean cuales sean los campos que aún no se conocen (FCF, recompras, solvencia, payout): la Fase 0
+    de pérdidas actuales y previstas. Cualquier otra regla depende de esos campos (p.ej. la de
+    sobrevaloración tiene una pata de FCF) y se deja para el nivel 2.
+    Supone que el PER LTM de Yahoo (trailingPE / epsTrailingTwelveMonths) tiene el mismo signo que el
+    beneficio neto TTM de los estados trimestrales con el que lo calcula el Gatekeeper. Suele ser así,
+    pero no está garantizado (extraordinarios, reexpresiones, trimestres aún no publicados en los
+    estados): si no coinciden, el prefiltro puede descartar un ticker que el Gatekeeper no descartaría.
+    'parametros' se acepta por simetría con el Gatekeeper.
+    Devuelve (descartar, motivo).
+    """
+    per_ltm, per_ntm = cotizacion['per_ltm'], cotizacion['per_ntm']
+    # Sin PER (dato ausente, no pérdidas) no hay base para descartar: pasa al nivel 2
+    if per_ltm is None or per_ntm is None:
+        return False, ""
+
+    # Fase 0: pérdidas actuales y previstas (DESCARTAR inmediato en el Gatekeeper completo)
+    if per_ltm <= 0 and per_ntm <= 0:
+        return True, "Pérdidas estructurales: EPS negativo actual y previsto."
+    return False, ""
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import random
+    # Las funciones se toman del módulo importado (no de __main__), igual que las usa el embudo
+    from Intento3_V1_GateKeeper import ejecutar_gatekeeper, prefiltro_cotizacion
+
+    # Comprobación: con los mismos PER en la cotización y en el snapshot, nada de lo que descarta el prefiltro
+    # obtiene otra decisión que DESCARTAR en el Gatekeeper completo, sean cuales sean el resto de campos (FCF,
+    # recompras, solvencia y referencias aleatorios). Es decir: el prefiltro no depende de nada que el nivel 1
+    # no conozca. La coincidencia de signo entre el EPS de Yahoo y los estados trimestrales es un supuesto
+    # (ver prefiltro_cotizacion): abajo se cuenta lo que cambia cuando el PER LTM del snapshot es independiente.
+    aleatorio = random.Random(0)
+    descartados, contraejemplos, discrepancias = 0, [], 0
+    for _ in range(20_000):
+        ebitda, capex = aleatorio.uniform(-1e9, 5e9), aleatorio.uniform(0, 2e9)
+        datos = {
+            'per_ltm': aleatorio.choice([-1.0, 0.0, aleatorio.uniform(1, 60)]),
+            'per_ntm': aleatorio.choice([-5.0, 0.0, aleatorio.uniform(1, 60)]),
+            'fcf_yield_ev': aleatorio.uniform(-0.05, 0.15), 'fcf_yield_mc': aleatorio.uniform(-0.05, 0.15),
+            # Como en Intento3_V1_Obtener_Datos: "N/A" cuando EBITDA - Capex no es positivo
+            'ratio_solvencia': aleatorio.uniform(-1, 8) if ebitda - capex > 0 else "N/A",
+            'debug_ebitda_ttm': ebitda, 'debug_capex_ttm': capex,
+            'div_yield': aleatorio.uniform(0, 0.08), 'buyback_yield': aleatorio.uniform(-0.02, 0.1),
+            'payout_ratio': aleatorio.choice(["N/A", aleatorio.uniform(0, 1.5)]),
+        }
+        referencias = {'Ref_Solvencia_Mediana': aleatorio.uniform(0.5, 4), 'Ref_PER_LTM_Mediana': aleatorio.uniform(8, 30),
+                       'Ref_PER_NTM_Mediana': aleatorio.uniform(8, 30), 'Ref_FCF_Yield_Mediana': aleatorio.uniform(2, 8),
+                       'Ref_Total_Yield': aleatorio.uniform(1, 8)}
+        cotizacion = {'per_ltm': datos['per_ltm'], 'per_ntm': datos['per_ntm'], 'div_yield': datos['div_yield']}
+        descartar, _ = prefiltro_cotizacion(cotizacion, referencias)
+        if descartar:
+            descartados += 1
+            decision = ejecutar_gatekeeper(datos, referencias)['decision']
+            if decision != "DESCARTAR":
+                contraejemplos.append((datos, referencias, decision))
+            # Mismo ticker con un beneficio neto TTM de los estados de signo independiente del EPS de Yahoo
+            per_estados = aleatorio.choice([-1.0, aleatorio.uniform(1, 60)])
+            if ejecutar_gatekeeper(dict(datos, per_ltm=per_estados), referencias)['decision'] != "DESCARTAR":
+                discrepancias += 1
+    print(f"Prefiltro: {descartados} descartados de 20000 snapshots aleatorios; "
+          f"con otra decisión en el Gatekeeper completo: {len(contraejemplos)}")
+    assert not contraejemplos, contraejemplos[:3]
+    print(f"Con el PER LTM de los estados de signo independiente del de Yahoo, el Gatekeeper no descartaría "
+          f"{discrepancias} de los {descartados}: el prefiltro solo es exacto si los signos coinciden")
+
@@ -1,10 +1,20 @@
 # NOMBRE DEL FICHERO: Intento3_V1_Gestor_IA.py
 
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
+import os
+import re
+import json
+import time
+
+from Intento3_V1_Tokens import (contar_tokens, compactar_espacios, ajustar_prompt_a_presupuesto, calcular_coste,
+                                presupuesto_disponible, presupuesto_agotado, tokenizador_gemini)
+from Intento3_V1_Plazos import PLAZOS_POR_DEFECTO, llamar_con_plazo, restante
+
+# Usamos 'gemini-3-flash-preview' ó gemini-2.5-flash' o 'gemini-2.5-flash-lite'
+MODELO_GEMINI = 'gemini-3-flash-preview'
 
 # --- 1. CONFIGURACIÓN DE PERSONALIDAD Y FORMATO (CONSTANTE) ---
-INSTRUCCIONES_DEL_SISTEMA = """
+# Perfil del analista (común a todos los modos de respuesta)
+PERFIL_ANALISTA = """
 Eres un Analista de Inversiones Senior experto en la estrategia 'Quality Value' y gestión de riesgos.
 
 TU TAREA:
@@ -17,7 +27,10 @@ TU FILOSOFÍA DE INVERSIÓN:
 4. ANÁLISIS DE LA TENDENCIA DE BENEFICIOS (CRÍTICO): Analiza la relación entre PER LTM y PER NTM:
     4.1.CASO CRECIMIENTO (PER NTM < PER LTM): Interpreta esto como una expectativa de mejora operativa o crecimiento de beneficios. No menciones "no deterioro" o similares en este caso; habla de "expansión de beneficios" o "mejora de eficiencia".
     4.2.CASO CONTRACCIÓN (PER NTM > PER LTM): Aquí sí debes activar tu alerta de riesgo y confirmar si realmente es un riesgo. Distingue si la caída de beneficio futuro es por (1) deterioro real, (2) normalización tras un año extraordinario (one-off) o (3) problema temporal. **NO asumas automáticamente un deterioro real**, antes debes **INVESTIGAR A FONDO LA CAÍDA DEL BENEFICIO EN FUENTES FIABLES** para incluir el motivo en la JUSTIFICACIÓN.
+"""
 
+# Formato libre en Markdown (modo clásico)
+FORMATO_MARKDOWN = """
 FORMATO DE RESPUESTA OBLIGATORIO (IMPORTANTE: USA MARKDOWN):
 - Usa títulos grandes (###) para las secciones principales.
 - Usa listas con viñetas (-) para los puntos.
@@ -57,72 +70,160 @@ ESTRUCTURA DE RESPUESTA OBLIGATORIA (Sigue este esquema visual):
             - TEMPORALIDAD: Para empresas de alta calidad los buenos momentos de compra se dan cuando se producen problemas temporales. Si estamos ante un problema temporal en una empresa de calidad la decisión debe tender a COMPRAR.
 """
 
+INSTRUCCIONES_DEL_SISTEMA = PERFIL_ANALISTA + FORMATO_MARKDOWN
+
+# Formato estructurado en JSON (modo_estructurado=True): el Markdown se pinta en local
+FORMATO_JSON = """
+FORMATO DE RESPUESTA OBLIGATORIO (JSON):
+Responde ÚNICAMENTE con un objeto JSON que cumpla el esquema indicado, sin Markdown ni texto adicional.
+- "decision": exactamente COMPRAR, NEUTRAL/PRECAUCIÓN o DESCARTAR. A la hora de tomar la decisión, considera la información cuantitativa y la ponderación entre Puntos Fuertes y Débiles enviados por el algoritmo, si está cara o barata por valoración (especialmente PER NTM respecto al PER NTM de Referencia) y la causa del descuento (Oportunidad vs Trampa de Valor). Si la empresa está cara, no recomiendes COMPRAR aunque sea de alta calidad; si es un problema temporal en una empresa de calidad, la decisión debe tender a COMPRAR.
+- "justificacion": máximo 100 palabras, concisa y directa, siguiendo el punto "4" de "TU FILOSOFÍA DE INVERSIÓN". Si una alerta incluye "Requiere investigación más profunda", investiga tú el motivo; NO le pidas al usuario que investigue.
+- "puntos_fuertes" y "puntos_debiles": frases cortas que empiecen por su categoría seguida de dos puntos (Calidad del Beneficio y Generación de FCF / Dividendos y Recompras / Deuda / Otros (Noticias/Contexto)).
+"""
+
+INSTRUCCIONES_DEL_SISTEMA_JSON = PERFIL_ANALISTA + FORMATO_JSON
+
+DECISIONES_VALIDAS = ["COMPRAR", "NEUTRAL/PRECAUCIÓN", "DESCARTAR"]
+
+# Decisión cuando no se llama a la IA por falta de presupuesto de tokens (queda la del Gatekeeper)
+DECISION_SIN_PRESUPUESTO = "🧮 SIN PRESUPUESTO"
+TEXTO_SIN_PRESUPUESTO = "🧮 Presupuesto de tokens agotado: no se ha llamado a la IA y se mantiene la decisión del Gatekeeper."
+
+# Decisión cuando se agota el tiempo de la ejecución antes (o durante) el análisis IA (queda la del Gatekeeper)
+DECISION_SIN_TIEMPO = "⏱️ SIN TIEMPO"
+TEXTO_SIN_TIEMPO = "⏱️ Se agotó el tiempo de la ejecución: solo se ha aplicado el Gatekeeper."
+
+# Esquema de respuesta (subconjunto OpenAPI que admite Gemini)
+ESQUEMA_RESPUESTA = {
+    "type": "object",
+    "properties": {
+        "decision": {"type": "string", "enum": DECISIONES_VALIDAS},
+        "justificacion": {"type": "string"},
+        "puntos_fuertes": {"type": "array", "items": {"type": "string"}},
+        "puntos_debiles": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["decision", "justificacion", "puntos_fuertes", "puntos_debiles"],
+}
+
+# Presupuesto de tokens de salida en modo estructurado (incluye el razonamiento interno del modelo)
+MAX_TOKENS_SALIDA_JSON = 2048
+
+# --- 1.1 MODO POR LOTES (varias empresas en una sola petición) ---
+# Cada empresa va en su sección delimitada; la respuesta se trocea por las mismas marcas.
+MARCA_EMPRESA = "<<<EMPRESA: {ticker}>>>"
+PATRON_MARCA_EMPRESA = re.compile(r"<<<\s*EMPRESA:\s*([^>\s]+)\s*>>>")
+PATRON_FIN_EMPRESA = re.compile(r"<<<\s*FIN EMPRESA[^>]*>>>")
+
+FORMATO_LOTE_MARKDOWN = """
+MODO LOTE (VARIAS EMPRESAS):
+Recibirás varias empresas, cada una entre las líneas <<<EMPRESA: TICKER>>> y <<<FIN EMPRESA: TICKER>>>.
+Analiza cada empresa POR SEPARADO y de forma independiente (no compares entre ellas).
+Para cada empresa, escribe primero una línea con su marca exacta <<<EMPRESA: TICKER>>> y a continuación
+la ESTRUCTURA DE RESPUESTA OBLIGATORIA completa. Respeta el orden de entrada y no omitas ninguna empresa.
+"""
+
+FORMATO_LOTE_JSON = """
+MODO LOTE (VARIAS EMPRESAS):
+Recibirás varias empresas, cada una entre las líneas <<<EMPRESA: TICKER>>> y <<<FIN EMPRESA: TICKER>>>.
+Analiza cada empresa POR SEPARADO y devuelve un objeto JSON con la lista "analisis": un elemento por empresa,
+con su "ticker" exacto y los mismos campos descritos arriba. Respeta el orden de entrada y no omitas ninguna empresa.
+"""
+
+ESQUEMA_RESPUESTA_LOTE = {
+    "type": "object",
+    "properties": {
+        "analisis": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"ticker": {"type": "string"}, **ESQUEMA_RESPUESTA["properties"]},
+                "required": ["ticker"] + ESQUEMA_RESPUESTA["required"],
+            },
+        },
+    },
+    "required": ["analisis"],
+}
+
+TAMANO_LOTE_POR_DEFECTO = 5
+
 # --- 2. CONFIGURACIÓN DE SEGURIDAD ---
 # Permite que la IA hable de temas financieros "sensibles" sin bloquearse
+# (por nombre: la librería los traduce a sus enums y así no hace falta importarla al cargar el módulo)
 CONFIGURACION_SEGURIDAD = {
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
+    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
+    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
 }
 
-def generar_analisis_gemini(api_key, ticker, datos_financieros, informe_gatekeeper):
+def _configurar_gemini(api_key):
     """
-    Construye el prompt avanzado y solicita el análisis a Gemini.
+    Autentica el cliente de Gemini y devuelve el módulo 'genai'.
+    Si existe la variable de entorno GEMINI_API_ENDPOINT (p.ej. el stub local de Intento3_V1_Stubs.py),
+    las peticiones se dirigen a ese servidor por REST en lugar de a Google.
+    La librería se importa aquí y no al cargar el módulo: es de las más lentas de importar
+    y la interfaz no la necesita hasta llegar a la fase de IA.
     """
-    if not api_key:
-        return "⚠️ Error: No se ha proporcionado una API Key de Google Gemini."
+    import google.generativeai as genai
 
-    try:
-        # A. Autenticación
+    endpoint = os.environ.get("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+    else:
         genai.configure(api_key=api_key)
-        
-        # B. Inicialización del Modelo con Instrucciones del Sistema
-        # Usamos 'gemini-3-flash-preview' ó gemini-2.5-flash' o 'gemini-2.5-flash-lite'
-        model = genai.GenerativeModel(
-            model_name='gemini-3-flash-preview',
-            system_instruction=INSTRUCCIONES_DEL_SISTEMA
-        )
+    return genai
 
-        # C. Preparación de Datos para el Prompt
-        
-        # 1. Noticias
-        lista_noticias = datos_financieros.get('noticias', [])
-        texto_noticias = "\n- " + "\n- ".join(lista_noticias) if lista_noticias else "No hay noticias recientes relevantes."
-
-        # 2. Factores Técnicos (Alertas y Puntos Fuertes del Gatekeeper)
-        factores_gatekeeper = ""
-        if informe_gatekeeper['puntos_fuertes']:
-            factores_gatekeeper += "\nPUNTOS A FAVOR DETECTADOS:\n- " + "\n- ".join(informe_gatekeeper['puntos_fuertes']) + "\n"
-        if informe_gatekeeper['alertas']:
-            factores_gatekeeper += "\nALERTAS AUTOMÁTICAS MODERADAS:\n- " + "\n- ".join(informe_gatekeeper['alertas'])
-        if informe_gatekeeper['alertas_criticas']:
-            factores_gatekeeper += "\nALERTAS AUTOMÁTICAS CRÍTICAS:\n- " + "\n- ".join(informe_gatekeeper['alertas_criticas'])
-     
-        # --- CORRECCIÓN DE FORMATOS (Sanitización de "N/A") ---
-        # Antes de crear el f-string, preparamos las variables para que no den error si son texto ("N/A")
-        def safe_fmt(valor, formato=".2f", sufijo=""):
-            if isinstance(valor, (int, float)):
-                return f"{valor:{formato}}{sufijo}"
-            return str(valor) # Si es "N/A", devuelve "N/A" sin intentar formatear decimales
-
-        str_precio = safe_fmt(datos_financieros['precio'], ".2f")
-        # Formateos específicos para PER LTM (puede ser negativo)
-        if datos_financieros['per_ltm'] == -1.0:
-            str_per_ltm = "Negativo"
-        else:
-            str_per_ltm = safe_fmt(datos_financieros['per_ltm'], ".1f", "x")
-        
-        str_per_ntm = safe_fmt(datos_financieros['per_ntm'], ".1f", "x")
-        str_div = safe_fmt(datos_financieros['div_yield'], ".2%")
-        str_buyback = safe_fmt(datos_financieros['buyback_yield'], ".2%")
-        str_fcf_mc = safe_fmt(datos_financieros['fcf_yield_mc'], ".2%")
-        str_payout = safe_fmt(datos_financieros['payout_ratio'], ".2%")
-        str_fcf_ev = safe_fmt(datos_financieros['fcf_yield_ev'], ".2%")
-        str_solvencia = safe_fmt(datos_financieros['ratio_solvencia'], ".2f", "x")
-             
-        # --- D. CONSTRUCCIÓN DEL PROMPT DE USUARIO (EL CASO ESPECÍFICO) ---
-        prompt_usuario = f"""
+
+def tokenizador_exacto(api_key):
+    """
+    Tokenizador con el recuento real de Gemini (countTokens) para Intento3_V1_Tokens.configurar_tokenizador.
+    """
+    genai = _configurar_gemini(api_key)
+    return tokenizador_gemini(genai.GenerativeModel(model_name=MODELO_GEMINI))
+
+
+def _construir_prompt_usuario(ticker, datos_financieros, informe_gatekeeper, noticias=None, compacto=False):
+    """
+    Construye el prompt específico de la empresa (datos, alertas del Gatekeeper y noticias).
+    'noticias' permite pasar una lista recortada y 'compacto' elimina sangrías y líneas vacías.
+    """
+    # 1. Noticias
+    lista_noticias = datos_financieros.get('noticias', []) if noticias is None else noticias
+    texto_noticias = "\n- " + "\n- ".join(lista_noticias) if lista_noticias else "No hay noticias recientes relevantes."
+
+    # 2. Factores Técnicos (Alertas y Puntos Fuertes del Gatekeeper)
+    factores_gatekeeper = ""
+    if informe_gatekeeper['puntos_fuertes']:
+        factores_gatekeeper += "\nPUNTOS A FAVOR DETECTADOS:\n- " + "\n- ".join(informe_gatekeeper['puntos_fuertes']) + "\n"
+    if informe_gatekeeper['alertas']:
+        factores_gatekeeper += "\nALERTAS AUTOMÁTICAS MODERADAS:\n- " + "\n- ".join(informe_gatekeeper['alertas'])
+    if informe_gatekeeper['alertas_criticas']:
+        factores_gatekeeper += "\nALERTAS AUTOMÁTICAS CRÍTICAS:\n- " + "\n- ".join(informe_gatekeeper['alertas_criticas'])
+ 
+    # --- CORRECCIÓN DE FORMATOS (Sanitización de "N/A") ---
+    # Antes de crear el f-string, preparamos las variables para que no den error si son texto ("N/A")
+    def safe_fmt(valor, formato=".2f", sufijo=""):
+        if isinstance(valor, (int, float)):
+            return f"{valor:{formato}}{sufijo}"
+        return str(valor) # Si es "N/A", devuelve "N/A" sin intentar formatear decimales
+
+    str_precio = safe_fmt(datos_financieros['precio'], ".2f")
+    # Formateos específicos para PER LTM (puede ser negativo)
+    if datos_financieros['per_ltm'] == -1.0:
+        str_per_ltm = "Negativo"
+    else:
+        str_per_ltm = safe_fmt(datos_financieros['per_ltm'], ".1f", "x")
+    
+    str_per_ntm = safe_fmt(datos_financieros['per_ntm'], ".1f", "x")
+    str_div = safe_fmt(datos_financieros['div_yield'], ".2%")
+    str_buyback = safe_fmt(datos_financieros['buyback_yield'], ".2%")
+    str_fcf_mc = safe_fmt(datos_financieros['fcf_yield_mc'], ".2%")
+    str_payout = safe_fmt(datos_financieros['payout_ratio'], ".2%")
+    str_fcf_ev = safe_fmt(datos_financieros['fcf_yield_ev'], ".2%")
+    str_solvencia = safe_fmt(datos_financieros['ratio_solvencia'], ".2f", "x")
+         
+    # --- CONSTRUCCIÓN DEL PROMPT DE USUARIO (EL CASO ESPECÍFICO) ---
+    prompt_usuario = f"""
         OBJETIVO: Validar oportunidad de inversión en **{ticker}**.
         
         1. DATOS FUNDAMENTALES (Hard Data - TTM):\n
@@ -146,71 +247,460 @@ def generar_analisis_gemini(api_key, ticker, datos_financieros, informe_gatekeep
                 
         DAME TU VEREDICTO FINAL SIGUIENDO LA ESTRUCTURA OBLIGATORIA.
         """
+    return compactar_espacios(prompt_usuario) if compacto else prompt_usuario
 
-        # E. Generación
 
-        generation_conf = genai.types.GenerationConfig(
-            temperature=0.0, 
-            candidate_count=1
+def _contabilizar_tokens(ticker, tokens_sistema, prompt_usuario, texto_bruto, response, recorte):
+    """
+    Registro de consumo de una llamada. Se usa el recuento del proveedor (usage_metadata) cuando existe;
+    si no, la estimación del tokenizador local. La salida incluye el razonamiento interno del modelo.
+    """
+    tokens_usuario = contar_tokens(prompt_usuario)
+    uso = getattr(response, "usage_metadata", None)
+    entrada_proveedor = getattr(uso, "prompt_token_count", 0) or 0
+    total_proveedor = getattr(uso, "total_token_count", 0) or 0
+    salida_proveedor = (total_proveedor - entrada_proveedor) if total_proveedor else (getattr(uso, "candidates_token_count", 0) or 0)
+
+    tokens_entrada = entrada_proveedor or (tokens_sistema + tokens_usuario)
+    tokens_salida = salida_proveedor or contar_tokens(texto_bruto)
+
+    return {
+        "ticker": ticker,
+        "tokens_sistema": tokens_sistema,
+        "tokens_usuario": tokens_usuario,
+        "tokens_entrada": tokens_entrada,
+        "tokens_salida": tokens_salida,
+        "fuente": "proveedor" if entrada_proveedor else "estimado",
+        "compactado": recorte["compactado"],
+        "noticias_eliminadas": recorte["noticias_eliminadas"],
+        "excede_presupuesto": recorte["excede_presupuesto"],
+        "coste_usd": calcular_coste(tokens_entrada, tokens_salida, MODELO_GEMINI),
+    }
+
+
+def _extraer_decision_y_justificacion(texto_respuesta):
+    """
+    Extrae DECISIÓN y JUSTIFICACIÓN de una respuesta en Markdown libre (modo clásico).
+    """
+    decision_ia = "NO DETECTADA" # Valor por defecto por si falla el parseo
+    justificacion_ia = "No disponible" # Valor por defecto por si falla el parseo
+    
+    try:
+        # 1. Extraer DECISIÓN: Recorremos el texto línea a línea buscando el patrón
+        for linea in texto_respuesta.split('\n'):
+            # Buscamos "DECISIÓN:" (o DECISION:) ignorando mayúsculas/tildes parciales
+            if "DECISI" in linea.upper() and "N:" in linea.upper():
+                # Ejemplo típico de línea: "- **DECISIÓN:** [COMPRAR]"
+                
+                # 1. Separamos por los dos puntos y cogemos la parte derecha
+                parte_derecha = linea.split(':')[-1]
+                
+                # 2. Limpiamos "ruido": asteriscos, corchetes, guiones y espacios
+                limpia = parte_derecha.replace('*', '').replace('[', '').replace(']', '').replace('-', '').strip()
+                
+                # 3. Guardamos el resultado (ej: "COMPRAR")
+                if limpia:
+                    decision_ia = limpia.upper()
+                    break
+        # 2. Extraer JUSTIFICACIÓN: Buscamos la etiqueta "JUSTIFICACIÓN:"
+        if "JUSTIFICACIÓN:**" in texto_respuesta:
+            # Partimos el texto en dos usando la etiqueta como separador
+            partes = texto_respuesta.split("JUSTIFICACIÓN:**")
+            if len(partes) > 1:
+                # Cogemos la segunda parte y limpiamos espacios extra
+                justificacion_ia = partes[1].strip()
+        elif "JUSTIFICACIÓN:" in texto_respuesta:
+             partes = texto_respuesta.split("JUSTIFICACIÓN:")
+             if len(partes) > 1:
+                justificacion_ia = partes[1].strip()
+        elif "**JUSTIFICACIÓN**" in texto_respuesta: # Por si la IA pone negritas diferente
+             partes = texto_respuesta.split("**JUSTIFICACIÓN**")
+             if len(partes) > 1:
+                justificacion_ia = partes[1].strip().lstrip(":").strip()
+    
+    except Exception as e:
+        # Si falla algo en el parseo, no rompemos el programa
+        print(f"Warning extrayendo datos IA: {e}")
+
+    return decision_ia, justificacion_ia
+
+
+def _renderizar_markdown(respuesta):
+    """
+    Pinta en local el mismo esquema visual del modo clásico a partir de la respuesta JSON.
+    """
+    def viñeta(punto):
+        # "Deuda: texto" -> "- **Deuda:** texto"
+        categoria, separador, detalle = punto.partition(":")
+        if separador and len(categoria) < 60:
+            return f"- **{categoria.strip()}:** {detalle.strip()}"
+        return f"- {punto.strip()}"
+
+    fuertes = "\n".join(viñeta(p) for p in respuesta.get("puntos_fuertes", [])) or "- _Sin puntos fuertes destacados._"
+    debiles = "\n".join(viñeta(p) for p in respuesta.get("puntos_debiles", [])) or "- _Sin puntos débiles destacados._"
+
+    return (
+        f"### ✅ 1. PUNTOS FUERTES\n{fuertes}\n\n"
+        f"### ⚠️ 2. PUNTOS DÉBILES\n{debiles}\n\n"
+        f"### 🏁 3. CONCLUSIÓN FINAL\n"
+        f"- **DECISIÓN:** {respuesta.get('decision', 'NO DETECTADA')}\n"
+        f"- **JUSTIFICACIÓN:** {respuesta.get('justificacion', 'No disponible')}\n"
+    )
+
+
+def _procesar_respuesta_json(texto_json):
+    """
+    Parsea la respuesta estructurada con un único json.loads.
+    Devuelve (texto_markdown, decision_ia, justificacion_ia).
+    Si el JSON no es válido (p.ej. truncado por max_output_tokens), se recurre al extractor clásico.
+    """
+    try:
+        respuesta = json.loads(texto_json)
+    except (ValueError, TypeError) as e:
+        print(f"Warning parseando JSON de la IA: {e}")
+        decision_ia, justificacion_ia = _extraer_decision_y_justificacion(texto_json or "")
+        return texto_json, decision_ia, justificacion_ia
+
+    decision_ia = str(respuesta.get("decision", "NO DETECTADA")).strip().upper()
+    justificacion_ia = respuesta.get("justificacion") or "No disponible"
+    return _renderizar_markdown(respuesta), decision_ia, justificacion_ia
+
+
+def _texto_fragmento(fragmento):
+    """
+    Texto de un fragmento del streaming. A diferencia de 'fragmento.text', no lanza excepción
+    cuando el fragmento no trae partes (p.ej. el último, que solo lleva finishReason).
+    """
+    try:
+        return "".join(parte.text for parte in fragmento.candidates[0].content.parts)
+    except (IndexError, AttributeError):
+        return ""
+
+
+def generar_analisis_gemini(api_key, ticker, datos_financieros, informe_gatekeeper,
+                            modo_estructurado=False, max_tokens_salida=None, al_recibir_fragmento=None,
+                            presupuesto_tokens=None, registro_tokens=None, plazo_segundos=None):
+    """
+    Construye el prompt avanzado y solicita el análisis a Gemini.
+
+    - modo_estructurado=False: respuesta libre en Markdown, se extraen DECISIÓN y JUSTIFICACIÓN del texto.
+    - modo_estructurado=True: se pide un JSON con esquema fijo (decision, justificacion, puntos_fuertes,
+      puntos_debiles) limitado a 'max_tokens_salida' y el Markdown se pinta en local.
+    - al_recibir_fragmento: si se indica, la respuesta se pide en streaming y se llama a esta función
+      con el texto acumulado cada vez que llega un fragmento (p.ej. para pintarlo en un st.empty()).
+      La extracción de DECISIÓN y JUSTIFICACIÓN se hace al terminar el stream.
+    - presupuesto_tokens: límite de tokens de entrada (sistema + usuario; None = sin límite). Si se supera, se
+      compactan los espacios y se eliminan noticias hasta encajar (ver Intento3_V1_Tokens.ajustar_prompt_a_presupuesto).
+      Si no llega ni para las instrucciones del sistema, no se llama a la IA y decision_ia es DECISION_SIN_PRESUPUESTO.
+    - registro_tokens: dict opcional que se rellena con el consumo de la llamada (tokens y coste).
+    - plazo_segundos: tiempo máximo de la llamada (por defecto el de Intento3_V1_Plazos); en streaming se aplica
+      a la petición y al recorrido del stream. Si se agota, decision_ia es "ERROR" y el texto lo indica.
+      Las peticiones a Gemini no se duplican con coberturas (la copia perdedora también se factura).
+    Devuelve (texto_respuesta, prompt_usuario, decision_ia, justificacion_ia).
+    """
+    if not api_key:
+        return "⚠️ Error: No se ha proporcionado una API Key de Google Gemini."
+
+    plazo_segundos = plazo_segundos or PLAZOS_POR_DEFECTO["gemini"]
+    limite = time.monotonic() + plazo_segundos
+    instrucciones = INSTRUCCIONES_DEL_SISTEMA_JSON if modo_estructurado else INSTRUCCIONES_DEL_SISTEMA
+    tokens_sistema = contar_tokens(instrucciones)
+    if presupuesto_agotado(presupuesto_tokens, tokens_sistema):
+        return TEXTO_SIN_PRESUPUESTO, None, DECISION_SIN_PRESUPUESTO, ""
+    try:
+        # A. Autenticación
+        genai = _configurar_gemini(api_key)
+        
+        # B. Inicialización del Modelo con Instrucciones del Sistema
+        model = genai.GenerativeModel(
+            model_name=MODELO_GEMINI,
+            system_instruction=instrucciones
         )
 
-        response = model.generate_content(
-            prompt_usuario,
-            safety_settings=CONFIGURACION_SEGURIDAD,
-            generation_config=generation_conf
+        # C/D. Preparación de Datos y construcción del prompt (ajustado al presupuesto de tokens)
+        presupuesto_usuario = presupuesto_tokens - tokens_sistema if presupuesto_tokens is not None else None
+        prompt_usuario, recorte = ajustar_prompt_a_presupuesto(
+            lambda noticias, compacto: _construir_prompt_usuario(ticker, datos_financieros, informe_gatekeeper, noticias, compacto),
+            datos_financieros.get('noticias', []),
+            presupuesto_usuario
         )
+
+        # E. Generación
+        if modo_estructurado:
+            generation_conf = genai.types.GenerationConfig(
+                temperature=0.0,
+                candidate_count=1,
+                max_output_tokens=max_tokens_salida or MAX_TOKENS_SALIDA_JSON,
+                response_mime_type="application/json",
+                response_schema=ESQUEMA_RESPUESTA
+            )
+        else:
+            generation_conf = genai.types.GenerationConfig(
+                temperature=0.0, 
+                candidate_count=1,
+                max_output_tokens=max_tokens_salida
+            )
+
+        streaming = al_recibir_fragmento is not None
+        opciones_peticion = {"timeout": max(1.0, limite - time.monotonic())}  # Plazo de la conexión HTTP
+        if streaming:
+            response = model.generate_content(
+                prompt_usuario,
+                safety_settings=CONFIGURACION_SEGURIDAD,
+                generation_config=generation_conf,
+                stream=True,
+                request_options=opciones_peticion
+            )
+            # Vamos entregando el texto acumulado según llega (el tiempo percibido es el del primer fragmento)
+            texto_bruto = ""
+            for fragmento in response:
+                texto_bruto += _texto_fragmento(fragmento)
+                al_recibir_fragmento(texto_bruto)
+                if time.monotonic() > limite:
+                    raise TimeoutError(f"gemini: respuesta incompleta a los {plazo_segundos:.0f}s")
+        else:
+            response = llamar_con_plazo(
+                "gemini", model.generate_content, prompt_usuario, plazo=limite - time.monotonic(), cubrir=False,
+                safety_settings=CONFIGURACION_SEGURIDAD, generation_config=generation_conf,
+                request_options=opciones_peticion
+            )
+            texto_bruto = response.text
         
-        texto_respuesta = response.text
-        
-        # --- EXTRACTOR DE DECISIÓN Y JUSTIFICACIÓN IA ---
-        decision_ia = "NO DETECTADA" # Valor por defecto por si falla el parseo
-        justificacion_ia = "No disponible" # Valor por defecto por si falla el parseo
-        
-        try:
-            # 1. Extraer DECISIÓN: Recorremos el texto línea a línea buscando el patrón
-            for linea in texto_respuesta.split('\n'):
-                # Buscamos "DECISIÓN:" (o DECISION:) ignorando mayúsculas/tildes parciales
-                if "DECISI" in linea.upper() and "N:" in linea.upper():
-                    # Ejemplo típico de línea: "- **DECISIÓN:** [COMPRAR]"
-                    
-                    # 1. Separamos por los dos puntos y cogemos la parte derecha
-                    parte_derecha = linea.split(':')[-1]
-                    
-                    # 2. Limpiamos "ruido": asteriscos, corchetes, guiones y espacios
-                    limpia = parte_derecha.replace('*', '').replace('[', '').replace(']', '').replace('-', '').strip()
-                    
-                    # 3. Guardamos el resultado (ej: "COMPRAR")
-                    if limpia:
-                        decision_ia = limpia.upper()
-                        break
-            # 2. Extraer JUSTIFICACIÓN: Buscamos la etiqueta "JUSTIFICACIÓN:"
-            if "JUSTIFICACIÓN:**" in texto_respuesta:
-                # Partimos el texto en dos usando la etiqueta como separador
-                partes = texto_respuesta.split("JUSTIFICACIÓN:**")
-                if len(partes) > 1:
-                    # Cogemos la segunda parte y limpiamos espacios extra
-                    justificacion_ia = partes[1].strip()
-            elif "JUSTIFICACIÓN:" in texto_respuesta:
-                 partes = texto_respuesta.split("JUSTIFICACIÓN:")
-                 if len(partes) > 1:
-                    justificacion_ia = partes[1].strip()
-            elif "**JUSTIFICACIÓN**" in texto_respuesta: # Por si la IA pone negritas diferente
-                 partes = texto_respuesta.split("**JUSTIFICACIÓN**")
-                 if len(partes) > 1:
-                    justificacion_ia = partes[1].strip().lstrip(":").strip()
-        
-        except Exception as e:
-            # Si falla algo en el parseo, no rompemos el programa
-            print(f"Warning extrayendo datos IA: {e}")
+        # --- EXTRACTOR DE DECISIÓN Y JUSTIFICACIÓN IA (con la respuesta completa) ---
+        if modo_estructurado:
+            texto_respuesta, decision_ia, justificacion_ia = _procesar_respuesta_json(texto_bruto)
+        else:
+            texto_respuesta = texto_bruto
+            decision_ia, justificacion_ia = _extraer_decision_y_justificacion(texto_respuesta)
+
+        if registro_tokens is not None:
+            registro_tokens.update(_contabilizar_tokens(ticker, tokens_sistema, prompt_usuario, texto_bruto, response, recorte))
 
         # RETORNO MODIFICADO: Añadimos decision_ia al final
         return texto_respuesta, prompt_usuario, decision_ia, justificacion_ia
 
+    except TimeoutError as e:
+        # Plazo agotado: el ticker se queda con la decisión del algoritmo (no se guarda como análisis)
+        return f"⏱️ Gemini no respondió a tiempo ({e}): se mantiene solo la decisión del algoritmo.", None, "ERROR", ""
     except Exception as e:
         # En caso de error de conexión, devolvemos 3 valores para no romper el unpacking en app.py
         return f"❌ Error al conectar con Gemini: {str(e)}", None, "ERROR", ""
-    
 
 
+# --- 3. ANÁLISIS POR LOTES ---
+def _construir_prompt_lote(secciones):
+    """Une los prompts de usuario de varias empresas en un único prompt con secciones delimitadas."""
+    bloques = [f"Analiza por separado las {len(secciones)} empresas siguientes."]
+    for ticker, prompt_ticker in secciones:
+        bloques.append(f"{MARCA_EMPRESA.format(ticker=ticker)}\n{prompt_ticker}\n<<<FIN EMPRESA: {ticker}>>>")
+    return "\n\n".join(bloques)
+
+
+def _trocear_respuesta_markdown(texto):
+    """Respuesta Markdown de un lote -> dict ticker -> texto de su sección (sin las marcas)."""
+    marcas = list(PATRON_MARCA_EMPRESA.finditer(texto or ""))
+    secciones = {}
+    for i, marca in enumerate(marcas):
+        fin = marcas[i + 1].start() if i + 1 < len(marcas) else len(texto)
+        secciones[marca.group(1).strip().upper()] = PATRON_FIN_EMPRESA.sub("", texto[marca.end():fin]).strip()
+    return secciones
+
+
+def _procesar_respuesta_lote(texto_bruto, tickers, modo_estructurado):
+    """
+    Reparte la respuesta de un lote por ticker. Solo se aceptan las secciones con una decisión válida;
+    el resto se devuelve aparte para repetirlas con llamadas individuales.
+    Devuelve (dict ticker -> (texto, decision_ia, justificacion_ia), lista de tickers fallidos).
+    """
+    validos = {}
+    if modo_estructurado:
+        try:
+            for elemento in json.loads(texto_bruto).get("analisis", []):
+                ticker = str(elemento.get("ticker", "")).strip().upper()
+                decision_ia = str(elemento.get("decision", "")).strip().upper()
+                if decision_ia in DECISIONES_VALIDAS:
+                    validos[ticker] = (_renderizar_markdown(elemento), decision_ia,
+                                       elemento.get("justificacion") or "No disponible")
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Warning parseando JSON del lote: {e}")
+    else:
+        for ticker, seccion in _trocear_respuesta_markdown(texto_bruto).items():
+            decision_ia, justificacion_ia = _extraer_decision_y_justificacion(seccion)
+            if decision_ia in DECISIONES_VALIDAS:
+                validos[ticker] = (seccion, decision_ia, justificacion_ia)
+
+    resultado = {t: validos[t.upper()] for t in tickers if t.upper() in validos}
+    return resultado, [t for t in tickers if t not in resultado]
+
+
+def _repartir_consumo(registro_lote, tokens_usuario_por_ticker, id_lote, desperdiciados=()):
+    """
+    Reparte el consumo de una petición por lotes entre sus tickers, en proporción a los tokens de su sección.
+    Devuelve una lista de registros con el mismo formato que los de las llamadas individuales.
+    Las cuotas de los tickers en 'desperdiciados' (secciones sin interpretar, que se repiten ticker a ticker)
+    se marcan con desperdiciado=True: se han pagado pero no han producido análisis.
+    """
+    total_usuario = sum(tokens_usuario_por_ticker.values()) or 1
+    registros = []
+    for ticker, tokens_usuario in tokens_usuario_por_ticker.items():
+        cuota = tokens_usuario / total_usuario
+        registro = dict(registro_lote)
+        registro.update({
+            "ticker": ticker,
+            "tokens_sistema": round(registro_lote["tokens_sistema"] * cuota),
+            "tokens_usuario": tokens_usuario,
+            "tokens_entrada": round(registro_lote["tokens_entrada"] * cuota),
+            "tokens_salida": round(registro_lote["tokens_salida"] * cuota),
+            "coste_usd": registro_lote["coste_usd"] * cuota,
+            "lote": id_lote,
+            "desperdiciado": ticker in desperdiciados,
+        })
+        registros.append(registro)
+    return registros
+
+
+def generar_analisis_gemini_lote(api_key, peticiones, modo_estructurado=False, tamano_lote=TAMANO_LOTE_POR_DEFECTO,
+                                 max_tokens_salida=None, presupuesto_ticker=None, presupuesto_run=None,
+                                 registros_tokens=None, al_completar_ticker=None, plazo_segundos=None, limite=None):
+    """
+    Análisis de varias empresas agrupándolas en peticiones de hasta 'tamano_lote' empresas: las
+    INSTRUCCIONES_DEL_SISTEMA se envían una vez por lote y no una vez por ticker.
+
+    - peticiones: lista de (ticker, datos_financieros, informe_gatekeeper).
+    - presupuesto_ticker / presupuesto_run: límites de tokens por ticker y por ejecución (0 o None = sin límite),
+      como en Intento3_V1_Tokens.presupuesto_disponible. Se recalculan antes de cada lote y de cada llamada
+      individual con lo ya consumido; en un lote, lo que queda de la ejecución se reparte entre sus tickers.
+      Si no cubre la parte de las instrucciones del sistema que le toca a cada ticker, el lote no se envía
+      y sus tickers quedan con DECISION_SIN_PRESUPUESTO.
+    - registros_tokens: lista opcional donde se añade un registro de consumo por ticker (en los lotes, el
+      consumo de la petición se reparte entre sus tickers, también el de las secciones sin interpretar,
+      marcadas con desperdiciado=True).
+    - al_completar_ticker(ticker, resultado): se llama en cuanto el resultado de un ticker está listo.
+    - plazo_segundos: tiempo máximo de cada petición (por defecto el de Intento3_V1_Plazos), recortado al
+      'limite' de la ejecución (ver Intento3_V1_Plazos.limite_ejecucion). Los tickers de un lote cuya petición
+      agota el plazo, o que quedan pendientes al llegar al límite, se entregan con DECISION_SIN_TIEMPO.
+    Las secciones que no se puedan interpretar (o todo el lote, si la petición falla) se repiten
+    con generar_analisis_gemini ticker a ticker.
+    Devuelve dict ticker -> (texto_respuesta, prompt_usuario, decision_ia, justificacion_ia).
+    """
+    resultados = {}
+    # El consumo ya hecho cuenta para el presupuesto de la ejecución aunque no se pida el detalle
+    registros = registros_tokens if registros_tokens is not None else []
+
+    def _entregar(ticker, resultado):
+        resultados[ticker] = resultado
+        if al_completar_ticker:
+            al_completar_ticker(ticker, resultado)
+
+    def _sin_tiempo(tickers):
+        for ticker in tickers:
+            _entregar(ticker, (TEXTO_SIN_TIEMPO, None, DECISION_SIN_TIEMPO, ""))
+
+    def _individual(ticker, datos, informe):
+        if restante(limite) <= 0:
+            _sin_tiempo([ticker])
+            return
+        registro = {}
+        resultado = generar_analisis_gemini(api_key, ticker, datos, informe, modo_estructurado=modo_estructurado,
+                                            max_tokens_salida=max_tokens_salida,
+                                            presupuesto_tokens=presupuesto_disponible(presupuesto_ticker, presupuesto_run, registros),
+                                            registro_tokens=registro,
+                                            plazo_segundos=min(plazo_segundos, restante(limite)))
+        if registro:
+            registros.append(registro)
+        _entregar(ticker, resultado)
+
+    if not api_key:
+        for ticker, _, _ in peticiones:
+            _entregar(ticker, ("⚠️ Error: No se ha proporcionado una API Key de Google Gemini.", None, "ERROR", ""))
+        return resultados
+
+    instrucciones = (INSTRUCCIONES_DEL_SISTEMA_JSON + FORMATO_LOTE_JSON) if modo_estructurado \
+        else (INSTRUCCIONES_DEL_SISTEMA + FORMATO_LOTE_MARKDOWN)
+    tokens_sistema = contar_tokens(instrucciones)
+    plazo_segundos = plazo_segundos or PLAZOS_POR_DEFECTO["gemini"]
+
+    for inicio in range(0, len(peticiones), max(1, tamano_lote)):
+        lote = peticiones[inicio:inicio + tamano_lote]
+        if len(lote) == 1:
+            _individual(*lote[0])
+            continue
+        if restante(limite) <= 0:
+            _sin_tiempo([ticker for ticker, _, _ in lote])
+            continue
+
+        presupuesto = presupuesto_disponible(presupuesto_ticker, presupuesto_run, registros, tickers=len(lote))
+        sistema_por_ticker = tokens_sistema / len(lote)
+        if presupuesto_agotado(presupuesto, sistema_por_ticker):
+            for ticker, _, _ in lote:
+                _entregar(ticker, (TEXTO_SIN_PRESUPUESTO, None, DECISION_SIN_PRESUPUESTO, ""))
+            continue
+
+        por_ticker = {ticker: (datos, informe) for ticker, datos, informe in lote}
+        id_lote = inicio // tamano_lote + 1
+        recorte = {"compactado": True, "noticias_eliminadas": 0, "excede_presupuesto": False}
+        response = None
+        try:
+            genai = _configurar_gemini(api_key)
+            model = genai.GenerativeModel(model_name=MODELO_GEMINI, system_instruction=instrucciones)
+
+            # Secciones compactas (los espacios no aportan nada y se repiten N veces), ajustadas al presupuesto
+            secciones = []
+            for ticker, datos, informe in lote:
+                prompt_ticker, _ = ajustar_prompt_a_presupuesto(
+                    lambda noticias, compacto, t=ticker, d=datos, i=informe: _construir_prompt_usuario(t, d, i, noticias, True),
+                    datos.get('noticias', []),
+                    presupuesto - sistema_por_ticker if presupuesto is not None else None
+                )
+                secciones.append((ticker, prompt_ticker))
+            prompt_lote = _construir_prompt_lote(secciones)
+
+            salida_por_ticker = max_tokens_salida or (MAX_TOKENS_SALIDA_JSON if modo_estructurado else None)
+            generation_conf = genai.types.GenerationConfig(
+                temperature=0.0,
+                candidate_count=1,
+                max_output_tokens=salida_por_ticker * len(lote) if salida_por_ticker else None,
+                **({"response_mime_type": "application/json", "response_schema": ESQUEMA_RESPUESTA_LOTE}
+                   if modo_estructurado else {})
+            )
+            plazo = min(plazo_segundos, restante(limite))
+            response = llamar_con_plazo(
+                "gemini", model.generate_content, prompt_lote, plazo=plazo, limite=limite, cubrir=False,
+                safety_settings=CONFIGURACION_SEGURIDAD, generation_config=generation_conf,
+                request_options={"timeout": max(1.0, plazo)}
+            )
+            texto_bruto = response.text
+        except TimeoutError as e:
+            # Repetirlo ticker a ticker multiplicaría la espera: el lote se queda con la decisión del Gatekeeper
+            print(f"Aviso: la petición por lotes agotó su plazo ({e}); sus tickers se quedan sin análisis IA.")
+            _sin_tiempo(por_ticker)
+            continue
+        except Exception as e:
+            print(f"Aviso: fallo en la petición por lotes ({e}); se repite ticker a ticker.")
+            if response is not None:
+                # La petición llegó a responderse (p.ej. respuesta bloqueada): se ha pagado sin producir análisis
+                registro_lote = _contabilizar_tokens("lote", tokens_sistema, prompt_lote, "", response, recorte)
+                registros.extend(_repartir_consumo(registro_lote, {t: contar_tokens(p) for t, p in secciones},
+                                                   id_lote, desperdiciados=set(por_ticker)))
+            for ticker, datos, informe in lote:
+                _individual(ticker, datos, informe)
+            continue
+
+        validos, fallidos = _procesar_respuesta_lote(texto_bruto, list(por_ticker), modo_estructurado)
+        prompts = dict(secciones)
+
+        # La petición se contabiliza siempre, aunque no se haya podido interpretar ninguna sección
+        registro_lote = _contabilizar_tokens("lote", tokens_sistema, prompt_lote, texto_bruto, response, recorte)
+        registros.extend(_repartir_consumo(registro_lote, {t: contar_tokens(p) for t, p in secciones},
+                                           id_lote, desperdiciados=set(fallidos)))
+
+        for ticker, (texto, decision_ia, justificacion_ia) in validos.items():
+            _entregar(ticker, (texto, prompts[ticker], decision_ia, justificacion_ia))
+
+        if fallidos:
+            print(f"Aviso: secciones sin interpretar en el lote ({', '.join(fallidos)}); se repiten ticker a ticker.")
+        for ticker in fallidos:
+            _individual(ticker, *por_ticker[ticker])
+
+    return resultados
 
-    
\ No newline at end of file
@@ -0,0 +1,449 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Historial.py
+
+import os
+import time
+import shutil
+import numbers
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_Cache import DIRECTORIO_CACHE
+from Intento3_V1_Exportacion import valor_numerico
+from Intento3_V1_Gestor_IA import DECISIONES_VALIDAS
+
+# --- HISTORIAL COLUMNAR DE SNAPSHOTS Y DECISIONES POR (TICKER, INSTANTE) ---
+# Cada ejecución añade una fila por ticker con los ratios del snapshot y las decisiones del Gatekeeper y de la IA.
+#   <directorio>/segmentos/<ns>_<pid>.npz -> filas de una ejecución; solo se añaden, nunca se modifican (el registro)
+#   <directorio>/ACTUAL                   -> nombre del índice vigente (se cambia de forma atómica)
+#   <directorio>/v<ns>/                   -> índice compactado de todos los segmentos, una columna por .npy:
+#       clave.npy       int64 (F,): (posición del ticker << 32) | segundos del instante; ordenada
+#       instante.npy    datetime64[s] (F,)
+#       <campo>.npy     float64 / int16 (F,) por campo numérico; int16 (F,) códigos de las decisiones
+#       tickers.npy     str (N,) ordenados; inicios.npy int64 (N + 1): filas del ticker k = [inicios[k], inicios[k+1])
+#       categorias.npy  str: vocabulario de los códigos de decisión (-1 = sin dato)
+#       ejecuciones.npy / filas_ejecucion.npy: instantes de las ejecuciones y nº de filas de cada una
+#       segmentos.npy   str: segmentos incorporados al índice
+# Las consultas abren el índice con mmap_mode='r' y solo hacen búsquedas binarias sobre 'clave': el historial de un
+# ticker es un rango contiguo y la foto de todo el universo en una fecha es un searchsorted por ticker.
+# El índice se puede borrar: se reconstruye de los segmentos. Los segmentos que aún no están en el índice (otro
+# proceso escribiendo a la vez) se mezclan en memoria al abrirlo.
+
+DIRECTORIO_HISTORIAL = os.path.join(DIRECTORIO_CACHE, "historial")
+VERSIONES_CONSERVADAS = 2  # La anterior se mantiene para los lectores que aún la tengan abierta
+
+CAMPOS_NUMERICOS = ['precio', 'market_cap', 'enterprise_value', 'per_ltm', 'per_ntm', 'ratio_solvencia',
+                    'div_yield', 'buyback_yield', 'total_yield', 'fcf_yield_ev', 'fcf_yield_mc', 'payout_ratio']
+CAMPOS_CONTEO = ['puntos_fuertes', 'alertas', 'alertas_criticas']  # Nº de elementos de cada lista del Gatekeeper
+CAMPOS_DECISION = ['decision_algoritmo', 'decision_ia']  # Solo DECISIONES_VALIDAS; "" si no hubo decisión
+
+_historiales_abiertos = {}  # (directorio, versión) -> índice ya mapeado en este proceso
+
+
+# --- 1. FILAS Y SEGMENTOS (ESCRITURA) ---
+def _marca(instante):
+    """pd.Timestamp sin zona horaria de un datetime, Timestamp, texto o segundos epoch (None = ahora, hora local)."""
+    if instante is None:
+        return pd.Timestamp.now()
+    marca = pd.Timestamp(instante, unit="s") if isinstance(instante, numbers.Real) else pd.Timestamp(instante)
+    return marca.tz_localize(None) if marca.tzinfo else marca
+
+
+def fila_historial(ticker, datos, informe=None, decision_ia=None):
+    """
+    Fila plana de un ticker: campos del snapshot, nº de puntos fuertes y alertas y las dos decisiones.
+    Los estados que no son una decisión ("ERROR", "⏱️ SIN TIEMPO", "⏳ EN COLA"...) se guardan como "".
+    """
+    fila = {'ticker': ticker}
+    fila.update({campo: valor_numerico(datos.get(campo), np.nan) for campo in CAMPOS_NUMERICOS})
+    informe = informe or {}
+    fila.update({campo: len(informe.get(campo, ())) for campo in CAMPOS_CONTEO})
+    fila['decision_algoritmo'] = _decision(informe.get('decision'))
+    fila['decision_ia'] = _decision(decision_ia)
+    return fila
+
+
+def _decision(texto):
+    return texto if texto in DECISIONES_VALIDAS else ""
+
+
+def anadir_ejecucion(filas, instante=None, directorio=DIRECTORIO_HISTORIAL, compactar=True):
+    """
+    Añade las filas de una ejecución (lista de fila_historial) como un segmento nuevo con el mismo 'instante'
+    (por defecto ahora; datetime, Timestamp o segundos epoch). Con 'compactar' publica a continuación un índice
+    que lo incluye; sin él, el segmento se lee igualmente hasta la próxima compactación.
+    Devuelve el nombre del segmento (None si no hay filas).
+    """
+    if not filas:
+        return None
+    tabla = pd.DataFrame(filas).drop_duplicates(subset='ticker', keep='last')
+    columnas = {
+        "ticker": tabla['ticker'].astype(str).to_numpy(dtype=str),
+        "instante": np.array(_marca(instante).to_datetime64(), dtype="datetime64[s]"),
+        **{campo: tabla[campo].to_numpy(dtype="float64") for campo in CAMPOS_NUMERICOS},
+        **{campo: tabla[campo].to_numpy(dtype="int16") for campo in CAMPOS_CONTEO},
+        **{campo: tabla[campo].fillna("").astype(str).to_numpy(dtype=str) for campo in CAMPOS_DECISION},
+    }
+
+    # Escritura atómica: el segmento aparece completo o no aparece
+    ruta_segmentos = os.path.join(directorio, "segmentos")
+    os.makedirs(ruta_segmentos, exist_ok=True)
+    nombre = f"{time.time_ns()}_{os.getpid()}.npz"
+    descriptor, ruta_tmp = tempfile.mkstemp(dir=ruta_segmentos, suffix=".tmp")
+    with os.fdopen(descriptor, "wb") as f:
+        np.savez(f, **columnas)
+    os.replace(ruta_tmp, os.path.join(ruta_segmentos, nombre))
+
+    if compactar:
+        compactar_historial(directorio)
+    return nombre
+
+
+def _segmentos(directorio):
+    try:
+        return sorted(s for s in os.listdir(os.path.join(directorio, "segmentos")) if s.endswith(".npz"))
+    except FileNotFoundError:
+        return []
+
+
+def _leer_segmento(directorio, nombre):
+    with np.load(os.path.join(directorio, "segmentos", nombre)) as segmento:
+        return {clave: segmento[clave] for clave in segmento.files}
+
+
+# --- 2. ÍNDICE COMPACTADO ---
+def _combinar(base, segmentos):
+    """
+    Índice en memoria (mismo formato que abrir_historial) con las filas de 'base' (o None) y de 'segmentos'
+    (dicts de _leer_segmento): se unifican tickers y vocabulario y se ordena todo por (ticker, instante).
+    """
+    partes_tickers = [s["ticker"] for s in segmentos]
+    partes_categorias = [s[c] for s in segmentos for c in CAMPOS_DECISION]
+    if base is not None:
+        partes_tickers.append(np.asarray(base["tickers"]))
+        partes_categorias.append(np.asarray(base["categorias"]))
+    tickers = np.unique(np.concatenate(partes_tickers))
+    categorias = np.unique(np.concatenate(partes_categorias + [np.array([""])]))
+
+    # Posición de cada fila en los tickers y códigos de decisión unificados
+    posiciones, instantes, columnas = [], [], {c: [] for c in CAMPOS_NUMERICOS + CAMPOS_CONTEO + CAMPOS_DECISION}
+    if base is not None and base["filas"]:
+        posiciones.append(np.searchsorted(tickers, base["tickers"])[base["clave"] >> 32])
+        instantes.append(base["instante"])
+        for c in CAMPOS_NUMERICOS + CAMPOS_CONTEO:
+            columnas[c].append(base["columnas"][c])
+        # Vocabulario previo -> unificado; el código -1 (sin dato) se toma del último elemento, que es ""
+        recodificar = np.append(np.searchsorted(categorias, base["categorias"]), np.searchsorted(categorias, ""))
+        for c in CAMPOS_DECISION:
+            columnas[c].append(recodificar[base["columnas"][c]])
+    for s in segmentos:
+        posiciones.append(np.searchsorted(tickers, s["ticker"]))
+        instantes.append(np.full(len(s["ticker"]), s["instante"], dtype="datetime64[s]"))
+        for c in CAMPOS_NUMERICOS + CAMPOS_CONTEO:
+            columnas[c].append(s[c])
+        for c in CAMPOS_DECISION:
+            columnas[c].append(np.searchsorted(categorias, s[c]))
+
+    instante = np.concatenate(instantes).astype("datetime64[s]")
+    clave = (np.concatenate(posiciones).astype("int64") << 32) | instante.astype("int64")
+    orden = np.argsort(clave, kind="stable")
+    clave = clave[orden]
+    columnas = {c: np.concatenate(v)[orden].astype("int16" if c not in CAMPOS_NUMERICOS else "float64")
+                for c, v in columnas.items()}
+    # El código "" pasa a -1 (sin dato): el vocabulario solo guarda decisiones reales
+    vacio = int(np.searchsorted(categorias, ""))
+    for c in CAMPOS_DECISION:
+        codigos = columnas[c]
+        columnas[c] = np.where(codigos == vacio, -1, codigos - (codigos > vacio)).astype("int16")
+    categorias = np.delete(categorias, vacio)
+
+    ejecuciones, filas_ejecucion = np.unique(instante, return_counts=True)
+    return {
+        "version": None, "clave": clave, "instante": instante[orden], "columnas": columnas, "tickers": tickers,
+        "inicios": np.searchsorted(clave, np.arange(len(tickers) + 1, dtype="int64") << 32),
+        "categorias": categorias, "ejecuciones": ejecuciones, "filas_ejecucion": filas_ejecucion,
+        "filas": len(clave), "segmentos": [],
+    }
+
+
+def _abrir_indice(directorio):
+    """Índice vigente mapeado en memoria (o None si aún no hay)."""
+    try:
+        with open(os.path.join(directorio, "ACTUAL")) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    clave = (directorio, version)
+    if clave not in _historiales_abiertos:
+        ruta = os.path.join(directorio, version)
+        cargar = lambda nombre: np.load(os.path.join(ruta, f"{nombre}.npy"), mmap_mode="r")
+        claves = cargar("clave")
+        _historiales_abiertos.clear()  # Solo interesa la última versión
+        _historiales_abiertos[clave] = {
+            "version": version, "clave": claves, "instante": cargar("instante"),
+            "columnas": {c: cargar(c) for c in CAMPOS_NUMERICOS + CAMPOS_CONTEO + CAMPOS_DECISION},
+            "tickers": cargar("tickers"), "inicios": cargar("inicios"), "categorias": cargar("categorias"),
+            "ejecuciones": cargar("ejecuciones"), "filas_ejecucion": cargar("filas_ejecucion"),
+            "filas": len(claves), "segmentos": list(cargar("segmentos")),
+        }
+    return _historiales_abiertos[clave]
+
+
+def compactar_historial(directorio=DIRECTORIO_HISTORIAL):
+    """
+    Publica un índice nuevo con los segmentos que aún no estaban en el vigente. Si dos procesos compactan a la vez
+    gana el último en publicar; los segmentos que su índice no incluya se siguen leyendo como pendientes.
+    Devuelve la versión publicada (None si no había nada pendiente).
+    """
+    base = _abrir_indice(directorio)
+    incorporados = set(base["segmentos"]) if base is not None else set()
+    pendientes = [s for s in _segmentos(directorio) if s not in incorporados]
+    if not pendientes:
+        return None
+    indice = _combinar(base, [_leer_segmento(directorio, s) for s in pendientes])
+
+    version = f"v{time.time_ns()}"
+    ruta = os.path.join(directorio, version)
+    os.makedirs(ruta)
+    for nombre in ("clave", "instante", "tickers", "inicios", "categorias", "ejecuciones", "filas_ejecucion"):
+        np.save(os.path.join(ruta, f"{nombre}.npy"), indice[nombre])
+    for c, valores in indice["columnas"].items():
+        np.save(os.path.join(ruta, f"{c}.npy"), valores)
+    np.save(os.path.join(ruta, "segmentos.npy"), np.array(sorted(incorporados.union(pendientes)), dtype=str))
+
+    descriptor, ruta_tmp = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(descriptor, "w") as f:
+        f.write(version)
+    os.replace(ruta_tmp, os.path.join(directorio, "ACTUAL"))
+
+    # Limpieza de índices antiguos (en Windows puede fallar si otro proceso los tiene mapeados: se ignora)
+    versiones = sorted(v for v in os.listdir(directorio) if v.startswith("v"))
+    for antigua in versiones[:-VERSIONES_CONSERVADAS]:
+        shutil.rmtree(os.path.join(directorio, antigua), ignore_errors=True)
+    return version
+
+
+def abrir_historial(directorio=DIRECTORIO_HISTORIAL):
+    """
+    Historial para consultar (o None si está vacío): el índice vigente mapeado en memoria, más los segmentos que
+    aún no incluye mezclados en memoria. Abrir un índice ya mapeado cuesta un listado del directorio de segmentos.
+    """
+    base = _abrir_indice(directorio)
+    incorporados = set(base["segmentos"]) if base is not None else set()
+    pendientes = [s for s in _segmentos(directorio) if s not in incorporados]
+    if not pendientes:
+        return base
+    return _combinar(base, [_leer_segmento(directorio, s) for s in pendientes])
+
+
+# --- 3. CONSULTAS ---
+def _posiciones(historial, tickers):
+    """(posiciones en historial['tickers'], tickers encontrados) de 'tickers' (None = todos)."""
+    if tickers is None:
+        return np.arange(len(historial["tickers"])), list(historial["tickers"])
+    tickers = list(dict.fromkeys(tickers))
+    posiciones = np.searchsorted(historial["tickers"], tickers)
+    posiciones = np.minimum(posiciones, len(historial["tickers"]) - 1)
+    encontrados = np.asarray(historial["tickers"])[posiciones] == np.array(tickers, dtype=str)
+    return posiciones[encontrados], [t for t, ok in zip(tickers, encontrados) if ok]
+
+
+def _segundos(instante, fin_del_dia=False):
+    """Segundos epoch de una fecha o instante; una fecha sin hora con 'fin_del_dia' incluye todo ese día."""
+    instante = _marca(instante)
+    if fin_del_dia and instante == instante.normalize():
+        instante = instante + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return int(instante.value // 10**9)
+
+
+def _tabla(historial, filas, indice):
+    """DataFrame con las columnas de las 'filas' del índice; las decisiones como categorías."""
+    columnas = {"instante": np.asarray(historial["instante"][filas])}
+    for c in CAMPOS_NUMERICOS + CAMPOS_CONTEO:
+        columnas[c] = historial["columnas"][c][filas]
+    for c in CAMPOS_DECISION:
+        columnas[c] = pd.Categorical.from_codes(historial["columnas"][c][filas], np.asarray(historial["categorias"]))
+    return pd.DataFrame(columnas, index=indice)
+
+
+def historial_ticker(historial, ticker, desde=None, hasta=None):
+    """
+    Filas de un ticker entre 'desde' y 'hasta' (incluidas; una fecha sin hora incluye el día entero),
+    como DataFrame indexado por instante. Vacío si el ticker no está en el historial.
+    """
+    posiciones, encontrados = _posiciones(historial, [ticker]) if historial else ([], [])
+    if not encontrados:
+        return pd.DataFrame(columns=["instante"] + CAMPOS_NUMERICOS + CAMPOS_CONTEO + CAMPOS_DECISION).set_index("instante")
+    k = int(posiciones[0])
+    inicio, fin = int(historial["inicios"][k]), int(historial["inicios"][k + 1])
+    if desde is not None:
+        inicio = int(np.searchsorted(historial["clave"], (k << 32) | _segundos(desde), side="left"))
+    if hasta is not None:
+        fin = int(np.searchsorted(historial["clave"], (k << 32) | _segundos(hasta, fin_del_dia=True), side="right"))
+    filas = np.arange(inicio, max(inicio, fin))
+    return _tabla(historial, filas, None).set_index("instante")
+
+
+def _filas_a_fecha(historial, posiciones, fecha):
+    """Fila más reciente de cada ticker con instante <= 'fecha' (-1 si no tiene ninguna)."""
+    claves = (posiciones.astype("int64") << 32) | _segundos(fecha, fin_del_dia=True)
+    filas = np.searchsorted(historial["clave"], claves, side="right") - 1
+    return np.where(filas >= np.asarray(historial["inicios"])[posiciones], filas, -1)
+
+
+def foto_historial(historial, fecha=None, tickers=None):
+    """
+    Última fila de cada ticker en 'fecha' (por defecto la más reciente de todas), como DataFrame indexado por
+    ticker. Los tickers sin filas hasta esa fecha no aparecen.
+    """
+    posiciones, encontrados = _posiciones(historial, tickers)
+    if fecha is None:
+        filas = np.asarray(historial["inicios"])[posiciones + 1] - 1
+        filas = np.where(filas >= np.asarray(historial["inicios"])[posiciones], filas, -1)
+    else:
+        filas = _filas_a_fecha(historial, posiciones, fecha)
+    con_fila = filas >= 0
+    return _tabla(historial, filas[con_fila], pd.Index(np.array(encontrados)[con_fila], name="ticker"))
+
+
+def _comparar(historial, encontrados, filas_antes, filas_ahora, solo_cambios_decision):
+    """
+    DataFrame por ticker con las decisiones antes/ahora y la variación de cada campo numérico.
+    'cambia_decision' solo compara decisiones reales: un lado sin decisión (o con un estado de filas antiguas
+    como "ERROR") no cuenta como cambio.
+    """
+    validas = (filas_antes >= 0) & (filas_ahora >= 0)
+    antes, ahora = filas_antes[validas], filas_ahora[validas]
+    columnas = historial["columnas"]
+    textos = np.append(np.asarray(historial["categorias"]), "")  # El código -1 (sin dato) cae en el "" final
+    reales = np.isin(textos, DECISIONES_VALIDAS)
+    tabla = {"instante_antes": np.asarray(historial["instante"][antes]), "instante_ahora": np.asarray(historial["instante"][ahora])}
+    cambia = np.zeros(len(antes), dtype=bool)
+    for c in CAMPOS_DECISION:
+        codigos_antes, codigos_ahora = columnas[c][antes], columnas[c][ahora]
+        tabla[f"{c}_antes"], tabla[f"{c}_ahora"] = textos[codigos_antes], textos[codigos_ahora]
+        cambia |= (codigos_antes != codigos_ahora) & reales[codigos_antes] & reales[codigos_ahora]
+    tabla["cambia_decision"] = cambia
+    for c in CAMPOS_NUMERICOS + CAMPOS_CONTEO:
+        tabla[f"Δ {c}"] = columnas[c][ahora].astype("float64") - columnas[c][antes]
+    tabla = pd.DataFrame(tabla, index=pd.Index(np.array(encontrados)[validas], name="ticker"))
+    return tabla[tabla["cambia_decision"]] if solo_cambios_decision else tabla
+
+
+def diferencias_historial(historial, desde, hasta=None, tickers=None, solo_cambios_decision=False):
+    """
+    Compara la foto de cada ticker en 'desde' con la de 'hasta' (por defecto la más reciente): decisiones
+    antes/ahora, 'cambia_decision' y 'Δ <campo>' de cada campo numérico. Solo tickers con fila en ambas fechas.
+    P.ej. los que pasaron de NEUTRAL/PRECAUCIÓN a COMPRAR esta semana:
+        d = diferencias_historial(h, hoy - 7 días)
+        d[(d.decision_algoritmo_antes == "NEUTRAL/PRECAUCIÓN") & (d.decision_algoritmo_ahora == "COMPRAR")]
+    """
+    posiciones, encontrados = _posiciones(historial, tickers)
+    filas_antes = _filas_a_fecha(historial, posiciones, desde)
+    if hasta is None:
+        filas_ahora = np.asarray(historial["inicios"])[posiciones + 1] - 1
+    else:
+        filas_ahora = _filas_a_fecha(historial, posiciones, hasta)
+    return _comparar(historial, encontrados, filas_antes, filas_ahora, solo_cambios_decision)
+
+
+def cambios_ultima_ejecucion(historial, tickers=None, referencia=None, solo_cambios_decision=False):
+    """
+    Cambios de la fila más reciente de cada ticker frente a la anterior del mismo ticker (su ejecución previa)
+    o, con 'referencia' (instante de una ejecución anterior), frente a su foto en ese instante.
+    Mismo formato que diferencias_historial.
+    """
+    posiciones, encontrados = _posiciones(historial, tickers)
+    inicios = np.asarray(historial["inicios"])
+    filas_ahora = inicios[posiciones + 1] - 1
+    if referencia is None:
+        filas_antes = filas_ahora - 1
+        filas_antes = np.where(filas_antes >= inicios[posiciones], filas_antes, -1)
+    else:
+        filas_antes = _filas_a_fecha(historial, posiciones, referencia)
+        filas_antes = np.where(filas_antes < filas_ahora, filas_antes, -1)  # La propia ejecución no es referencia
+    return _comparar(historial, encontrados, filas_antes, filas_ahora, solo_cambios_decision)
+
+
+def ejecuciones_historial(historial):
+    """DataFrame con el instante de cada ejecución registrada y su número de tickers, de la más reciente a la más antigua."""
+    if historial is None:
+        return pd.DataFrame(columns=["instante", "tickers"])
+    return pd.DataFrame({"instante": np.asarray(historial["ejecuciones"]),
+                         "tickers": np.asarray(historial["filas_ejecucion"])}).iloc[::-1].reset_index(drop=True)
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Historial sintético de ejecuciones diarias y tiempos de consulta")
+    parser.add_argument("--tickers", type=int, default=1_000)
+    parser.add_argument("--dias", type=int, default=365)
+    args = parser.parse_args()
+
+    directorio_prueba = tempfile.mkdtemp(prefix="historial_tfm_")
+    rng = np.random.default_rng(0)
+    universo = [f"T{k:05d}" for k in range(args.tickers)]
+    decisiones = np.array(DECISIONES_VALIDAS)
+    ratios = rng.uniform(0.5, 1.5, (args.tickers, len(CAMPOS_NUMERICOS)))
+    estado = rng.integers(len(decisiones), size=args.tickers)
+    inicio_historial = pd.Timestamp("2025-10-20 18:00")
+
+    print(f"\n--- 🗃️ HISTORIAL DE {args.dias} EJECUCIONES DIARIAS x {args.tickers} TICKERS ---")
+    def filas_del_dia():
+        ratios[:] *= rng.normal(1, 0.01, ratios.shape)
+        cambian = rng.random(args.tickers) < 0.02  # ~2% de tickers cambian de decisión cada día
+        estado[cambian] = rng.integers(len(decisiones), size=cambian.sum())
+        return [{'ticker': t, **dict(zip(CAMPOS_NUMERICOS, ratios[k])), 'puntos_fuertes': 2, 'alertas': 1,
+                 'alertas_criticas': 0, 'decision_algoritmo': decisiones[estado[k]], 'decision_ia': decisiones[estado[k]]}
+                for k, t in enumerate(universo)]
+
+    t0 = time.perf_counter()
+    for dia in range(args.dias):
+        anadir_ejecucion(filas_del_dia(), inicio_historial + pd.Timedelta(days=dia), directorio_prueba, compactar=False)
+    escritura_segmentos = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    compactar_historial(directorio_prueba)
+    compactacion = time.perf_counter() - t0
+    print(f"   > {args.dias} segmentos escritos en {escritura_segmentos:.1f}s; compactación inicial {compactacion:.2f}s")
+
+    # Coste diario real: un segmento más y la compactación del índice con él
+    t0 = time.perf_counter()
+    anadir_ejecucion(filas_del_dia(), inicio_historial + pd.Timedelta(days=args.dias), directorio_prueba)
+    print(f"   > Ejecución nueva (segmento + compactación): {time.perf_counter() - t0:.2f}s")
+
+    def cronometrar(nombre, funcion, repeticiones=200):
+        funcion()
+        t0 = time.perf_counter()
+        for _ in range(repeticiones):
+            resultado = funcion()
+        print(f"   > {nombre}: {(time.perf_counter() - t0) / repeticiones * 1e3:.2f} ms ({len(resultado)} filas)")
+        return resultado
+
+    _historiales_abiertos.clear()
+    t0 = time.perf_counter()
+    historial = abrir_historial(directorio_prueba)
+    print(f"   > Apertura en frío: {(time.perf_counter() - t0) * 1e3:.2f} ms ({historial['filas']:,} filas)")
+    hoy = pd.Timestamp(historial["ejecuciones"][-1])
+    cronometrar("Apertura (índice ya mapeado)", lambda: abrir_historial(directorio_prueba)["clave"])
+    cronometrar("Rango de un ticker (90 días)", lambda: historial_ticker(historial, universo[rng.integers(args.tickers)],
+                                                                         hoy - pd.Timedelta(days=90), hoy))
+    cronometrar("Foto del universo hace 6 meses", lambda: foto_historial(historial, hoy - pd.Timedelta(days=182)))
+    cambios = cronometrar("Diferencias de la última semana", lambda: diferencias_historial(historial, hoy - pd.Timedelta(days=7)))
+    cronometrar("Cambios desde la última ejecución", lambda: cambios_ultima_ejecucion(historial, solo_cambios_decision=True))
+
+    giros = cambios[(cambios["decision_algoritmo_antes"] == "NEUTRAL/PRECAUCIÓN") & (cambios["decision_algoritmo_ahora"] == "COMPRAR")]
+    print(f"   > De NEUTRAL/PRECAUCIÓN a COMPRAR en la última semana: {len(giros)} tickers, p.ej. {list(giros.index[:5])}")
+
+    # Comprobación: la foto coincide con la última fila de cada ticker en su historial completo
+    muestra = universo[:: max(1, args.tickers // 20)]
+    foto = foto_historial(historial, hoy - pd.Timedelta(days=30), muestra)
+    coincide = all(historial_ticker(historial, t, hasta=hoy - pd.Timedelta(days=30)).iloc[-1]['precio'] == foto.at[t, 'precio']
+                   for t in muestra)
+    print(f"   > Foto == última fila del rango de cada ticker: {coincide}")
+    shutil.rmtree(directorio_prueba, ignore_errors=True)
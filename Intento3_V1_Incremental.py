@@ -0,0 +1,86 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Incremental.py
+
+import hashlib
+
+from Intento3_V1_Cache import guardar_en_cache, leer_de_cache
+
+ESPACIO_ANALISIS = "analisis_ia"
+
+# Tolerancias de cambio por ratio: (relativa, absoluta). Hay cambio material si
+# |nuevo - anterior| > max(relativa * |anterior|, absoluta). La absoluta evita falsos positivos cerca de 0.
+TOLERANCIAS_POR_DEFECTO = {
+    'per_ltm': (0.05, 0.5),
+    'per_ntm': (0.05, 0.5),
+    'ratio_solvencia': (0.10, 0.2),
+    'div_yield': (0.05, 0.001),
+    'buyback_yield': (0.05, 0.002),
+    'total_yield': (0.05, 0.002),
+    'fcf_yield_ev': (0.05, 0.002),
+    'fcf_yield_mc': (0.05, 0.002),
+    'payout_ratio': (0.10, 0.05),
+}
+
+
+def _huellas_noticias(titulares):
+    """Hash de cada titular normalizado (minúsculas y espacios colapsados)."""
+    return sorted({
+        hashlib.sha1(" ".join(str(t).lower().split()).encode("utf-8")).hexdigest()
+        for t in (titulares or [])
+    })
+
+
+def _cambio_material(anterior, nuevo, tolerancia):
+    es_num_ant = isinstance(anterior, (int, float))
+    es_num_nuevo = isinstance(nuevo, (int, float))
+    if not es_num_ant or not es_num_nuevo:
+        return es_num_ant != es_num_nuevo or anterior != nuevo  # p.ej. "N/A" -> número
+    relativa, absoluta = tolerancia
+    return abs(nuevo - anterior) > max(relativa * abs(anterior), absoluta)
+
+
+def evaluar_cambios(ticker, datos, informe_gatekeeper, factor_tolerancia=1.0, tolerancias=None):
+    """
+    Compara el snapshot actual con el del último análisis IA guardado para el ticker.
+    'factor_tolerancia' escala todas las tolerancias (2.0 = el doble de permisivo).
+
+    Devuelve un dict:
+      - 'reanalizar': True si hay que volver a llamar a la IA
+      - 'motivos': lista de textos explicando el cambio (o la ausencia de análisis previo)
+      - 'analisis': la tupla (texto, prompt, decision_ia, justificacion_ia) guardada, si existe
+      - 'antiguedad': segundos desde el análisis guardado
+    """
+    tolerancias = tolerancias or TOLERANCIAS_POR_DEFECTO
+    previo, antiguedad = leer_de_cache(ESPACIO_ANALISIS, ticker)
+    if previo is None:
+        return {"reanalizar": True, "motivos": ["Sin análisis previo"], "analisis": None, "antiguedad": None}
+
+    motivos = []
+    # 1. Cambio de decisión del Gatekeeper
+    if previo["decision_gatekeeper"] != informe_gatekeeper['decision']:
+        motivos.append(f"Decisión del algoritmo: {previo['decision_gatekeeper']} → {informe_gatekeeper['decision']}")
+
+    # 2. Ratios fuera de tolerancia
+    for campo, (relativa, absoluta) in tolerancias.items():
+        anterior, nuevo = previo["ratios"].get(campo), datos.get(campo)
+        if _cambio_material(anterior, nuevo, (relativa * factor_tolerancia, absoluta * factor_tolerancia)):
+            motivos.append(f"{campo}: {anterior} → {nuevo}")
+
+    # 3. Titulares nuevos (que un titular antiguo desaparezca no cuenta)
+    nuevas = set(_huellas_noticias(datos.get('noticias'))) - set(previo["huellas_noticias"])
+    if nuevas:
+        motivos.append(f"{len(nuevas)} titular(es) nuevo(s)")
+
+    return {"reanalizar": bool(motivos), "motivos": motivos, "analisis": previo["analisis"], "antiguedad": antiguedad}
+
+
+def guardar_analisis(ticker, datos, informe_gatekeeper, analisis):
+    """
+    Guarda el snapshot que se ha enviado a la IA y su resultado
+    'analisis' = (texto, prompt, decision_ia, justificacion_ia).
+    """
+    guardar_en_cache(ESPACIO_ANALISIS, ticker, {
+        "ratios": {campo: datos.get(campo) for campo in TOLERANCIAS_POR_DEFECTO},
+        "decision_gatekeeper": informe_gatekeeper['decision'],
+        "huellas_noticias": _huellas_noticias(datos.get('noticias')),
+        "analisis": tuple(analisis),
+    })
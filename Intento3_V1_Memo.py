@@ -0,0 +1,232 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Memo.py
+
+import os
+import time
+import pickle
+import hashlib
+import inspect
+import numbers
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_Cache import guardar_en_cache, leer_de_cache
+
+# --- MEMOIZACIÓN DE LAS ETAPAS PURAS POR HUELLA DE SUS ENTRADAS ---
+# La extracción TTM solo depende de sus entradas: si los estados trimestrales de un ticker no cambian, su
+# resultado tampoco. Cada etapa memoizada guarda huella de las entradas -> resultado:
+#   - huella: blake2b del contenido (valores, índice y columnas de los DataFrames, dicts, listas y escalares) y del
+#     fichero que define la etapa (editar ese módulo invalida sus resultados memoizados)
+#   - almacén acotado: LRU de MAX_ENTRADAS_MEMO resultados por etapa en memoria, persistido en la caché
+#     ('memo/<etapa>') con guardar_memo() al final de cada ejecución y cargado la primera vez que se usa la etapa
+#   - resultados serializados con pickle: cada acierto devuelve una copia que el llamador puede modificar
+# Contadores de aciertos y fallos por etapa en contadores_memo() / informe_memo().
+# Solo compensa donde calcular cuesta bastante más que la huella ("µs por cálculo" frente a "µs por huella"):
+# los ratios de precio y el Gatekeeper son aritmética sobre una docena de campos y se recalculan siempre.
+
+ESPACIO_MEMO = "memo"
+MAX_ENTRADAS_MEMO = 20_000  # Por etapa: varios días de un universo de miles de tickers
+MEMO_ACTIVO = os.environ.get("TFM_MEMO", "1") != "0"
+
+_etapas = {}  # etapa -> estado (ver _estado_etapa)
+_cerrojo = threading.Lock()
+
+
+# --- 1. HUELLA DE CONTENIDO ---
+def _canonico(objeto):
+    """
+    Forma canónica de 'objeto' hecha de tipos básicos de Python, para serializarla de una vez con pickle:
+    los arrays y DataFrames pasan a sus bytes, los dicts a tuplas ordenadas por clave y los números de NumPy
+    a int / float (float y np.float64 con el mismo valor dan la misma huella).
+    """
+    if isinstance(objeto, (str, bool)) or objeto is None:
+        return objeto
+    if isinstance(objeto, numbers.Integral):
+        return int(objeto)
+    if isinstance(objeto, numbers.Real):
+        return float(objeto)
+    if isinstance(objeto, dict):
+        return ("{", tuple((str(clave), _canonico(valor)) for clave, valor in sorted(objeto.items(), key=lambda kv: str(kv[0]))))
+    if isinstance(objeto, (list, tuple)):
+        return ("[", tuple(_canonico(elemento) for elemento in objeto))
+    if isinstance(objeto, pd.DataFrame):
+        return ("D", _canonico(objeto.to_numpy()), _canonico(objeto.index), _canonico(objeto.columns))
+    if isinstance(objeto, pd.Series):
+        return ("S", _canonico(objeto.to_numpy()), _canonico(objeto.index), _canonico(objeto.name))
+    if isinstance(objeto, pd.DatetimeIndex):
+        return ("T", str(objeto.tz), objeto.asi8.tobytes())
+    if isinstance(objeto, pd.Index):
+        return ("I", _canonico(objeto.tolist()))
+    if isinstance(objeto, np.ndarray):
+        if objeto.dtype.kind in "biufM":
+            return ("A", str(objeto.dtype), objeto.shape, np.ascontiguousarray(objeto).tobytes())
+        return ("A", objeto.shape, _canonico(objeto.ravel().tolist()))
+    return objeto  # Otros tipos: tal cual los serialice pickle
+
+
+def huella(*objetos):
+    """Huella hexadecimal (32 caracteres) del contenido de 'objetos'."""
+    return hashlib.blake2b(pickle.dumps(_canonico(objetos), protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).hexdigest()
+
+
+def _version_codigo(funcion):
+    """Huella del fichero que define 'funcion' (o de su bytecode si no hay fichero)."""
+    try:
+        with open(inspect.getsourcefile(funcion), "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    except (OSError, TypeError):
+        return hashlib.blake2b(funcion.__code__.co_code, digest_size=8).hexdigest()
+
+
+# --- 2. ALMACÉN ACOTADO Y PERSISTENTE ---
+def _estado_etapa(etapa, version):
+    """Estado en memoria de la etapa; la primera vez se carga de la caché si es de la misma versión del código."""
+    with _cerrojo:
+        estado = _etapas.get(etapa)
+        if estado is None or estado["version"] != version:
+            persistido, _ = leer_de_cache(ESPACIO_MEMO, etapa)
+            entradas = persistido["entradas"] if persistido and persistido.get("version") == version else OrderedDict()
+            estado = {"version": version, "entradas": entradas, "cambios": False, "aciertos": 0, "fallos": 0,
+                      "segundos_calculo": 0.0, "segundos_huella": 0.0}
+            _etapas[etapa] = estado
+        return estado
+
+
+def memoizar(etapa, clave=None):
+    """
+    Decorador: memoiza la función pura en la etapa 'etapa' por la huella de sus entradas.
+    'clave(*args, **kwargs)' devuelve solo lo que la función lee (p.ej. unos campos de un dict grande);
+    sin ella se usan todos los argumentos. La función original queda en '.sin_memo'.
+    """
+    def decorador(funcion):
+        version = _version_codigo(funcion)
+
+        @wraps(funcion)
+        def memoizada(*args, **kwargs):
+            if not MEMO_ACTIVO:
+                return funcion(*args, **kwargs)
+            inicio = time.perf_counter()
+            firma = huella(clave(*args, **kwargs) if clave else (args, kwargs))
+            fin_huella = time.perf_counter()
+            estado = _estado_etapa(etapa, version)
+            with _cerrojo:
+                estado["segundos_huella"] += fin_huella - inicio
+                guardado = estado["entradas"].get(firma)
+                if guardado is not None:
+                    estado["entradas"].move_to_end(firma)
+                    estado["aciertos"] += 1
+            if guardado is not None:
+                return pickle.loads(guardado)
+
+            resultado = funcion(*args, **kwargs)
+            segundos = time.perf_counter() - fin_huella
+            serializado = pickle.dumps(resultado, protocol=pickle.HIGHEST_PROTOCOL)
+            with _cerrojo:
+                estado["fallos"] += 1
+                estado["segundos_calculo"] += segundos
+                estado["entradas"][firma] = serializado
+                estado["cambios"] = True
+                while len(estado["entradas"]) > MAX_ENTRADAS_MEMO:
+                    estado["entradas"].popitem(last=False)  # El usado hace más tiempo
+            return resultado
+
+        memoizada.sin_memo = funcion
+        return memoizada
+    return decorador
+
+
+def guardar_memo():
+    """
+    Persiste en la caché las etapas con resultados nuevos. Se mezcla con lo que otro proceso haya guardado
+    entretanto (sus entradas quedan como las menos recientes) antes de recortar a MAX_ENTRADAS_MEMO.
+    """
+    with _cerrojo:
+        pendientes = {etapa: estado for etapa, estado in _etapas.items() if estado["cambios"]}
+        for etapa, estado in pendientes.items():
+            persistido, _ = leer_de_cache(ESPACIO_MEMO, etapa)
+            if persistido and persistido.get("version") == estado["version"]:
+                ajenas = [(k, v) for k, v in persistido["entradas"].items() if k not in estado["entradas"]]
+                estado["entradas"] = OrderedDict(ajenas + list(estado["entradas"].items()))
+            while len(estado["entradas"]) > MAX_ENTRADAS_MEMO:
+                estado["entradas"].popitem(last=False)
+            try:
+                guardar_en_cache(ESPACIO_MEMO, etapa, {"version": estado["version"], "entradas": estado["entradas"]})
+                estado["cambios"] = False
+            except Exception as e:
+                print(f"Aviso: no se pudo guardar la memoización de '{etapa}': {e}")
+
+
+def borrar_memo():
+    """Vacía la memoización en memoria y en disco (los contadores vuelven a cero)."""
+    from Intento3_V1_Cache import borrar_cache
+    with _cerrojo:
+        _etapas.clear()
+    borrar_cache(ESPACIO_MEMO)
+
+
+# --- 3. CONTADORES ---
+def contadores_memo():
+    """dict etapa -> {'aciertos', 'fallos', 'entradas', 'segundos_calculo', 'segundos_huella'} acumulados en el proceso."""
+    with _cerrojo:
+        return {etapa: {"aciertos": e["aciertos"], "fallos": e["fallos"], "entradas": len(e["entradas"]),
+                        "segundos_calculo": e["segundos_calculo"], "segundos_huella": e["segundos_huella"]}
+                for etapa, e in _etapas.items()}
+
+
+def informe_memo(desde=None):
+    """
+    DataFrame por etapa con aciertos, fallos, tasa de aciertos y coste medio de calcular frente a calcular la huella.
+    Con 'desde' (un contadores_memo() anterior) cuenta solo lo ocurrido después, p.ej. en una ejecución.
+    """
+    desde = desde or {}
+    filas = []
+    for etapa, ahora in contadores_memo().items():
+        antes = desde.get(etapa, {})
+        aciertos = ahora["aciertos"] - antes.get("aciertos", 0)
+        fallos = ahora["fallos"] - antes.get("fallos", 0)
+        llamadas = aciertos + fallos
+        if not llamadas:
+            continue
+        segundos_calculo = ahora["segundos_calculo"] - antes.get("segundos_calculo", 0.0)
+        segundos_huella = ahora["segundos_huella"] - antes.get("segundos_huella", 0.0)
+        filas.append({"Etapa": etapa, "Aciertos": aciertos, "Fallos": fallos, "% aciertos": aciertos / llamadas,
+                      "Entradas": ahora["entradas"],
+                      "µs por cálculo": round(segundos_calculo / fallos * 1e6, 1) if fallos else np.nan,
+                      "µs por huella": round(segundos_huella / llamadas * 1e6, 1)})
+    return pd.DataFrame(filas, columns=["Etapa", "Aciertos", "Fallos", "% aciertos", "Entradas",
+                                        "µs por cálculo", "µs por huella"])
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import argparse
+    from Intento3_V1_Stubs import instalar_stub_yahoo
+    from Intento3_V1_Obtener_Datos import obtener_datos_financieros
+    from Intento3_V1_GateKeeper import ejecutar_gatekeeper
+    from Intento3_V1_Embudo import cargar_universo
+    # Las etapas se registran en el módulo importado (no en __main__): los contadores se leen de ahí
+    from Intento3_V1_Memo import contadores_memo, informe_memo, guardar_memo
+
+    parser = argparse.ArgumentParser(description="Dos recorridos seguidos contra el stub de Yahoo: el segundo sale de la memoización")
+    parser.add_argument("--tickers", type=int, default=24)
+    args = parser.parse_args()
+
+    instalar_stub_yahoo(latencia=0.0)
+    df_refs = cargar_universo("Referencias.xlsx").head(args.tickers)
+
+    print(f"\n--- 🧠 MEMOIZACIÓN DEL TTM ({len(df_refs)} tickers) ---")
+    for vuelta in ("1ª (en frío)", "2ª (mismas entradas)"):
+        antes = contadores_memo()
+        inicio = time.perf_counter()
+        for _, fila in df_refs.iterrows():
+            datos = obtener_datos_financieros(fila['Ticker'])
+            if datos:
+                ejecutar_gatekeeper(datos, fila)
+        print(f"\n   > Vuelta {vuelta}: {time.perf_counter() - inicio:.3f}s")
+        print(informe_memo(antes).to_string(index=False))
+    guardar_memo()
@@ -0,0 +1,106 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Noticias.py
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from Intento3_V1_Cache import guardar_en_cache, leer_de_cache
+from Intento3_V1_Perfilado import ejecutar_perfilado
+
+ESPACIO_NOTICIAS = "noticias"
+NOTICIAS_TTL_SEGUNDOS = 15 * 60   # Las noticias caducan rápido: caché corta
+MAX_TITULARES = 8                 # Máximo de titulares que se envían a la IA
+SIMILITUD_DUPLICADO = 0.8         # Jaccard de palabras a partir del cual dos titulares son "el mismo"
+
+# Hilos compartidos para lanzar descargas en segundo plano mientras se pinta la interfaz
+_EJECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="noticias")
+
+# Sufijos de agencia habituales en titulares sindicados: "... - Reuters", "... | Yahoo Finance"
+_SUFIJO_FUENTE = re.compile(r"\s+[-|–—]\s+[^-|–—]{2,40}$")
+
+
+def _palabras(titular):
+    sin_fuente = _SUFIJO_FUENTE.sub("", titular)
+    return set(re.findall(r"\w+", sin_fuente.lower()))
+
+
+def _deduplicar_titulares(titulares):
+    """
+    Elimina titulares repetidos entre fuentes sindicadas: mismo texto con distinta agencia,
+    mayúsculas o puntuación. Conserva el primero (el más reciente en Yahoo).
+    """
+    unicos, conjuntos = [], []
+    for titular in titulares:
+        palabras = _palabras(titular)
+        if not palabras:
+            continue
+        duplicado = any(
+            len(palabras & previas) / len(palabras | previas) >= SIMILITUD_DUPLICADO
+            for previas in conjuntos
+        )
+        if not duplicado:
+            unicos.append(titular.strip())
+            conjuntos.append(palabras)
+    return unicos
+
+
+def _extraer_titulares(noticias_raw):
+    titulares = []
+    for n in noticias_raw:
+        # Lógica robusta: Yahoo a veces anida la info en 'content'
+        content = n.get("content", {}) or {}
+
+        # Prioridad 1: Buscar dentro de 'content' (title > headline > summary)
+        # Prioridad 2: Buscar en la raíz (fallback por si cambia la API)
+        titulo = (content.get("title") or
+                  content.get("headline") or
+                  content.get("summary") or
+                  n.get("title")) # Fallback a raíz
+        if titulo:
+            titulares.append(titulo)
+    return titulares
+
+
+def obtener_noticias(ticker_symbol, ttl=NOTICIAS_TTL_SEGUNDOS):
+    """
+    Titulares recientes del ticker (lista de textos), deduplicados y limitados a MAX_TITULARES.
+    Se sirven desde la caché si tienen menos de 'ttl' segundos.
+    """
+    en_cache, _ = leer_de_cache(ESPACIO_NOTICIAS, ticker_symbol, ttl=ttl)
+    if en_cache is not None:
+        return en_cache
+
+    try:
+        import yfinance as yf  # Diferido: solo se paga si hay que descargar (no en los aciertos de caché)
+
+        # Recuperamos la lista bruta (o lista vacía si es None)
+        noticias_raw = yf.Ticker(ticker_symbol).news or []
+        titulares = _deduplicar_titulares(_extraer_titulares(noticias_raw))[:MAX_TITULARES]
+
+        # Gestión de lista vacía
+        if not titulares:
+            titulares = ["No hay noticias recientes disponibles en Yahoo Finance."]
+
+        guardar_en_cache(ESPACIO_NOTICIAS, ticker_symbol, titulares)
+        return titulares
+
+    except Exception as e:
+        # En caso de error no rompemos el programa (y no se guarda en caché), devolvemos aviso
+        print(f"Aviso: Error procesando noticias para {ticker_symbol}: {e}")
+        return ["No se pudieron recuperar noticias recientes (Error API)."]
+
+
+def lanzar_descarga_noticias(ticker_symbol):
+    """
+    Inicia la descarga en segundo plano y devuelve un Future; '.result()' da la lista de titulares.
+    Permite solapar la descarga con otro trabajo (pintar gráficos, Gatekeeper, etc.).
+    """
+    return _EJECUTOR.submit(ejecutar_perfilado, obtener_noticias, ticker_symbol)
+
+
+def obtener_noticias_lote(tickers, max_hilos=8):
+    """Descarga concurrente de las noticias de varios tickers. Devuelve dict ticker -> titulares."""
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_hilos, len(tickers))) as ejecutor:
+        return dict(zip(tickers, ejecutor.map(lambda t: ejecutar_perfilado(obtener_noticias, t), tickers)))
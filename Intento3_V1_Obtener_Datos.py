@@ -1,8 +1,18 @@
 # NOMBRE DEL FICHERO: gestor_datos.py
 
-import yfinance as yf
 import pandas as pd
 import json
+# yfinance se importa dentro de las funciones que descargan: es lento de importar y retrasaría
+# el primer pintado de la interfaz, que no lo necesita hasta lanzar una ejecución.
+
+from Intento3_V1_Noticias import obtener_noticias
+from Intento3_V1_Cache import guardar_en_cache, leer_de_cache
+from Intento3_V1_Proveedores import PROVEEDORES, materia_prima_yahoo
+from Intento3_V1_Memo import memoizar
+from Intento3_V1_Plazos import llamar_con_plazo
+from Intento3_V1_Perfilado import ejecutar_perfilado
+
+ESPACIO_DATOS = "datos_financieros"
 
 def _obtener_valor_ttm(df_quarterly, keys_posibles):
     """
@@ -50,193 +60,179 @@ def _obtener_dato_reciente_balance(df_balance, keys_posibles, fallback_value=0):
                 continue
     return fallback_value
 
-def obtener_datos_financieros(ticker_symbol):
+# Memoizado por la huella de los tres estados trimestrales y de los campos de 'info' que se usan (ver Intento3_V1_Memo.py)
+@memoizar("ttm", clave=lambda q_financials, q_cashflow, q_balance, info: (
+    q_financials, q_cashflow, q_balance, [info.get(k) for k in ('ebitda', 'totalDebt', 'totalCash')]))
+def _calcular_fundamentales_ttm(q_financials, q_cashflow, q_balance, info):
     """
-    Descarga y calcula ratios usando TTM (Últimos 4 Trimestres) real.
+    Numeradores TTM y datos de balance (solo cambian con cada trimestre, no con el precio).
+    Todo lo que depende de la cotización se calcula aparte en _calcular_ratios_precio.
     """
-    try:
-        empresa = yf.Ticker(ticker_symbol)
-        data = {}
-
-        # --- 1. DATOS ESTÁTICOS Y PRECIO ---
-        info = empresa.info
-        history = empresa.history(period="5y")
-        data['history'] = history
-        fast_info = empresa.fast_info
-        
-        # Precio (Lógica de respaldo robusta)
-        precio = fast_info.get('last_price')
-        if not precio: precio = info.get('currentPrice')
-        if not precio: precio = info.get('previousClose', 0)
-        data['precio'] = precio
-        
-        # Market Cap
-        m_cap = fast_info.get('market_cap')
-        if not m_cap: m_cap = info.get('marketCap', 0)
-        data['market_cap'] = m_cap
-
-        # --- 2. CARGA DE DATAFRAMES TRIMESTRALES ---
-        # Estos son vitales para el cálculo TTM
-        q_cashflow = empresa.quarterly_cashflow
-        q_financials = empresa.quarterly_financials
-        q_balance = empresa.quarterly_balance_sheet
-
-        # --- 3. RATIOS BÁSICOS ---
-        # A) CÁLCULO MANUAL DEL PER LTM (Price to Earnings)
-        # En lugar de fiarnos de 'trailingPE', lo calculamos: Market Cap / Beneficio Neto TTM
-        keys_ni = ['Net Income', 'Net Income Common Stockholders', 'Net Income Continuous Operations']
-        net_income_ttm = _obtener_valor_ttm(q_financials, keys_ni)
-        data['net_income_ttm'] = net_income_ttm # Guardamos el dato bruto por si acaso
-
-        if net_income_ttm > 0:
-            # Caso Normal: Empresa con beneficios
-            # Usamos el Market Cap que ya obtuvimos arriba
-            if data['market_cap'] > 0:
-                data['per_ltm'] = data['market_cap'] / net_income_ttm
-            else:
-                data['per_ltm'] = 0.0 # Error si no hay Market Cap
-        elif net_income_ttm < 0:
-            # Caso Pérdidas: Asignamos valor de alerta
-            # ESTRATEGIA: Asignamos -1.0 para que el Gatekeeper detecte la alerta crítica.
-            data['per_ltm'] = -1.0
-        else:
-            # Caso 0 o Error de datos (sin financial reports)
-            data['per_ltm'] = 0.0
+    f = {}
 
-        # B) Cálculo PER NTM (Forward PE)
-        data['per_ntm'] = info.get('forwardPE', 0)
-        
-        # C) Dividendo
-        raw_div_yield = info.get('dividendYield', 0)
-        if raw_div_yield is None: raw_div_yield = 0
-        data['div_yield'] = raw_div_yield / 100 if raw_div_yield > 0.2 else raw_div_yield
-
-        # --- 4. CÁLCULOS DE FLUJOS Y EBITDA TTM REALES (SUMA 4 TRIMESTRES) ---
-
-        # A) CAPEX TTM
-        keys_capex = ['Capital Expenditure', 'CapitalExpenditures', 'Purchase Of PPE', 'Net PPE Purchase And Sale']
-        # El Capex suele ser negativo, obtenemos la suma y luego usaremos abs
-        capex_ttm_raw = _obtener_valor_ttm(q_cashflow, keys_capex)
-        capex_ttm = abs(capex_ttm_raw) # Lo guardamos positivo para restar luego
-
-        # B) OPERATING CASH FLOW (OCF) TTM
-        keys_ocf = ['Operating Cash Flow', 'Total Cash From Operating Activities']
-        ocf_ttm = _obtener_valor_ttm(q_cashflow, keys_ocf)
-
-        # C) RECOMPRAS Y EMISIONES TTM
-        keys_recompras = ['Repurchase Of Capital Stock', 'Purchase Of Stock', 'Stock Repurchase']
-        recompras_ttm_raw = _obtener_valor_ttm(q_cashflow, keys_recompras) # Suele ser negativo
-        
-        keys_emisiones = ['Issuance Of Capital Stock']
-        emisiones_ttm = _obtener_valor_ttm(q_cashflow, keys_emisiones) # Suele ser positivo
-        
-        # Cálculo Neto TTM
-        recompras_netas_ttm = abs(recompras_ttm_raw) - emisiones_ttm
+    # A) BENEFICIO NETO TTM (numerador del PER LTM)
+    keys_ni = ['Net Income', 'Net Income Common Stockholders', 'Net Income Continuous Operations']
+    f['net_income_ttm'] = _obtener_valor_ttm(q_financials, keys_ni)
 
-        # D) EBITDA TTM
-        # Intentamos obtenerlo de financials trimestrales (Suma de 4Q)
-        keys_ebitda = ['Normalized EBITDA', 'EBITDA']
-        ebitda_ttm = _obtener_valor_ttm(q_financials, keys_ebitda)
-        
-        # Si no está en financials, usamos el dato de 'info' (que suele ser TTM) como fallback
-        if ebitda_ttm == 0:
-            ebitda_ttm = info.get('ebitda', 0)
+    # --- CÁLCULOS DE FLUJOS Y EBITDA TTM REALES (SUMA 4 TRIMESTRES) ---
 
-        # --- 5. DATOS DE BALANCE (FOTO MÁS RECIENTE Q1) ---
-        
-        # Deuda Total (Último trimestre)
-        keys_debt = ['Total Debt', 'Total Debt And Capital Lease Obligation']
-        total_debt = _obtener_dato_reciente_balance(q_balance, keys_debt, fallback_value=info.get('totalDebt', 0))
-        
-        # Caja Total (Último trimestre)
-        keys_cash = ['Cash And Cash Equivalents', 'Cash Cash Equivalents And Short Term Investments', 'Total Cash']
-        total_cash = _obtener_dato_reciente_balance(q_balance, keys_cash, fallback_value=info.get('totalCash', 0))
-        
-        # Enterprise Value (Recalculado con datos frescos)
-        # EV = MarketCap + Deuda - Caja
-        ev_calculado = data['market_cap'] + total_debt - total_cash
-        data['enterprise_value'] = ev_calculado if ev_calculado > 0 else data['market_cap']
+    # B) CAPEX TTM
+    keys_capex = ['Capital Expenditure', 'CapitalExpenditures', 'Purchase Of PPE', 'Net PPE Purchase And Sale']
+    # El Capex suele ser negativo, obtenemos la suma y luego usaremos abs
+    capex_ttm_raw = _obtener_valor_ttm(q_cashflow, keys_capex)
+    f['capex_ttm'] = abs(capex_ttm_raw) # Lo guardamos positivo para restar luego
 
-        # --- 6. CÁLCULO DE RATIOS FINALES ---
+    # C) OPERATING CASH FLOW (OCF) TTM
+    keys_ocf = ['Operating Cash Flow', 'Total Cash From Operating Activities']
+    f['ocf_ttm'] = _obtener_valor_ttm(q_cashflow, keys_ocf)
+
+    # D) RECOMPRAS Y EMISIONES TTM
+    keys_recompras = ['Repurchase Of Capital Stock', 'Purchase Of Stock', 'Stock Repurchase']
+    recompras_ttm_raw = _obtener_valor_ttm(q_cashflow, keys_recompras) # Suele ser negativo
+    
+    keys_emisiones = ['Issuance Of Capital Stock']
+    emisiones_ttm = _obtener_valor_ttm(q_cashflow, keys_emisiones) # Suele ser positivo
+    
+    # Cálculo Neto TTM
+    f['recompras_netas_ttm'] = abs(recompras_ttm_raw) - emisiones_ttm
+
+    # E) EBITDA TTM
+    # Intentamos obtenerlo de financials trimestrales (Suma de 4Q)
+    keys_ebitda = ['Normalized EBITDA', 'EBITDA']
+    ebitda_ttm = _obtener_valor_ttm(q_financials, keys_ebitda)
+    
+    # Si no está en financials, usamos el dato de 'info' (que suele ser TTM) como fallback
+    if ebitda_ttm == 0:
+        ebitda_ttm = info.get('ebitda', 0)
+    f['ebitda_ttm'] = ebitda_ttm
+
+    # F) FCF TTM = OCF TTM - Capex TTM
+    f['fcf_ttm'] = f['ocf_ttm'] - f['capex_ttm']
+
+    # --- DATOS DE BALANCE (FOTO MÁS RECIENTE Q1) ---
+    
+    # Deuda Total (Último trimestre)
+    keys_debt = ['Total Debt', 'Total Debt And Capital Lease Obligation']
+    f['total_debt'] = _obtener_dato_reciente_balance(q_balance, keys_debt, fallback_value=info.get('totalDebt', 0))
+    
+    # Caja Total (Último trimestre)
+    keys_cash = ['Cash And Cash Equivalents', 'Cash Cash Equivalents And Short Term Investments', 'Total Cash']
+    f['total_cash'] = _obtener_dato_reciente_balance(q_balance, keys_cash, fallback_value=info.get('totalCash', 0))
+    return f
+
+
+def _calcular_ratios_precio(precio, market_cap, per_ntm, div_yield, f):
+    """
+    Ratios que dependen de la cotización (precio / market cap) a partir de los fundamentales TTM 'f'.
+    Es lo único que hay que recalcular en un refresco intradía de cotizaciones.
+    """
+    data = {'precio': precio, 'market_cap': market_cap, 'per_ntm': per_ntm, 'div_yield': div_yield}
+    net_income_ttm = f['net_income_ttm']
+    data['net_income_ttm'] = net_income_ttm # Guardamos el dato bruto por si acaso
 
-        # 6.1 Buyback Yield
+    # A) CÁLCULO MANUAL DEL PER LTM (Price to Earnings)
+    # En lugar de fiarnos de 'trailingPE', lo calculamos: Market Cap / Beneficio Neto TTM
+    if net_income_ttm > 0:
+        # Caso Normal: Empresa con beneficios
+        # Usamos el Market Cap que ya obtuvimos arriba
         if data['market_cap'] > 0:
-            data['buyback_yield'] = recompras_netas_ttm / data['market_cap']
+            data['per_ltm'] = data['market_cap'] / net_income_ttm
         else:
-            data['buyback_yield'] = 0.0
+            data['per_ltm'] = 0.0 # Error si no hay Market Cap
+    elif net_income_ttm < 0:
+        # Caso Pérdidas: Asignamos valor de alerta
+        # ESTRATEGIA: Asignamos -1.0 para que el Gatekeeper detecte la alerta crítica.
+        data['per_ltm'] = -1.0
+    else:
+        # Caso 0 o Error de datos (sin financial reports)
+        data['per_ltm'] = 0.0
 
-        # 6.2 Solvencia (Deuda Neta / (EBITDA TTM - Capex TTM))
-        deuda_neta = total_debt - total_cash
-        flujo_solvencia = ebitda_ttm - capex_ttm # EBITDA - Capex (Owner Earnings proxy)
-        
-        if flujo_solvencia > 0:
-            data['ratio_solvencia'] = deuda_neta / flujo_solvencia
-        else:
-            data['ratio_solvencia'] = "N/A" # Riesgo alto si flujo es negativo
+    # Enterprise Value (Recalculado con datos frescos)
+    # EV = MarketCap + Deuda - Caja
+    ev_calculado = data['market_cap'] + f['total_debt'] - f['total_cash']
+    data['enterprise_value'] = ev_calculado if ev_calculado > 0 else data['market_cap']
+
+    # --- CÁLCULO DE RATIOS FINALES ---
+
+    # 1 Buyback Yield
+    if data['market_cap'] > 0:
+        data['buyback_yield'] = f['recompras_netas_ttm'] / data['market_cap']
+    else:
+        data['buyback_yield'] = 0.0
+
+    # 2 Solvencia (Deuda Neta / (EBITDA TTM - Capex TTM))
+    deuda_neta = f['total_debt'] - f['total_cash']
+    flujo_solvencia = f['ebitda_ttm'] - f['capex_ttm'] # EBITDA - Capex (Owner Earnings proxy)
+    
+    if flujo_solvencia > 0:
+        data['ratio_solvencia'] = deuda_neta / flujo_solvencia
+    else:
+        data['ratio_solvencia'] = "N/A" # Riesgo alto si flujo es negativo
+
+    # 3 FCF Yield (Sobre EV)
+    if data['enterprise_value'] > 0:
+        data['fcf_yield_ev'] = f['fcf_ttm'] / data['enterprise_value']
+    else:
+        data['fcf_yield_ev'] = 0.0
+
+    # 3.1 FCF Yield (Sobre Market Cap)
+    if data['market_cap'] > 0:
+        data['fcf_yield_mc'] = f['fcf_ttm'] / data['market_cap']
+    else:
+        data['fcf_yield_mc'] = 0.0
+
+    # 4 Yield Total (Dividendo + Recompras)
+    data['total_yield'] = data['div_yield'] + data['buyback_yield']
 
-        # 6.3 FCF Yield (Sobre EV)
-        # FCF TTM = OCF TTM - Capex TTM
-        fcf_ttm = ocf_ttm - capex_ttm
+    # 5 Payout Ratio (Dividendo / FCF)
+    if data['fcf_yield_mc'] > 0:
+        data['payout_ratio'] = (data['div_yield'] / data['fcf_yield_mc'])
+    else:
+        data['payout_ratio'] = "N/A"
         
-        if data['enterprise_value'] > 0:
-            data['fcf_yield_ev'] = fcf_ttm / data['enterprise_value']
-        else:
-            data['fcf_yield_ev'] = 0.0
+    # GUARDAMOS DATOS INTERMEDIOS (Opcional, para debug)
+    data['debug_capex_ttm'] = f['capex_ttm']
+    data['debug_ebitda_ttm'] = f['ebitda_ttm']
+    data['debug_fcf_ttm'] = f['fcf_ttm']
+    return data
 
-        #6.4.1 FCF Yield (Sobre Market Cap)
-        if data['market_cap'] > 0:
-            data['fcf_yield_mc'] = fcf_ttm / data['market_cap']
-        else:
-            data['fcf_yield_mc'] = 0.0
 
-        # 6.4 Yield Total (Dividendo + Recompras)
-        total_yield = data['div_yield'] + data['buyback_yield']
-        data['total_yield'] = total_yield
+def _construir_snapshot(materia):
+    """
+    Snapshot de ratios a partir de la materia prima de cualquier proveedor (ver Intento3_V1_Proveedores.py).
+    Es el mismo cálculo TTM/ratios para Yahoo y para los volcados locales.
+    """
+    # --- 4/5. FUNDAMENTALES TTM Y BALANCE ---
+    fundamentales = _calcular_fundamentales_ttm(materia['q_financials'], materia['q_cashflow'],
+                                                materia['q_balance'], materia['info'])
+    # Nº de acciones implícito: permite pasar de precio a market cap en los refrescos
+    precio, m_cap = materia['precio'], materia['market_cap']
+    fundamentales['acciones'] = m_cap / precio if precio and m_cap else None
 
-        # 6.5 Payout Ratio (Dividendo / FCF)
-        if data['fcf_yield_mc'] > 0:
-            data['payout_ratio'] = (data['div_yield'] / data['fcf_yield_mc'])
-        else:
-            data['payout_ratio'] = "N/A"
-            
-        # GUARDAMOS DATOS INTERMEDIOS (Opcional, para debug)
-        data['debug_capex_ttm'] = capex_ttm
-        data['debug_ebitda_ttm'] = ebitda_ttm
-        data['debug_fcf_ttm'] = fcf_ttm
+    # --- 6. RATIOS DEPENDIENTES DEL PRECIO ---
+    data = _calcular_ratios_precio(precio, m_cap, materia['per_ntm'], materia['div_yield'], fundamentales)
+    data['history'] = materia['history']
+    data['fundamentales'] = fundamentales
+    return data
 
 
-        # --- 7. EXTRACCIÓN DE NOTICIAS (CONTEXTO CUALITATIVO) ---
-        try:
-            # Recuperamos la lista bruta (o lista vacía si es None)
-            noticias_raw = empresa.news or []
-            titulares = []
-            
-            # Procesamos hasta 8 noticias como en tu referencia
-            for n in noticias_raw[:8]:
-                # Lógica robusta: Yahoo a veces anida la info en 'content'
-                content = n.get("content", {})
-                
-                # Prioridad 1: Buscar dentro de 'content' (title > headline > summary)
-                # Prioridad 2: Buscar en la raíz (fallback por si cambia la API)
-                titulo = (content.get("title") or 
-                          content.get("headline") or 
-                          content.get("summary") or 
-                          n.get("title")) # Fallback a raíz
-                
-                if titulo:
-                    titulares.append(titulo)
-            
-            # Gestión de lista vacía
-            if not titulares:
-                titulares = ["No hay noticias recientes disponibles en Yahoo Finance."]
-                
-            # Guardamos como LISTA (gestor_ia.py se encarga de convertirlo a texto con saltos de línea)
-            data['noticias'] = titulares
-            
-        except Exception as e:
-            # En caso de error inesperado, no rompemos el programa, devolvemos aviso
-            print(f"Aviso: Error procesando noticias para {ticker_symbol}: {e}")
-            data['noticias'] = ["No se pudieron recuperar noticias recientes (Error API)."]
+def obtener_datos_financieros(ticker_symbol, incluir_noticias=False):
+    """
+    Descarga y calcula ratios usando TTM (Últimos 4 Trimestres) real.
+    Las noticias no se descargan salvo que se pida 'incluir_noticias' (ver Intento3_V1_Noticias.py).
+    El resultado (con sus fundamentales TTM) se guarda en caché para los refrescos de cotización.
+    """
+    try:
+        # --- 1/2/3. DESCARGA DE YAHOO (precio, info y estados trimestrales) ---
+        data = _construir_snapshot(materia_prima_yahoo(ticker_symbol))
+
+        guardar_en_cache(ESPACIO_DATOS, ticker_symbol, data)
+
+        # --- 7. NOTICIAS (ETAPA APARTE) ---
+        # Se descargan bajo demanda con Intento3_V1_Noticias.obtener_noticias: solo las necesita la IA
+        # y la mayoría de tickers acaban en DESCARTAR. 'incluir_noticias=True' mantiene el comportamiento clásico.
+        if incluir_noticias:
+            data['noticias'] = obtener_noticias(ticker_symbol)
 
         return data
 
@@ -251,6 +247,191 @@ def obtener_datos_financieros(ticker_symbol):
         print(f"Error crítico en gestor_datos (TTM) para {ticker_symbol}: {e}")
         return None
 
+def obtener_datos_financieros_con_plazo(ticker_symbol, plazo=None, limite=None, cubrir=True):
+    """
+    obtener_datos_financieros con plazo por llamada, recortado al 'limite' de la ejecución, y con una copia de
+    cobertura si la descarga supera su p95 (ver Intento3_V1_Plazos.py). Devuelve (datos, antigüedad):
+      - descarga a tiempo: (datos, None)
+      - plazo agotado: (último snapshot de la caché aunque esté caducado, su antigüedad en segundos),
+        o (None, None) si nunca se descargó
+    """
+    try:
+        return llamar_con_plazo("yahoo", obtener_datos_financieros, ticker_symbol, plazo=plazo, limite=limite,
+                                cubrir=cubrir, aceptar=lambda datos: datos is not None), None
+    except TimeoutError as e:
+        print(f"Aviso: {ticker_symbol}: {e}; se usa el último snapshot en caché")
+        return leer_de_cache(ESPACIO_DATOS, ticker_symbol)
+
+
+def obtener_datos_financieros_lote(tickers, proveedor="yahoo", guardar=True, **opciones):
+    """
+    Snapshots de muchos tickers con el proveedor indicado ("yahoo", "ficheros" o uno registrado con
+    Intento3_V1_Proveedores.registrar_proveedor). 'opciones' se pasan al proveedor (p.ej. directorio=, max_hilos=).
+    Devuelve dict ticker -> datos (None si el proveedor no lo tiene o el cálculo falla).
+    Con 'guardar' cada snapshot va a la caché, igual que en obtener_datos_financieros.
+    """
+    materias = PROVEEDORES[proveedor](tickers, **opciones)
+    resultado = {}
+    for t in dict.fromkeys(tickers):
+        materia = materias.get(t)
+        if materia is None:
+            resultado[t] = None
+            continue
+        try:
+            resultado[t] = _construir_snapshot(materia)
+        except Exception as e:
+            print(f"Error crítico en gestor_datos (TTM) para {t}: {e}")
+            resultado[t] = None
+            continue
+        if guardar:
+            guardar_en_cache(ESPACIO_DATOS, t, resultado[t])
+    return resultado
+
+
+def obtener_cotizaciones_lote(tickers):
+    """
+    Último precio de muchos tickers con una única descarga masiva (yf.download),
+    sin pedir 'info' ni estados financieros. Devuelve dict ticker -> precio (los que fallen no aparecen).
+    """
+    import yfinance as yf
+
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+    try:
+        df = yf.download(tickers, period="5d", interval="15m", progress=False, auto_adjust=False, threads=True)
+    except Exception as e:
+        print(f"Aviso: Error en la descarga masiva de cotizaciones: {e}")
+        return {}
+    if df is None or df.empty:
+        return {}
+
+    cierres = df['Close']
+    if isinstance(cierres, pd.Series):  # Un único ticker
+        cierres = cierres.to_frame(tickers[0])
+    ultimos = cierres.ffill().iloc[-1]
+    return {t: float(p) for t, p in ultimos.items() if pd.notna(p) and p > 0}
+
+
+def recalcular_con_precio(datos_previos, precio):
+    """
+    Recalcula los ratios dependientes del precio con una cotización nueva,
+    reutilizando los fundamentales TTM de una descarga completa anterior.
+    """
+    f = datos_previos['fundamentales']
+    m_cap = precio * f['acciones'] if f.get('acciones') else datos_previos['market_cap']
+    # PER NTM (precio / BPA estimado) y Dividend Yield (DPA / precio) se escalan con la variación del precio
+    variacion = precio / datos_previos['precio'] if datos_previos['precio'] else 1.0
+    per_ntm = (datos_previos['per_ntm'] or 0) * variacion
+    div_yield = datos_previos['div_yield'] / variacion
+
+    data = _calcular_ratios_precio(precio, m_cap, per_ntm, div_yield, f)
+    data['history'] = datos_previos['history']
+    data['fundamentales'] = f
+    return data
+
+
+def obtener_datos_precalentados(tickers, ttl):
+    """
+    Snapshots completos en caché con menos de 'ttl' segundos (p.ej. los del precalentado de
+    Intento3_V1_Precalentado.py), sin ninguna descarga. Devuelve dict ticker -> datos solo con los encontrados.
+    """
+    resultado = {}
+    for t in dict.fromkeys(tickers):
+        datos, _ = leer_de_cache(ESPACIO_DATOS, t, ttl=ttl)
+        if datos is not None:
+            resultado[t] = datos
+    return resultado
+
+
+def refrescar_datos_financieros(tickers):
+    """
+    Modo "refrescar cotizaciones" (intradía): usa los fundamentales TTM en caché y solo descarga
+    precios, en bloque, para todo el universo. Devuelve (dict ticker -> datos, set de tickers caducados).
+    Los tickers sin descarga completa previa devuelven None (necesitan obtener_datos_financieros).
+    Si un precio no llega, se mantiene el último snapshot guardado y el ticker va en los caducados
+    (sus datos no son de este instante).
+    """
+    previos = {t: leer_de_cache(ESPACIO_DATOS, t)[0] for t in tickers}
+    precios = obtener_cotizaciones_lote([t for t, d in previos.items() if d])
+
+    resultado = {}
+    caducados = set()
+    for t, previo in previos.items():
+        if previo is None:
+            resultado[t] = None
+        elif t in precios:
+            resultado[t] = recalcular_con_precio(previo, precios[t])
+        else:
+            resultado[t] = previo
+            caducados.add(t)
+    return resultado, caducados
+
+def _normalizar_cotizacion_basica(q):
+    """Campos de una cotización de Yahoo (v7/quote o 'info') -> dict con los nombres del snapshot."""
+    # 'trailingAnnualDividendYield' viene en decimal; 'dividendYield' en % (mismo criterio que obtener_datos_financieros)
+    div_yield = q.get('trailingAnnualDividendYield')
+    if div_yield is None:
+        raw = q.get('dividendYield') or 0
+        div_yield = raw / 100 if raw > 0.2 else raw
+    precio = q.get('regularMarketPrice') or q.get('currentPrice') or 0
+
+    def _per(per, eps):
+        # Yahoo omite el PER cuando el EPS es negativo: lo reconstruimos con signo. None = desconocido
+        if per:
+            return per
+        if eps and precio:
+            return precio / eps
+        return None
+
+    return {
+        'precio': precio,
+        'market_cap': q.get('marketCap') or 0,
+        'per_ntm': _per(q.get('forwardPE'), q.get('epsForward') or q.get('forwardEps')),
+        'per_ltm': _per(q.get('trailingPE'), q.get('epsTrailingTwelveMonths') or q.get('trailingEps')),
+        'div_yield': div_yield or 0,
+    }
+
+
+def obtener_cotizaciones_basicas_lote(tickers, tamano_bloque=200, max_hilos=8):
+    """
+    Cotización básica (precio, market cap, PER NTM, PER LTM de Yahoo y Dividend Yield) de muchos tickers,
+    pidiendo hasta 'tamano_bloque' símbolos por petición al endpoint de cotizaciones de Yahoo.
+    Si la petición masiva falla, se recurre a 'info' ticker a ticker en paralelo.
+    Devuelve dict ticker -> cotización (los que fallen no aparecen).
+    """
+    # Sesión interna de yfinance: reutiliza cookies/crumb igual que Ticker.info
+    import yfinance as yf
+    from yfinance.data import YfData
+    from yfinance.const import _QUERY1_URL_
+
+    tickers = list(dict.fromkeys(tickers))
+    resultado, pendientes = {}, []
+    for inicio in range(0, len(tickers), tamano_bloque):
+        bloque = tickers[inicio:inicio + tamano_bloque]
+        try:
+            respuesta = YfData().get_raw_json(f"{_QUERY1_URL_}/v7/finance/quote",
+                                              params={"symbols": ",".join(bloque), "formatted": "false"})
+            for q in respuesta.get("quoteResponse", {}).get("result", []):
+                resultado[q["symbol"]] = _normalizar_cotizacion_basica(q)
+        except Exception as e:
+            print(f"Aviso: cotización masiva fallida ({e}); se consulta ticker a ticker.")
+            pendientes.extend(bloque)
+
+    def _info_individual(t):
+        try:
+            return t, _normalizar_cotizacion_basica(yf.Ticker(t).info)
+        except Exception:
+            return t, None
+
+    if pendientes:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_hilos) as ejecutor:
+            for t, q in ejecutor.map(lambda t: ejecutar_perfilado(_info_individual, t), pendientes):
+                if q:
+                    resultado[t] = q
+    return resultado
+
 # ==========================================
 # BLOQUE DE PRUEBA
 # ==========================================
@@ -259,7 +440,7 @@ if __name__ == "__main__":
     TICKER_TEST = "PAHGF" 
     print(f"\n--- 🧪 TEST TTM (Últimos 4 Trimestres) PARA: {TICKER_TEST} ---")
     
-    datos = obtener_datos_financieros(TICKER_TEST)
+    datos = obtener_datos_financieros(TICKER_TEST, incluir_noticias=True)
     
     if datos:
         print("\n✅ EXTRACCIÓN TTM EXITOSA.")
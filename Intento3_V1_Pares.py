@@ -0,0 +1,201 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Pares.py
+
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_Exportacion import valor_numerico
+
+# --- COMPARACIÓN CON LOS PARES DEL SECTOR / SUBSECTOR ---
+# Medianas y percentiles en vivo de las métricas clave entre todos los snapshots descargados, agrupados por
+# Subsector (o por Sector si el subsector no llega a MIN_PARES empresas con datos). Sirven para:
+#   - sustituir las medianas Ref_* escritas a mano por las de los pares (modo pares del Gatekeeper)
+#   - situar cada ticker en un percentil frente a sus pares ('Percentil_Pares': 0 = el peor, 100 = el mejor)
+# El registro se actualiza según llegan snapshots y solo recalcula los grupos en los que ha entrado o cambiado
+# alguno: cada recálculo es un único groupby vectorizado sobre las filas de esos grupos.
+
+METRICAS_PARES = {
+    # métrica del snapshot: (columna Ref_* equivalente, factor a las unidades del Excel, mejor cuanto mayor)
+    'per_ltm': ('Ref_PER_LTM_Mediana', 1, False),
+    'per_ntm': ('Ref_PER_NTM_Mediana', 1, False),
+    'fcf_yield_ev': ('Ref_FCF_Yield_Mediana', 100, True),
+    'total_yield': ('Ref_Total_Yield', 100, True),
+    'ratio_solvencia': ('Ref_Solvencia_Mediana', 1, False),
+}
+NIVELES_PARES = ('Subsector', 'Sector')  # Del más específico al más general
+MIN_PARES = 3                            # Empresas con dato necesarias para que un grupo sea comparable
+CUANTILES = (0.25, 0.5, 0.75)
+
+_METRICAS = list(METRICAS_PARES)
+_SIGNOS = np.array([1.0 if mejor_mayor else -1.0 for _, _, mejor_mayor in METRICAS_PARES.values()])
+
+
+def _valor_metrica(metrica, valor):
+    """float comparable o NaN ('N/A', infinitos, el centinela de solvencia y los PER sin beneficios no son datos)."""
+    valor = valor_numerico(valor, np.nan)
+    if metrica.startswith('per_') and valor <= 0:
+        return np.nan
+    return valor
+
+
+def nuevo_registro_pares(df_referencias):
+    """
+    Registro vacío para el universo de 'df_referencias' (columnas Ticker, Sector y Subsector).
+    Los tickers sin sector o subsector en el Excel (o universos sin esas columnas) no forman grupo a ese nivel.
+    """
+    grupos = (df_referencias.drop_duplicates(subset='Ticker').set_index('Ticker').reindex(columns=list(NIVELES_PARES))
+              .apply(lambda columna: columna.astype("string").str.strip().replace("", pd.NA)))
+    return {
+        "grupos": grupos,
+        "valores": {},                                 # ticker -> array de METRICAS_PARES
+        "miembros": {n: {} for n in NIVELES_PARES},    # nivel -> grupo -> set de tickers con snapshot
+        "pendientes": set(),                           # (nivel, grupo) por recalcular
+        "estadisticas": {n: {} for n in NIVELES_PARES},  # nivel -> grupo -> {(métrica, cuantil): valor, ("N", ""): n}
+        "percentiles": {n: {} for n in NIVELES_PARES},    # nivel -> ticker -> array de percentiles por métrica
+    }
+
+
+def actualizar_pares(registro, snapshots):
+    """
+    Añade o sustituye los snapshots (dict ticker -> datos) y marca sus grupos para recalcular.
+    Los tickers que no están en las referencias se ignoran; los snapshots sin cambios no cuestan recálculo.
+    """
+    for ticker, datos in snapshots.items():
+        if not datos or ticker not in registro["grupos"].index:
+            continue
+        valores = np.array([_valor_metrica(m, datos.get(m)) for m in _METRICAS])
+        previo = registro["valores"].get(ticker)
+        if previo is not None and np.array_equal(previo, valores, equal_nan=True):
+            continue
+        registro["valores"][ticker] = valores
+        for nivel in NIVELES_PARES:
+            grupo = registro["grupos"].at[ticker, nivel]
+            if pd.notna(grupo):
+                registro["miembros"][nivel].setdefault(grupo, set()).add(ticker)
+                registro["pendientes"].add((nivel, grupo))
+
+
+def _recalcular(registro):
+    """Recalcula estadísticas y percentiles solo de los grupos pendientes (un groupby por nivel)."""
+    for nivel in NIVELES_PARES:
+        sucios = {grupo for n, grupo in registro["pendientes"] if n == nivel}
+        if not sucios:
+            continue
+        tickers = sorted(set().union(*(registro["miembros"][nivel][g] for g in sucios)))
+        tabla = pd.DataFrame(np.vstack([registro["valores"][t] for t in tickers]), index=tickers, columns=_METRICAS)
+        claves = registro["grupos"].loc[tickers, nivel]  # Serie alineada con la tabla (no array: pandas la buscaría como columna)
+        por_grupo = tabla.groupby(claves)
+
+        # Medianas y cuantiles: NaN donde el grupo no tiene MIN_PARES datos de esa métrica
+        cuenta = por_grupo.count()
+        cuantiles = por_grupo.quantile(list(CUANTILES)).unstack()
+        cuantiles = cuantiles.where(cuenta.reindex(columns=cuantiles.columns, level=0).to_numpy() >= MIN_PARES)
+        cuantiles[("N", "")] = por_grupo.size()
+
+        # Percentil orientado (100 = mejor del grupo): (posición - 1) / (n - 1) entre los que tienen dato
+        orientada = tabla * _SIGNOS
+        posicion = orientada.groupby(claves).rank(method="average")
+        n_datos = orientada.groupby(claves).transform("count")
+        percentiles = ((posicion - 1) / (n_datos - 1) * 100).where(n_datos >= MIN_PARES)
+
+        # Solo se sustituyen las entradas de los grupos recalculados (coste proporcional a su tamaño)
+        registro["estadisticas"][nivel].update(cuantiles.to_dict("index"))
+        registro["percentiles"][nivel].update(zip(tickers, percentiles.to_numpy()))
+    registro["pendientes"].clear()
+
+
+def _nivel_de(registro, ticker):
+    """(nivel, grupo) más específico con al menos MIN_PARES empresas con snapshot, o (None, None)."""
+    if ticker not in registro["grupos"].index:
+        return None, None
+    for nivel in NIVELES_PARES:
+        grupo = registro["grupos"].at[ticker, nivel]
+        if pd.notna(grupo) and len(registro["miembros"][nivel].get(grupo, ())) >= MIN_PARES:
+            return nivel, grupo
+    return None, None
+
+
+def percentiles_ticker(registro, ticker):
+    """
+    dict con 'nivel', 'grupo', 'n' (empresas del grupo), el percentil de cada métrica (NaN sin dato)
+    y 'compuesto' (media de los disponibles). None si el ticker no tiene pares suficientes.
+    """
+    _recalcular(registro)
+    nivel, grupo = _nivel_de(registro, ticker)
+    if nivel is None or ticker not in registro["percentiles"][nivel]:
+        return None
+    fila = registro["percentiles"][nivel][ticker]
+    con_dato = fila[~np.isnan(fila)]
+    return {"nivel": nivel, "grupo": grupo, "n": len(registro["miembros"][nivel][grupo]),
+            **dict(zip(_METRICAS, fila.tolist())), "compuesto": float(con_dato.mean()) if len(con_dato) else np.nan}
+
+
+def referencias_pares(registro, fila_ref):
+    """
+    Copia de la fila de referencias con las medianas Ref_* sustituidas por las de los pares (en las unidades
+    del Excel) y las columnas 'Percentil_Pares' y 'Grupo_Pares' que lee el Gatekeeper.
+    Las métricas sin pares suficientes conservan la referencia del Excel; sin pares, 'Percentil_Pares' es NaN.
+    """
+    fila = fila_ref.copy()
+    fila['Percentil_Pares'], fila['Grupo_Pares'] = np.nan, ""
+    posicion = percentiles_ticker(registro, fila_ref['Ticker'])
+    if posicion is None:
+        return fila
+
+    medianas = registro["estadisticas"][posicion["nivel"]][posicion["grupo"]]
+    for metrica, (columna_ref, factor, _) in METRICAS_PARES.items():
+        mediana = medianas[(metrica, 0.5)]
+        if pd.notna(mediana):
+            fila[columna_ref] = mediana * factor
+    fila['Percentil_Pares'] = posicion["compuesto"]
+    fila['Grupo_Pares'] = f"{posicion['nivel'].lower()} {posicion['grupo']} ({posicion['n']} empresas)"
+    return fila
+
+
+def estadisticas_pares(registro, nivel="Subsector"):
+    """DataFrame por grupo del 'nivel' con N y las medianas y cuartiles de cada métrica (para la interfaz)."""
+    _recalcular(registro)
+    columnas = [("N", "")] + [(m, q) for m in _METRICAS for q in CUANTILES]
+    tabla = pd.DataFrame.from_dict(registro["estadisticas"][nivel], orient="index", columns=columnas).sort_index()
+    tabla.columns = ["N"] + [f"{m} p{int(q * 100)}" for m in _METRICAS for q in CUANTILES]
+    return tabla
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import time
+
+    N_TICKERS, N_SUBSECTORES = 5_000, 60
+    rng = np.random.default_rng(0)
+    subsectores = [f"Subsector {k}" for k in range(N_SUBSECTORES)]
+    universo = pd.DataFrame({
+        'Ticker': [f"T{k:05d}" for k in range(N_TICKERS)],
+        'Subsector': rng.choice(subsectores, N_TICKERS),
+    })
+    universo['Sector'] = "Sector " + (universo['Subsector'].str.split().str[-1].astype(int) // 6).astype(str)
+    snapshots = {t: {'per_ltm': rng.uniform(-5, 40), 'per_ntm': rng.uniform(5, 35), 'fcf_yield_ev': rng.uniform(-0.02, 0.09),
+                     'total_yield': rng.uniform(0, 0.08), 'ratio_solvencia': rng.choice([rng.uniform(-1, 6), "N/A"])}
+                 for t in universo['Ticker']}
+
+    print(f"\n--- 👥 PARES DE {N_TICKERS} TICKERS EN {N_SUBSECTORES} SUBSECTORES ---")
+    registro = nuevo_registro_pares(universo)
+    t0 = time.perf_counter()
+    actualizar_pares(registro, snapshots)
+    tabla = estadisticas_pares(registro)
+    print(f"   > Carga inicial y recálculo completo: {time.perf_counter() - t0:.3f}s ({len(tabla)} subsectores)")
+
+    # Llegada incremental: un snapshot nuevo solo recalcula su subsector y su sector
+    t0 = time.perf_counter()
+    for t in universo['Ticker'].head(100):
+        actualizar_pares(registro, {t: dict(snapshots[t], per_ltm=rng.uniform(5, 40))})
+        fila = referencias_pares(registro, universo[universo['Ticker'] == t].iloc[0])
+    print(f"   > 100 llegadas incrementales con sus referencias: {(time.perf_counter() - t0) / 100 * 1e3:.2f} ms por ticker")
+    print(f"   > {t}: percentil {fila['Percentil_Pares']:.0f} frente al {fila['Grupo_Pares']}; "
+          f"PER LTM de referencia {fila['Ref_PER_LTM_Mediana']:.1f}x")
+
+    # Comprobación: el incremental coincide con un recálculo desde cero
+    completo = nuevo_registro_pares(universo)
+    actualizar_pares(completo, {t: {m: v for m, v in zip(_METRICAS, registro["valores"][t])} for t in registro["valores"]})
+    iguales = estadisticas_pares(completo).equals(estadisticas_pares(registro))
+    print(f"   > Incremental == recálculo completo: {iguales}")
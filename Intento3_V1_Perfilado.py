@@ -0,0 +1,267 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Perfilado.py
+
+import os
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+
+# --- PERFILADO BAJO DEMANDA DE UNA EJECUCIÓN ---
+# Se activa para una sola ejecución (casilla de la barra lateral o --perfilar en la consola) y guarda:
+#   <base>.pstats      -> perfil de CPU de cProfile (pstats.Stats, snakeviz, gprof2dot...)
+#   <base>.collapsed   -> pilas muestreadas en formato "plegado" (una línea 'a;b;c N'), para flamegraph.pl,
+#                         speedscope o inferno
+#   <base>.tracemalloc -> instantánea de tracemalloc (tracemalloc.Snapshot.load) con el origen de cada reserva
+# cProfile y el muestreo de pilas siguen al hilo que inicia el perfilado (el de la ejecución) y a los hilos de
+# trabajo que pasan por ejecutar_perfilado (llamadas con plazo de Intento3_V1_Plazos, noticias, cotizaciones en
+# bloque): cada uno lleva su propio cProfile, que se suma al perfil al terminar.
+# Los hilos de trabajo y tracemalloc son de todo el proceso: con otras sesiones perfilando a la vez, su trabajo
+# aparece en todos los perfiles activos. tracemalloc se arranca con el primer perfilado activo y se para al
+# terminar el último (si lo arrancó este módulo).
+
+DIRECTORIO_PERFILES = os.environ.get("TFM_PERFILES_DIR", "perfiles")
+INTERVALO_MUESTREO = 0.005   # Segundos entre muestras de pila (~200 Hz)
+PROFUNDIDAD_TRACEMALLOC = 10  # Marcos guardados por reserva (más = más detalle y más coste)
+TOP_POR_DEFECTO = 15
+
+_perfiladores_activos = []      # Perfilados en marcha en el proceso (todas las sesiones)
+_tracemalloc_propio = False     # tracemalloc lo arrancó este módulo (y lo para al terminar el último perfilado)
+_cerrojo = threading.Lock()
+
+
+def ruta_perfil_nueva(prefijo="perfil", directorio=DIRECTORIO_PERFILES):
+    """Ruta base (sin extensión) para los ficheros de un perfilado nuevo, con fecha y hora."""
+    os.makedirs(directorio, exist_ok=True)
+    return os.path.join(directorio, f"{prefijo}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+
+def _muestrear_pilas(perfilador, intervalo):
+    """Muestrea las pilas del hilo de la ejecución y de los hilos de trabajo en curso ('hilos' del perfilador)."""
+    while not perfilador["parar"].wait(intervalo):
+        with _cerrojo:
+            hilos = list(perfilador["hilos"])
+        marcos = sys._current_frames()
+        for id_hilo in hilos:
+            marco = marcos.get(id_hilo)
+            pila = []
+            while marco is not None:
+                codigo = marco.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                marco = marco.f_back
+            if pila:
+                perfilador["pilas"][";".join(reversed(pila))] += 1
+
+
+def ejecutar_perfilado(funcion, *args, **kwargs):
+    """
+    Ejecuta funcion(*args, **kwargs) en el hilo actual. Si hay perfilados activos, el hilo se perfila con su propio
+    cProfile (que se suma a todos ellos) y entra en su muestreo de pilas mientras dura la llamada.
+    Para envolver el trabajo que se hace en otros hilos (Thread, ThreadPoolExecutor).
+    """
+    with _cerrojo:
+        activos = list(_perfiladores_activos)
+    if not activos:
+        return funcion(*args, **kwargs)
+
+    id_hilo = threading.get_ident()
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        perfil = None  # Python 3.12+: ya hay otro perfilador de CPU activo
+    with _cerrojo:
+        for perfilador in activos:
+            perfilador["hilos"].add(id_hilo)
+    try:
+        return funcion(*args, **kwargs)
+    finally:
+        if perfil is not None:
+            perfil.disable()
+        with _cerrojo:
+            for perfilador in activos:
+                perfilador["hilos"].discard(id_hilo)
+                if perfil is not None:
+                    perfilador["perfiles_hilos"].append(perfil)
+
+
+def iniciar_perfilado(intervalo=INTERVALO_MUESTREO):
+    """
+    Empieza a perfilar el hilo actual y sus hilos de trabajo (CPU con cProfile y muestreo de pilas, ver
+    ejecutar_perfilado) y las reservas de memoria del proceso.
+    Devuelve el perfilador (dict) que se pasa a detener_perfilado.
+    """
+    global _tracemalloc_propio
+    perfilador = {"inicio": time.perf_counter(), "cprofile": cProfile.Profile(), "pilas": Counter(),
+                  "parar": threading.Event(), "hilos": {threading.get_ident()}, "perfiles_hilos": []}
+    with _cerrojo:
+        if not _perfiladores_activos:
+            _tracemalloc_propio = not tracemalloc.is_tracing()
+            if _tracemalloc_propio:
+                tracemalloc.start(PROFUNDIDAD_TRACEMALLOC)
+        _perfiladores_activos.append(perfilador)
+        tracemalloc.reset_peak()
+    try:
+        perfilador["cprofile"].enable()
+    except ValueError as e:
+        # Python 3.12+: solo puede haber un perfilador de CPU activo por proceso (p.ej. otra sesión perfilando)
+        print(f"Aviso: perfil de CPU no disponible en esta ejecución: {e}")
+        perfilador["cprofile"] = None
+    perfilador["muestreador"] = threading.Thread(
+        target=_muestrear_pilas, args=(perfilador, intervalo), daemon=True, name="muestreo_pilas")
+    perfilador["muestreador"].start()
+    return perfilador
+
+
+def _nombre_funcion(clave):
+    fichero, linea, funcion = clave
+    if fichero == "~":
+        return funcion  # Funciones internas de C, p.ej. <method 'join' of 'str' objects>
+    return f"{funcion} ({os.path.basename(fichero)}:{linea})"
+
+
+def _combinar_perfiles(perfiles):
+    """pstats.Stats con la suma de varios cProfile.Profile (los vacíos se ignoran); None si no hay ninguno."""
+    estadisticas = None
+    for perfil in perfiles:
+        try:
+            parcial = pstats.Stats(perfil)
+        except TypeError:
+            continue  # Perfil sin ninguna llamada registrada
+        if estadisticas is None:
+            estadisticas = parcial
+        else:
+            estadisticas.add(parcial)
+    return estadisticas
+
+
+def hotspots_cpu(estadisticas, top_n=TOP_POR_DEFECTO):
+    """DataFrame con las 'top_n' funciones con más tiempo propio (sin contar lo que llaman) de un pstats.Stats."""
+    if estadisticas is None:
+        estadisticas = pstats.Stats()  # Sin perfil de CPU: tabla vacía
+    filas = [{"Función": _nombre_funcion(clave), "Llamadas": llamadas, "Tiempo propio (s)": round(propio, 4),
+              "Tiempo acumulado (s)": round(acumulado, 4)}
+             for clave, (_, llamadas, propio, acumulado, _) in estadisticas.stats.items()]
+    if not filas:
+        return pd.DataFrame(columns=["Función", "Llamadas", "Tiempo propio (s)", "Tiempo acumulado (s)"])
+    return pd.DataFrame(filas).sort_values("Tiempo propio (s)", ascending=False).head(top_n).reset_index(drop=True)
+
+
+def hotspots_memoria(instantanea, top_n=TOP_POR_DEFECTO):
+    """DataFrame con las 'top_n' líneas de código con más memoria reservada y aún viva al terminar."""
+    if instantanea is None:
+        return pd.DataFrame(columns=["Línea", "Memoria (KB)", "Bloques"])  # tracemalloc parado desde fuera
+    instantanea = instantanea.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                             tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                                             tracemalloc.Filter(False, "<unknown>")])
+    filas = [{"Línea": f"{os.path.basename(e.traceback[0].filename)}:{e.traceback[0].lineno}",
+              "Memoria (KB)": round(e.size / 1024, 1), "Bloques": e.count}
+             for e in instantanea.statistics("lineno")[:top_n]]
+    return pd.DataFrame(filas, columns=["Línea", "Memoria (KB)", "Bloques"])
+
+
+def detener_perfilado(perfilador, ruta_base=None, top_n=TOP_POR_DEFECTO):
+    """
+    Detiene el perfilado y, si se indica 'ruta_base', guarda los ficheros .pstats, .collapsed y .tracemalloc.
+    Devuelve un dict:
+      - 'segundos': duración perfilada
+      - 'cpu': DataFrame de hotspots de CPU (ver hotspots_cpu); vacío si cProfile no estaba disponible
+      - 'estadisticas': pstats.Stats del hilo de la ejecución y sus hilos de trabajo (None sin cProfile)
+      - 'memoria': DataFrame de hotspots de memoria (ver hotspots_memoria)
+      - 'pico_memoria_mb': pico de memoria trazada por tracemalloc durante el perfilado
+      - 'muestras': nº de pilas muestreadas
+      - 'rutas': ficheros guardados
+    """
+    if perfilador["cprofile"] is not None:
+        perfilador["cprofile"].disable()
+    perfilador["parar"].set()
+    perfilador["muestreador"].join()
+    segundos = time.perf_counter() - perfilador["inicio"]
+
+    with _cerrojo:
+        # Solo este módulo lo para bajo el cerrojo, pero otro código podría haberlo parado por su cuenta
+        instantanea = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        _, pico = tracemalloc.get_traced_memory()
+        _perfiladores_activos.remove(perfilador)
+        if not _perfiladores_activos and _tracemalloc_propio:
+            tracemalloc.stop()
+        perfiles = [perfilador["cprofile"]] + perfilador["perfiles_hilos"]
+
+    estadisticas = _combinar_perfiles(p for p in perfiles if p is not None)
+    rutas = []
+    if ruta_base:
+        os.makedirs(os.path.dirname(ruta_base) or ".", exist_ok=True)
+        if estadisticas is not None:
+            estadisticas.dump_stats(f"{ruta_base}.pstats")
+            rutas.append(f"{ruta_base}.pstats")
+        with open(f"{ruta_base}.collapsed", "w", encoding="utf-8") as f:
+            for pila, muestras in perfilador["pilas"].most_common():
+                f.write(f"{pila} {muestras}\n")
+        rutas.append(f"{ruta_base}.collapsed")
+        if instantanea is not None:
+            instantanea.dump(f"{ruta_base}.tracemalloc")
+            rutas.append(f"{ruta_base}.tracemalloc")
+
+    return {
+        "segundos": round(segundos, 2),
+        "cpu": hotspots_cpu(estadisticas, top_n),
+        "estadisticas": estadisticas,
+        "memoria": hotspots_memoria(instantanea, top_n),
+        "pico_memoria_mb": round(pico / 1024 ** 2, 1),
+        "muestras": sum(perfilador["pilas"].values()),
+        "rutas": rutas,
+    }
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import Intento3_V1_Cache
+    from Intento3_V1_Stubs import instalar_stub_yahoo
+    from Intento3_V1_Obtener_Datos import obtener_datos_financieros_con_plazo
+    from Intento3_V1_GateKeeper import ejecutar_gatekeeper
+    from Intento3_V1_Embudo import cargar_universo
+    # Las funciones se toman del módulo importado (no de __main__): su registro de perfilados es el que ven los hilos
+    from Intento3_V1_Perfilado import iniciar_perfilado, detener_perfilado
+
+    parser = argparse.ArgumentParser(description="Perfila descarga + Gatekeeper de unos tickers contra el stub de Yahoo")
+    parser.add_argument("--tickers", type=int, default=10)
+    parser.add_argument("--top", type=int, default=TOP_POR_DEFECTO)
+    parser.add_argument("--guardar", action="store_true", help=f"Guardar los ficheros en '{DIRECTORIO_PERFILES}'")
+    args = parser.parse_args()
+
+    Intento3_V1_Cache.DIRECTORIO_CACHE = tempfile.mkdtemp(prefix="perfilado_tfm_")  # Caché y memo vacíos: todo se calcula
+    instalar_stub_yahoo(latencia=0.02)
+    df_refs = cargar_universo("Referencias.xlsx").head(args.tickers)
+
+    print(f"\n--- 🔬 PERFILADO DE {len(df_refs)} TICKERS (stub de Yahoo) ---")
+    perfilador = iniciar_perfilado()
+    for _, fila in df_refs.iterrows():
+        # Mismo camino que la app: la descarga corre en un hilo de Intento3_V1_Plazos
+        datos, _ = obtener_datos_financieros_con_plazo(fila['Ticker'])
+        if datos:
+            ejecutar_gatekeeper(datos, fila)
+    informe = detener_perfilado(perfilador, ruta_perfil_nueva() if args.guardar else None, top_n=args.top)
+
+    # El trabajo de los hilos de la descarga tiene que estar en el perfil de CPU y en las pilas muestreadas
+    funciones = {funcion for _, _, funcion in informe["estadisticas"].stats}
+    assert "_calcular_fundamentales_ttm" in funciones, "el perfil de CPU no sigue a los hilos de Intento3_V1_Plazos"
+    pilas_snapshot = sum(n for pila, n in perfilador["pilas"].items() if "_construir_snapshot" in pila)
+    print(f"   > Hilos de trabajo seguidos: _calcular_fundamentales_ttm en el perfil de CPU, "
+          f"{pilas_snapshot}/{informe['muestras']} pilas con _construir_snapshot")
+
+    print(f"   > {informe['segundos']}s, {informe['muestras']} muestras de pila, "
+          f"pico de memoria trazada {informe['pico_memoria_mb']} MB")
+    print("\n   CPU (tiempo propio):")
+    print(informe["cpu"].to_string(index=False))
+    print("\n   Memoria viva por línea:")
+    print(informe["memoria"].to_string(index=False))
+    if informe["rutas"]:
+        print(f"\n   > Guardado en: {', '.join(informe['rutas'])}")
@@ -0,0 +1,261 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Plazos.py
+
+import math
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_Perfilado import ejecutar_perfilado
+
+# --- PLAZOS POR LLAMADA Y POR EJECUCIÓN, CON PETICIONES DE COBERTURA ---
+# Una llamada a Yahoo o a Gemini que se cuelga no debe parar todo el recorrido:
+#   - plazo por llamada: pasado ese tiempo se abandona la espera (TimeoutError) y el llamador degrada el resultado
+#     (snapshot caducado de la caché, solo Gatekeeper...). El hilo colgado no se puede matar: termina por su cuenta.
+#   - plazo de la ejecución: instante límite (time.monotonic) que recorta el plazo de cada llamada posterior
+#   - cobertura ("hedged request"): si la llamada supera el p95 de las latencias observadas para esa operación,
+#     se lanza una copia idéntica y gana la primera respuesta válida. Con el p95 como disparador, solo ~5% de las
+#     llamadas se duplican; FRACCION_MAX_COBERTURAS acota además la carga extra ante una degradación general.
+#     Solo entran en el percentil las copias que terminan mientras alguien las espera: un plazo agotado no
+#     es una latencia (solo una cota) y una copia abandonada que acaba tarde empujaría el p95 hacia el plazo
+#     hasta dejar de cubrir. Por lo mismo el disparador nunca pasa de FRACCION_MAX_UMBRAL del plazo.
+#     Las operaciones de OPERACIONES_FACTURADAS (Gemini) no se cubren: la copia perdedora también se paga.
+# Cada copia corre en un hilo demonio propio: una llamada colgada no retiene el cierre del proceso.
+
+PLAZOS_POR_DEFECTO = {"yahoo": 30.0, "gemini": 90.0, "noticias": 10.0}  # Segundos por llamada
+COBERTURA_INICIAL = {"yahoo": 8.0, "gemini": 30.0, "noticias": 4.0}     # Disparador hasta tener MIN_MUESTRAS
+PERCENTIL_COBERTURA = 95
+MIN_MUESTRAS = 10
+VENTANA_MUESTRAS = 200              # Latencias recientes por operación con las que se estima el percentil
+FRACCION_MAX_COBERTURAS = 0.1       # Como mucho ~10% de llamadas extra por operación
+FRACCION_MAX_UMBRAL = 0.5           # El disparador de la copia no pasa de la mitad del plazo de la llamada
+OPERACIONES_FACTURADAS = {"gemini"} # Cada petición se cobra: sin copias de cobertura
+
+_latencias = {}   # operación -> deque de segundos
+_contadores = {}  # operación -> {'llamadas', 'coberturas', 'ganadas_por_cobertura', 'agotadas', 'fallidas'}
+_cerrojo = threading.Lock()
+
+
+# --- 1. PLAZO DE LA EJECUCIÓN ---
+def limite_ejecucion(segundos):
+    """Instante límite (time.monotonic) para una ejecución de 'segundos' de duración; None = sin límite."""
+    return time.monotonic() + segundos if segundos else None
+
+
+def restante(limite):
+    """Segundos que quedan hasta 'limite' (infinito si es None; puede ser negativo si ya pasó)."""
+    return math.inf if limite is None else limite - time.monotonic()
+
+
+# --- 2. LATENCIAS OBSERVADAS ---
+def _contador(operacion):
+    return _contadores.setdefault(operacion, {"llamadas": 0, "coberturas": 0, "ganadas_por_cobertura": 0,
+                                              "agotadas": 0, "fallidas": 0})
+
+
+def registrar_latencia(operacion, segundos):
+    with _cerrojo:
+        _latencias.setdefault(operacion, deque(maxlen=VENTANA_MUESTRAS)).append(segundos)
+
+
+def umbral_cobertura(operacion, plazo=None):
+    """
+    Segundos de espera antes de lanzar la copia: p95 de las latencias recientes (o el valor inicial),
+    como mucho FRACCION_MAX_UMBRAL del 'plazo' de la llamada.
+    """
+    with _cerrojo:
+        muestras = list(_latencias.get(operacion, ()))
+    if len(muestras) < MIN_MUESTRAS:
+        umbral = COBERTURA_INICIAL.get(operacion, PLAZOS_POR_DEFECTO.get(operacion, 30.0) / 2)
+    else:
+        umbral = float(np.percentile(muestras, PERCENTIL_COBERTURA))
+    return min(umbral, FRACCION_MAX_UMBRAL * plazo) if plazo else umbral
+
+
+def _lanzar(operacion, funcion, args, kwargs, abandonada):
+    """
+    Ejecuta la función en un hilo demonio y devuelve su Future. Al terminar registra su latencia,
+    salvo que la llamada ya se haya abandonado (evento 'abandonada': plazo agotado u otra copia ganó).
+    """
+    futuro = Future()
+
+    def _ejecutar():
+        inicio = time.perf_counter()
+        try:
+            resultado, error = ejecutar_perfilado(funcion, *args, **kwargs), None
+        except BaseException as e:
+            resultado, error = None, e
+        # Antes de publicar el resultado: el llamador, al despertar, ya no puede marcarla como abandonada
+        if not abandonada.is_set():
+            registrar_latencia(operacion, time.perf_counter() - inicio)
+        if error is None:
+            futuro.set_result(resultado)
+        else:
+            futuro.set_exception(error)
+
+    threading.Thread(target=_ejecutar, daemon=True, name=f"plazo_{operacion}").start()
+    return futuro
+
+
+# --- 3. LLAMADA CON PLAZO Y COBERTURA ---
+def llamar_con_plazo(operacion, funcion, *args, plazo=None, limite=None, cubrir=True, aceptar=None, **kwargs):
+    """
+    Llama a funcion(*args, **kwargs) con un plazo de 'plazo' segundos (por defecto PLAZOS_POR_DEFECTO[operacion]),
+    recortado al 'limite' de la ejecución (ver limite_ejecucion). Con 'cubrir', si la llamada supera el umbral de
+    cobertura de la operación se lanza una copia y gana la primera respuesta válida (nunca en OPERACIONES_FACTURADAS).
+    'aceptar(resultado)' decide si un resultado es válido (p.ej. descartar None); uno no válido o una excepción
+    no ganan mientras quede otra copia en marcha.
+    Lanza TimeoutError si no hay respuesta válida a tiempo; si todas las copias fallan, la última excepción
+    (o devuelve el último resultado no válido).
+    """
+    plazo = min(plazo or PLAZOS_POR_DEFECTO.get(operacion, 30.0), restante(limite))
+    with _cerrojo:
+        contador = _contador(operacion)
+        contador["llamadas"] += 1
+    if plazo <= 0:
+        with _cerrojo:
+            contador["agotadas"] += 1
+        raise TimeoutError(f"{operacion}: plazo de la ejecución agotado")
+
+    inicio = time.monotonic()
+    fin = inicio + plazo
+    abandonada = threading.Event()
+    try:
+        return _esperar_copias(operacion, funcion, args, kwargs, contador, inicio, fin,
+                               cubrir and operacion not in OPERACIONES_FACTURADAS, aceptar, abandonada)
+    finally:
+        # Las copias que sigan en marcha ya no tienen a nadie esperando: su latencia no cuenta
+        abandonada.set()
+
+
+def _esperar_copias(operacion, funcion, args, kwargs, contador, inicio, fin, cubrir, aceptar, abandonada):
+    """Bucle de espera de llamar_con_plazo: lanza la copia de cobertura si toca y devuelve la primera respuesta válida."""
+    plazo = fin - inicio
+    copias = [_lanzar(operacion, funcion, args, kwargs, abandonada)]
+    pendientes = set(copias)
+    ultimo_fallo = None
+    cobertura_decidida = not cubrir
+    while pendientes:
+        espera = fin - time.monotonic()
+        if not cobertura_decidida:
+            espera = min(espera, inicio + umbral_cobertura(operacion, plazo) - time.monotonic())
+        terminados, pendientes = wait(pendientes, timeout=max(0.0, espera), return_when=FIRST_COMPLETED)
+
+        for futuro in terminados:
+            error = futuro.exception()
+            if error is None and (aceptar is None or aceptar(futuro.result())):
+                if futuro is not copias[0]:
+                    with _cerrojo:
+                        contador["ganadas_por_cobertura"] += 1
+                return futuro.result()
+            ultimo_fallo = futuro
+
+        if time.monotonic() >= fin:
+            break
+        if not terminados and not cobertura_decidida:
+            # Supera el percentil: una copia más si el cupo de coberturas de la operación lo permite
+            cobertura_decidida = True
+            with _cerrojo:
+                permitida = contador["coberturas"] < FRACCION_MAX_COBERTURAS * contador["llamadas"] + 1
+                if permitida:
+                    contador["coberturas"] += 1
+            if permitida:
+                copia = _lanzar(operacion, funcion, args, kwargs, abandonada)
+                copias.append(copia)
+                pendientes.add(copia)
+
+    if pendientes:
+        # Se acabó el plazo: la latencia real se desconoce (no se registra; ver la cabecera)
+        with _cerrojo:
+            contador["agotadas"] += 1
+        raise TimeoutError(f"{operacion}: sin respuesta en {plazo:.1f}s")
+    with _cerrojo:
+        contador["fallidas"] += 1
+    return ultimo_fallo.result()  # Relanza la excepción de la última copia, o devuelve su resultado no válido
+
+
+# --- 4. ESTADÍSTICAS ---
+def estadisticas_plazos():
+    """DataFrame por operación: llamadas, coberturas, ganadas por la copia, agotadas, fallidas y p50/p95/p99 (s)."""
+    with _cerrojo:
+        filas = []
+        for operacion, contador in _contadores.items():
+            muestras = np.array(_latencias.get(operacion, ()))
+            p50, p95, p99 = np.percentile(muestras, [50, 95, 99]) if len(muestras) else (np.nan,) * 3
+            filas.append({"Operación": operacion, "Llamadas": contador["llamadas"], "Coberturas": contador["coberturas"],
+                          "Ganadas por la copia": contador["ganadas_por_cobertura"], "Plazos agotados": contador["agotadas"],
+                          "Fallidas": contador["fallidas"], "p50 (s)": round(p50, 3), "p95 (s)": round(p95, 3),
+                          "p99 (s)": round(p99, 3)})
+    return pd.DataFrame(filas, columns=["Operación", "Llamadas", "Coberturas", "Ganadas por la copia", "Plazos agotados",
+                                        "Fallidas", "p50 (s)", "p95 (s)", "p99 (s)"])
+
+
+def reiniciar_estadisticas():
+    """Olvida latencias y contadores (p.ej. entre escenarios de una prueba)."""
+    with _cerrojo:
+        _latencias.clear()
+        _contadores.clear()
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import os
+    import argparse
+    from Intento3_V1_Stubs import instalar_stub_yahoo, iniciar_stub_gemini
+    # Las funciones se toman del módulo importado (no de __main__): sus contadores son los que usan los demás módulos
+    from Intento3_V1_Plazos import estadisticas_plazos, reiniciar_estadisticas, limite_ejecucion
+    from Intento3_V1_Obtener_Datos import obtener_datos_financieros_con_plazo
+    from Intento3_V1_Gestor_IA import generar_analisis_gemini
+    from Intento3_V1_GateKeeper import ejecutar_gatekeeper
+    from Intento3_V1_Embudo import cargar_universo
+    import tempfile
+    import Intento3_V1_Cache
+
+    parser = argparse.ArgumentParser(description="Latencia de cola con y sin plazos/coberturas contra stubs con cuelgues")
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--cuelgue", type=float, default=0.01, help="Probabilidad de que una petición se cuelgue")
+    parser.add_argument("--segundos-cuelgue", type=float, default=6.0)
+    parser.add_argument("--plazo-yahoo", type=float, default=2.0)
+    parser.add_argument("--plazo-ia", type=float, default=2.0)
+    args = parser.parse_args()
+
+    Intento3_V1_Cache.DIRECTORIO_CACHE = tempfile.mkdtemp(prefix="plazos_tfm_")  # Sin tocar la caché real
+    instalar_stub_yahoo(latencia=0.02, dispersion=0.3, probabilidad_cuelgue=args.cuelgue,
+                        segundos_cuelgue=args.segundos_cuelgue, semilla=1)
+    servidor, url = iniciar_stub_gemini(retardo_fragmento=0.0, retardo_peticion=0.05, dispersion_retardo=0.3,
+                                        probabilidad_cuelgue=args.cuelgue * 2, segundos_cuelgue=args.segundos_cuelgue,
+                                        semilla=1)
+    os.environ["GEMINI_API_ENDPOINT"] = url
+    universo = cargar_universo("Referencias.xlsx")
+    filas = [universo.iloc[k % len(universo)].copy() for k in range(args.tickers)]
+    for k, fila in enumerate(filas):
+        fila['Ticker'] = f"{fila['Ticker']}{k}"
+
+    print(f"\n--- ⏱️ PLAZOS Y COBERTURAS: {args.tickers} tickers, {args.cuelgue:.0%} de peticiones Yahoo colgadas "
+          f"{args.segundos_cuelgue:g}s ({args.cuelgue * 2:.0%} en Gemini) ---")
+    for nombre, plazo_yahoo, plazo_ia, cubrir in (("Sin plazos", 1e9, 1e9, False),
+                                                  ("Plazos", args.plazo_yahoo, args.plazo_ia, False),
+                                                  ("Plazos + coberturas", args.plazo_yahoo, args.plazo_ia, True)):
+        reiniciar_estadisticas()
+        duraciones, caducados, sin_ia = [], 0, 0
+        limite = limite_ejecucion(None)
+        for fila in filas:
+            inicio = time.perf_counter()
+            datos, antiguedad = obtener_datos_financieros_con_plazo(fila['Ticker'], plazo=plazo_yahoo, limite=limite, cubrir=cubrir)
+            caducados += antiguedad is not None
+            if datos:
+                informe = ejecutar_gatekeeper(datos, fila)
+                _, _, decision_ia, _ = generar_analisis_gemini("clave-falsa", fila['Ticker'], datos, informe,
+                                                               plazo_segundos=plazo_ia)
+                sin_ia += decision_ia == "ERROR"
+            duraciones.append(time.perf_counter() - inicio)
+        p50, p95, p99 = np.percentile(duraciones, [50, 95, 99])
+        print(f"\n   > {nombre}: total {sum(duraciones):.1f}s | por ticker p50 {p50:.2f}s  p95 {p95:.2f}s  "
+              f"p99 {p99:.2f}s  máx {max(duraciones):.2f}s | {caducados} de caché caducada, {sin_ia} solo Gatekeeper")
+        print(estadisticas_plazos().to_string(index=False))
+    servidor.shutdown()
@@ -0,0 +1,209 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Precalentado.py
+
+import time
+import datetime
+import threading
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+
+from Intento3_V1_Cache import guardar_en_cache, leer_de_cache
+from Intento3_V1_Obtener_Datos import obtener_datos_financieros, ESPACIO_DATOS
+from Intento3_V1_GateKeeper import ejecutar_gatekeeper
+from Intento3_V1_Almacen_Precios import guardar_historicos
+from Intento3_V1_Embudo import cargar_universo
+from Intento3_V1_Memo import guardar_memo
+
+# --- PRECALENTADO DE LA CACHÉ ANTES DE LA APERTURA ---
+# Proceso independiente de la app (cron / Programador de tareas, o en bucle con --hora) que descarga y puntúa
+# todo el universo de referencia con las mismas funciones que la app:
+#   - obtener_datos_financieros deja el snapshot en la caché 'datos_financieros'
+#   - ejecutar_gatekeeper comprueba que el snapshot se puntúa sin errores y su decisión queda en el informe
+#   - los históricos van al almacén de precios (gráficos sin descarga)
+# La app sirve esos snapshots solo mientras el mercado siga cerrado desde que se escribieron (ver ttl_precalentado):
+# en cuanto abre, los precios ya no son los del precalentado y los tickers se vuelven a descargar.
+# Orden: los tickers más pedidos en la app primero (contador en la caché 'demanda'), para que si el
+# presupuesto de tiempo se agota antes de terminar falten solo los que casi nadie consulta.
+
+UNIVERSO_PRECALENTADO = "Referencias_Ampliado.xlsx"
+ESPACIO_DEMANDA = "demanda"
+ESPACIO_PRECALENTADO = "precalentado"
+PRECALENTADO_TTL_SEGUNDOS = 18 * 3600  # Máximo en cualquier caso (p.ej. un lunes, desde el cierre del viernes)
+ZONA_MERCADO = ZoneInfo("America/New_York")
+HORA_APERTURA = datetime.time(9, 30)
+HORA_CIERRE = datetime.time(16, 0)
+PRESUPUESTO_SEGUNDOS = 20 * 60
+PAUSA_ENTRE_DESCARGAS = 1.0  # Por hilo: mismo respeto a la API que el recorrido de la app
+
+_cerrojo_demanda = threading.Lock()
+
+
+# --- 1. DEMANDA: QUÉ TICKERS SE PIDEN EN LA APP ---
+def registrar_peticiones(tickers):
+    """Suma una petición a cada ticker (se llama en cada 'Ejecutar Análisis'). Aproximado entre procesos."""
+    ahora = time.time()
+    with _cerrojo_demanda:
+        demanda = demanda_tickers()
+        for t in dict.fromkeys(tickers):
+            previo = demanda.get(t, {"peticiones": 0})
+            demanda[t] = {"peticiones": previo["peticiones"] + 1, "ultima": ahora}
+        guardar_en_cache(ESPACIO_DEMANDA, "contador", demanda)
+
+
+def demanda_tickers():
+    """dict ticker -> {'peticiones', 'ultima'} (vacío si nunca se ha registrado nada)."""
+    demanda, _ = leer_de_cache(ESPACIO_DEMANDA, "contador")
+    return demanda or {}
+
+
+def ordenar_por_demanda(tickers, demanda=None):
+    """Más peticiones primero; a igualdad, el pedido más recientemente; después, el orden del universo."""
+    demanda = demanda_tickers() if demanda is None else demanda
+    tickers = list(dict.fromkeys(tickers))
+    posicion = {t: i for i, t in enumerate(tickers)}
+    vacio = {"peticiones": 0, "ultima": 0}
+    return sorted(tickers, key=lambda t: (-demanda.get(t, vacio)["peticiones"], -demanda.get(t, vacio)["ultima"],
+                                          posicion[t]))
+
+
+# --- 2. VIGENCIA: HASTA LA PRÓXIMA APERTURA DEL MERCADO ---
+def ultimo_cierre(ahora=None):
+    """
+    Instante (epoch) del cierre de la última sesión que ya ha abierto (lunes a viernes; los festivos no se
+    tienen en cuenta). En plena sesión es el cierre de hoy, todavía en el futuro.
+    """
+    ahora = datetime.datetime.fromtimestamp(time.time() if ahora is None else ahora, ZONA_MERCADO)
+    dia = ahora.date()
+    while dia.weekday() >= 5 or datetime.datetime.combine(dia, HORA_APERTURA, ZONA_MERCADO) > ahora:
+        dia -= datetime.timedelta(days=1)
+    return datetime.datetime.combine(dia, HORA_CIERRE, ZONA_MERCADO).timestamp()
+
+
+def ttl_precalentado(ahora=None):
+    """
+    Antigüedad máxima (s) de un snapshot para servirlo como precalentado: el tiempo desde el último cierre
+    (sus precios siguen siendo los vigentes), como mucho PRECALENTADO_TTL_SEGUNDOS. 0 con el mercado abierto.
+    """
+    ahora = time.time() if ahora is None else ahora
+    return max(0.0, min(PRECALENTADO_TTL_SEGUNDOS, ahora - ultimo_cierre(ahora)))
+
+
+# --- 3. PRECALENTADO ---
+def precalentar(df_universo, presupuesto_segundos=PRESUPUESTO_SEGUNDOS, max_hilos=2, ttl=None,
+                forzar=False, parametros=None, al_progresar=None):
+    """
+    Descarga y puntúa los tickers de 'df_universo' (DataFrame con 'Ticker' y columnas Ref_*) por orden de demanda.
+    Los que ya tienen un snapshot de menos de 'ttl' segundos (por defecto ttl_precalentado()) se saltan
+    (salvo 'forzar').
+    No se empieza ninguna descarga pasado 'presupuesto_segundos'; las ya empezadas terminan.
+    'al_progresar(texto)' es opcional. Devuelve (y guarda en la caché 'precalentado') un informe:
+      - 'inicio', 'segundos'
+      - 'calentados': dict ticker -> decisión del Gatekeeper
+      - 'ya_calientes', 'fallidos', 'sin_tiempo': listas de tickers
+    """
+    avisar = al_progresar or (lambda _: None)
+    referencias = {fila['Ticker']: fila for _, fila in df_universo.iterrows()}
+    orden = ordenar_por_demanda(list(referencias))
+    inicio = time.time()
+    limite = time.monotonic() + presupuesto_segundos
+
+    ya_calientes = []
+    ttl = ttl_precalentado() if ttl is None else ttl
+    if not forzar and ttl > 0:
+        ya_calientes = [t for t in orden if leer_de_cache(ESPACIO_DATOS, t, ttl=ttl)[0] is not None]
+        orden = [t for t in orden if t not in ya_calientes]
+    avisar(f"{len(orden)} tickers por precalentar ({len(ya_calientes)} ya calientes), "
+           f"presupuesto de {presupuesto_segundos:.0f}s")
+
+    calentados, fallidos, sin_tiempo, historicos = {}, [], [], {}
+
+    def _uno(t):
+        # El presupuesto se comprueba al empezar cada ticker: la cola se recorre en orden de demanda
+        if time.monotonic() >= limite:
+            sin_tiempo.append(t)
+            return
+        datos = obtener_datos_financieros(t)
+        if not datos:
+            fallidos.append(t)
+        else:
+            try:
+                calentados[t] = ejecutar_gatekeeper(datos, referencias[t], parametros)['decision']
+                historicos[t] = datos['history']
+                avisar(f"{t}: {calentados[t]}")
+            except Exception as e:
+                print(f"Aviso: el Gatekeeper falló con {t}: {e}")
+                fallidos.append(t)
+        time.sleep(PAUSA_ENTRE_DESCARGAS)
+
+    if orden:
+        with ThreadPoolExecutor(max_workers=min(max_hilos, len(orden)), thread_name_prefix="precalentado") as ejecutor:
+            list(ejecutor.map(_uno, orden))
+
+    if historicos:
+        try:
+            guardar_historicos(historicos)
+        except Exception as e:
+            print(f"Aviso: no se pudo actualizar el almacén de precios: {e}")
+    guardar_memo()  # La app arranca con el TTM de todo el universo ya memoizado
+
+    informe = {
+        "inicio": inicio,
+        "segundos": round(time.time() - inicio, 1),
+        "calentados": {t: calentados[t] for t in orden if t in calentados},
+        "ya_calientes": ya_calientes,
+        "fallidos": [t for t in orden if t in fallidos],
+        "sin_tiempo": [t for t in orden if t in sin_tiempo],
+    }
+    guardar_en_cache(ESPACIO_PRECALENTADO, "ultimo", informe)
+    return informe
+
+
+def ultimo_precalentado():
+    """(informe, antigüedad en segundos) del último precalentado, o (None, None)."""
+    return leer_de_cache(ESPACIO_PRECALENTADO, "ultimo")
+
+
+# --- 4. PLANIFICACIÓN ---
+def proxima_ejecucion(hora, ahora=None, solo_laborables=True):
+    """Próximo datetime a la hora 'HH:MM' (local). Con 'solo_laborables' se salta sábados y domingos."""
+    ahora = ahora or datetime.datetime.now()
+    horas, minutos = (int(x) for x in hora.split(":"))
+    siguiente = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    if siguiente <= ahora:
+        siguiente += datetime.timedelta(days=1)
+    while solo_laborables and siguiente.weekday() >= 5:
+        siguiente += datetime.timedelta(days=1)
+    return siguiente
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precalienta la caché de la app con el universo de referencia")
+    parser.add_argument("universo", nargs="?", default=UNIVERSO_PRECALENTADO, help="CSV o Excel con columna 'Ticker'")
+    parser.add_argument("--presupuesto", type=float, default=PRESUPUESTO_SEGUNDOS / 60, help="Minutos máximos por pasada")
+    parser.add_argument("--hilos", type=int, default=2)
+    parser.add_argument("--forzar", action="store_true", help="Descargar también los tickers ya calientes")
+    parser.add_argument("--hora", help="HH:MM: queda en marcha y precalienta cada día laborable a esa hora "
+                                       "(sin ella, una sola pasada para cron / Programador de tareas)")
+    args = parser.parse_args()
+
+    def pasada():
+        print(f"\n--- ♨️ PRECALENTADO DE {args.universo} ({datetime.datetime.now():%Y-%m-%d %H:%M}) ---")
+        informe = precalentar(cargar_universo(args.universo), presupuesto_segundos=args.presupuesto * 60,
+                              max_hilos=args.hilos, forzar=args.forzar, al_progresar=lambda texto: print(f"   > {texto}"))
+        print(f"   > {len(informe['calentados'])} calentados, {len(informe['ya_calientes'])} ya calientes, "
+              f"{len(informe['fallidos'])} fallidos, {len(informe['sin_tiempo'])} sin tiempo ({informe['segundos']}s)")
+        if informe['sin_tiempo']:
+            print(f"   > Sin tiempo: {', '.join(informe['sin_tiempo'])}")
+
+    if not args.hora:
+        pasada()
+    else:
+        while True:
+            siguiente = proxima_ejecucion(args.hora)
+            print(f"   > Próximo precalentado: {siguiente:%Y-%m-%d %H:%M}")
+            time.sleep(max(0.0, (siguiente - datetime.datetime.now()).total_seconds()))
+            pasada()
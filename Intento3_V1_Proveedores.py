@@ -0,0 +1,222 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Proveedores.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_Almacen_Precios import abrir_almacen, serie_cierres
+from Intento3_V1_Plazos import llamar_con_plazo
+
+# --- PROVEEDORES DE DATOS FUNDAMENTALES ---
+# Un proveedor es una función  lote(tickers, **opciones) -> dict ticker -> materia prima (o None si falla).
+# La "materia prima" es lo mínimo que necesita el cálculo TTM/ratios de Intento3_V1_Obtener_Datos:
+#   'precio', 'market_cap', 'per_ntm', 'div_yield' (decimal)
+#   'info'          -> dict con los respaldos 'ebitda', 'totalDebt', 'totalCash'
+#   'q_financials', 'q_cashflow', 'q_balance' -> DataFrames trimestrales (filas = concepto con los nombres
+#                      de Yahoo, columnas = trimestres del más reciente al más antiguo)
+#   'history'       -> DataFrame con columna 'Close' (o None)
+
+DIRECTORIO_VOLCADOS = os.environ.get("TFM_VOLCADOS_DIR", "volcados")
+
+
+# --- 1. YAHOO FINANCE (una petición HTTP por ticker y dato) ---
+def materia_prima_yahoo(ticker_symbol):
+    import yfinance as yf  # Diferido: importarlo es caro y el proveedor de ficheros no lo necesita
+
+    empresa = yf.Ticker(ticker_symbol)
+
+    # --- 1. DATOS ESTÁTICOS Y PRECIO ---
+    info = empresa.info
+    history = empresa.history(period="5y")
+    fast_info = empresa.fast_info
+
+    # Precio (Lógica de respaldo robusta)
+    precio = fast_info.get('last_price')
+    if not precio: precio = info.get('currentPrice')
+    if not precio: precio = info.get('previousClose', 0)
+
+    # Market Cap
+    m_cap = fast_info.get('market_cap')
+    if not m_cap: m_cap = info.get('marketCap', 0)
+
+    # --- 2. CARGA DE DATAFRAMES TRIMESTRALES ---
+    # Estos son vitales para el cálculo TTM
+    q_cashflow = empresa.quarterly_cashflow
+    q_financials = empresa.quarterly_financials
+    q_balance = empresa.quarterly_balance_sheet
+
+    # --- 3. RATIOS BÁSICOS DE 'info' ---
+    # A) Cálculo PER NTM (Forward PE)
+    per_ntm = info.get('forwardPE', 0)
+
+    # B) Dividendo
+    raw_div_yield = info.get('dividendYield', 0)
+    if raw_div_yield is None: raw_div_yield = 0
+    div_yield = raw_div_yield / 100 if raw_div_yield > 0.2 else raw_div_yield
+
+    return {'precio': precio, 'market_cap': m_cap, 'per_ntm': per_ntm, 'div_yield': div_yield, 'info': info,
+            'q_financials': q_financials, 'q_cashflow': q_cashflow, 'q_balance': q_balance, 'history': history}
+
+
+def lote_yahoo(tickers, max_hilos=8, plazo=None, cubrir=True):
+    """
+    Proveedor Yahoo: descarga concurrente ticker a ticker.
+    Cada ticker tiene 'plazo' segundos (por defecto el de Intento3_V1_Plazos) y, con 'cubrir', una copia de
+    cobertura si supera el p95: un ticker colgado acaba en None en lugar de retener el lote entero.
+    """
+    def _uno(t):
+        try:
+            return llamar_con_plazo("yahoo", materia_prima_yahoo, t, plazo=plazo, cubrir=cubrir)
+        except Exception as e:
+            print(f"Aviso: Error descargando {t} de Yahoo: {e}")
+            return None
+
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_hilos, len(tickers))) as ejecutor:
+        return dict(zip(tickers, ejecutor.map(_uno, tickers)))
+
+
+# --- 2. VOLCADO LOCAL DE FICHEROS (CSV o Parquet del proveedor de datos) ---
+# <directorio>/cotizaciones.parquet|csv : Ticker, Precio, Market_Cap, PER_NTM, Div_Yield (decimal)
+#                                         [, EBITDA, Total_Debt, Total_Cash]  (respaldos, opcionales)
+# <directorio>/trimestrales.parquet|csv : formato largo Ticker, Fecha, Concepto, Valor (un dato por trimestre)
+# <directorio>/precios.parquet|csv      : Ticker, Fecha, Close (opcional; si falta se usa el almacén de precios)
+
+COLUMNAS_INFO = {'EBITDA': 'ebitda', 'Total_Debt': 'totalDebt', 'Total_Cash': 'totalCash'}
+
+
+def _leer_tabla(directorio, nombre, tickers):
+    """Lee <nombre>.parquet o <nombre>.csv (el primero que exista) filtrando a 'tickers'. None si no hay fichero."""
+    ruta_parquet = os.path.join(directorio, f"{nombre}.parquet")
+    ruta_csv = os.path.join(directorio, f"{nombre}.csv")
+    if os.path.exists(ruta_parquet):
+        # El filtro se aplica en la lectura: solo se cargan los row groups de los tickers pedidos
+        return pd.read_parquet(ruta_parquet, filters=[("Ticker", "in", list(tickers))])
+    if os.path.exists(ruta_csv):
+        df = pd.read_csv(ruta_csv)
+        return df[df['Ticker'].isin(tickers)]
+    return None
+
+
+def lote_ficheros(tickers, directorio=DIRECTORIO_VOLCADOS, mapa_conceptos=None):
+    """
+    Proveedor de volcado local: carga el universo completo en tres lecturas vectorizadas.
+    'mapa_conceptos' traduce los nombres de concepto del proveedor a los de Yahoo
+    (p.ej. {"NetIncome": "Net Income", "CapEx": "Capital Expenditure"}).
+    Los tickers ausentes de 'cotizaciones' devuelven None.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    cotizaciones = _leer_tabla(directorio, "cotizaciones", tickers)
+    if cotizaciones is None:
+        raise FileNotFoundError(f"No hay 'cotizaciones.parquet' ni 'cotizaciones.csv' en '{directorio}'.")
+    cotizaciones = cotizaciones.drop_duplicates(subset='Ticker', keep='last').set_index('Ticker')
+
+    # Estados trimestrales: tabla ancha (Ticker, Concepto) x Fecha, trimestres del más reciente al más antiguo
+    trimestrales = _leer_tabla(directorio, "trimestrales", tickers)
+    estados = {}
+    if trimestrales is not None and not trimestrales.empty:
+        if mapa_conceptos:
+            trimestrales = trimestrales.assign(Concepto=trimestrales['Concepto'].replace(mapa_conceptos))
+        trimestrales = trimestrales.assign(Fecha=pd.to_datetime(trimestrales['Fecha']))
+        ancha = (trimestrales.drop_duplicates(subset=['Ticker', 'Concepto', 'Fecha'], keep='last')
+                 .set_index(['Ticker', 'Concepto', 'Fecha'])['Valor']
+                 .unstack('Fecha'))
+        ancha = ancha[ancha.columns.sort_values(ascending=False)].sort_index()
+        # Troceo por ticker sobre el array (las filas de cada ticker son contiguas tras sort_index)
+        valores, fechas = ancha.to_numpy(), ancha.columns
+        codigos_ticker = ancha.index.get_level_values('Ticker')
+        conceptos = ancha.index.get_level_values('Concepto')
+        limites = np.flatnonzero(codigos_ticker[1:] != codigos_ticker[:-1]) + 1
+        for inicio, fin in zip(np.r_[0, limites], np.r_[limites, len(ancha)]):
+            bloque = valores[inicio:fin]
+            # Cada empresa tiene su calendario fiscal: fuera las fechas de otros tickers
+            con_dato = ~np.isnan(bloque).all(axis=0)
+            estados[codigos_ticker[inicio]] = pd.DataFrame(bloque[:, con_dato], index=conceptos[inicio:fin],
+                                                           columns=fechas[con_dato])
+
+    # Históricos de precio: fichero del volcado o, si no existe, el almacén columnar (vista sin copia)
+    precios = _leer_tabla(directorio, "precios", tickers)
+    historicos = {}
+    if precios is not None and not precios.empty:
+        precios = precios.assign(Fecha=pd.to_datetime(precios['Fecha'])).sort_values(['Ticker', 'Fecha'])
+        for t, bloque in precios.groupby('Ticker', sort=False):
+            historicos[t] = bloque.set_index('Fecha')[['Close']]
+    else:
+        almacen = abrir_almacen()
+        for t in tickers:
+            cierres = serie_cierres(almacen, t)
+            if cierres is not None:
+                historicos[t] = cierres.to_frame()
+
+    vacio = pd.DataFrame()
+    columnas_info = [c for c in COLUMNAS_INFO if c in cotizaciones.columns]
+    resultado = {}
+    for t, fila in zip(cotizaciones.index, cotizaciones.to_dict("records")):
+        estado = estados.get(t, vacio)
+        resultado[t] = {
+            'precio': fila['Precio'], 'market_cap': fila['Market_Cap'],
+            'per_ntm': fila['PER_NTM'] if pd.notna(fila['PER_NTM']) else 0,
+            'div_yield': fila['Div_Yield'] if pd.notna(fila['Div_Yield']) else 0,
+            'info': {COLUMNAS_INFO[c]: fila[c] for c in columnas_info if pd.notna(fila[c])},
+            # Un único estado con todos los conceptos: los nombres de Yahoo no se repiten entre estados
+            'q_financials': estado, 'q_cashflow': estado, 'q_balance': estado,
+            'history': historicos.get(t),
+        }
+    return {t: resultado.get(t) for t in tickers}
+
+
+# --- 3. REGISTRO ---
+PROVEEDORES = {
+    "yahoo": lote_yahoo,
+    "ficheros": lote_ficheros,
+}
+
+
+def registrar_proveedor(nombre, funcion_lote):
+    """Añade (o sustituye) un proveedor: funcion_lote(tickers, **opciones) -> dict ticker -> materia prima."""
+    PROVEEDORES[nombre] = funcion_lote
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import time
+    import shutil
+    import tempfile
+    from Intento3_V1_Obtener_Datos import obtener_datos_financieros_lote
+
+    N_TICKERS = 5_000
+    print(f"\n--- 🧪 VOLCADO SINTÉTICO DE {N_TICKERS} TICKERS (Parquet) ---")
+    directorio_prueba = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    tickers_prueba = [f"T{k:05d}" for k in range(N_TICKERS)]
+    trimestres = pd.date_range("2023-03-31", periods=8, freq="QE")
+    conceptos = {'Net Income': (-1e8, 6e8), 'EBITDA': (2e8, 1e9), 'Operating Cash Flow': (1e8, 8e8),
+                 'Capital Expenditure': (-3e8, -1e7), 'Repurchase Of Capital Stock': (-2e8, 0),
+                 'Issuance Of Capital Stock': (0, 5e7), 'Total Debt': (1e9, 5e9), 'Cash And Cash Equivalents': (1e8, 2e9)}
+
+    pd.DataFrame({'Ticker': tickers_prueba, 'Precio': rng.uniform(20, 200, N_TICKERS),
+                  'Market_Cap': rng.uniform(1e9, 1e11, N_TICKERS), 'PER_NTM': rng.uniform(8, 30, N_TICKERS),
+                  'Div_Yield': rng.uniform(0, 0.05, N_TICKERS)}).to_parquet(os.path.join(directorio_prueba, "cotizaciones.parquet"))
+    largo = pd.MultiIndex.from_product([tickers_prueba, list(conceptos), trimestres],
+                                       names=['Ticker', 'Concepto', 'Fecha']).to_frame(index=False)
+    limites = np.array([conceptos[c] for c in largo['Concepto']])
+    largo['Valor'] = rng.uniform(limites[:, 0], limites[:, 1])
+    largo.to_parquet(os.path.join(directorio_prueba, "trimestrales.parquet"))
+    print(f"   > {len(largo):,} filas trimestrales")
+
+    t0 = time.perf_counter()
+    snapshots = obtener_datos_financieros_lote(tickers_prueba, proveedor="ficheros", directorio=directorio_prueba,
+                                               guardar=False)
+    duracion = time.perf_counter() - t0
+    validos = sum(1 for d in snapshots.values() if d)
+    print(f"   > {validos}/{N_TICKERS} snapshots en {duracion:.2f}s")
+    ejemplo = snapshots[tickers_prueba[0]]
+    print(f"   > {tickers_prueba[0]}: PER LTM {ejemplo['per_ltm']:.1f}x | FCF Yield (EV) {ejemplo['fcf_yield_ev']:.2%} | "
+          f"Solvencia {ejemplo['ratio_solvencia']}")
+    shutil.rmtree(directorio_prueba, ignore_errors=True)
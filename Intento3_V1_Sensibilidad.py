@@ -0,0 +1,296 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Sensibilidad.py
+
+import time
+import numpy as np
+import pandas as pd
+
+from Intento3_V1_GateKeeper import PARAMETROS_GATEKEEPER
+
+# Codificación numérica de las decisiones dentro del "cubo" (ticker x juego de parámetros)
+DECISIONES = ("DESCARTAR", "NEUTRAL/PRECAUCIÓN", "COMPRAR")
+COD_DESCARTAR, COD_NEUTRAL, COD_COMPRAR = 0, 1, 2
+
+# Parámetros enteros (umbrales de conteo del semáforo): se redondean al generar la rejilla
+PARAMETROS_ENTEROS = {k for k, v in PARAMETROS_GATEKEEPER.items() if isinstance(v, int)}
+
+CAMPOS_DATOS = [
+    'fcf_yield_ev', 'fcf_yield_mc', 'per_ltm', 'per_ntm', 'ratio_solvencia',
+    'debug_ebitda_ttm', 'debug_capex_ttm', 'div_yield', 'buyback_yield', 'payout_ratio',
+]
+CAMPOS_REFERENCIAS = [
+    'Ref_Solvencia_Mediana', 'Ref_PER_LTM_Mediana', 'Ref_PER_NTM_Mediana',
+    'Ref_FCF_Yield_Mediana', 'Ref_Total_Yield',
+    'Percentil_Pares',  # Solo en modo pares (ver Intento3_V1_Pares.referencias_pares); sin él, NaN
+]
+
+
+def _a_float(valor):
+    """
+    Convierte un dato del snapshot a float. Los "N/A" (o None) pasan a NaN,
+    que en NumPy se comporta igual que en ejecutar_gatekeeper: toda comparación es False.
+    """
+    if isinstance(valor, (int, float, np.number)) and not isinstance(valor, bool):
+        return float(valor)
+    return np.nan
+
+
+def _matriz_datos(snapshots, tickers):
+    """Construye un dict campo -> array (T, 1) a partir de los snapshots de obtener_datos_financieros."""
+    return {
+        campo: np.array([_a_float(snapshots[t].get(campo)) for t in tickers])[:, None]
+        for campo in CAMPOS_DATOS
+    }
+
+
+def _matriz_referencias(referencias, tickers):
+    """
+    Admite el DataFrame del Excel (columna 'Ticker') o un dict ticker -> fila/dict.
+    Devuelve un dict campo -> array (T, 1).
+    """
+    if isinstance(referencias, pd.DataFrame):
+        referencias = {fila['Ticker']: fila for _, fila in referencias.iterrows()}
+
+    valores_defecto = {'Ref_Total_Yield': 3}  # Mismo valor por defecto que el Gatekeeper
+    matriz = {}
+    for campo in CAMPOS_REFERENCIAS:
+        columna = []
+        for t in tickers:
+            fila = referencias.get(t, {})
+            columna.append(_a_float(fila.get(campo, valores_defecto.get(campo, "N/A"))))
+        matriz[campo] = np.array(columna)[:, None]
+    return matriz
+
+
+def rangos_por_defecto(amplitud=0.2):
+    """
+    Rangos de barrido de +/- 'amplitud' alrededor de cada umbral por defecto.
+    Los umbrales de conteo del semáforo se mueven +/- 1 unidad.
+    """
+    rangos = {}
+    for nombre, valor in PARAMETROS_GATEKEEPER.items():
+        if nombre in PARAMETROS_ENTEROS:
+            rangos[nombre] = (max(0, valor - 1), valor + 1)
+        else:
+            rangos[nombre] = (valor * (1 - amplitud), valor * (1 + amplitud))
+    return rangos
+
+
+def generar_rejilla(rangos, n_puntos=10_000, metodo="aleatorio", semilla=0):
+    """
+    Genera la rejilla de parámetros como dict nombre -> array (P,).
+
+    - metodo="aleatorio": muestreo uniforme de 'n_puntos' dentro de cada rango (min, max).
+    - metodo="cartesiano": producto cartesiano de las listas de valores de 'rangos'.
+    Los parámetros que no aparecen en 'rangos' se fijan a su valor por defecto.
+    """
+    if metodo == "cartesiano":
+        nombres = list(rangos.keys())
+        mallas = np.meshgrid(*[np.asarray(rangos[n], dtype=float) for n in nombres], indexing="ij")
+        rejilla = {n: m.ravel() for n, m in zip(nombres, mallas)}
+        n_puntos = mallas[0].size if mallas else 1
+    elif metodo == "aleatorio":
+        rng = np.random.default_rng(semilla)
+        rejilla = {}
+        for nombre, (minimo, maximo) in rangos.items():
+            if nombre in PARAMETROS_ENTEROS:
+                rejilla[nombre] = rng.integers(int(minimo), int(maximo) + 1, size=n_puntos).astype(float)
+            else:
+                rejilla[nombre] = rng.uniform(minimo, maximo, size=n_puntos)
+    else:
+        raise ValueError(f"Método de rejilla desconocido: {metodo}")
+
+    for nombre, valor in PARAMETROS_GATEKEEPER.items():
+        if nombre not in rejilla:
+            rejilla[nombre] = np.full(n_puntos, float(valor))
+    return rejilla
+
+
+def gatekeeper_vectorizado(datos, refs, parametros):
+    """
+    Réplica vectorizada de ejecutar_gatekeeper.
+    'datos' y 'refs' son arrays (T, 1); 'parametros' son arrays (1, P).
+    Devuelve la matriz de decisiones codificadas (T, P) como int8.
+    Cada 'if / elif' del Gatekeeper se traduce a máscaras booleanas (A, ~A & B).
+    """
+    p = parametros
+    fcf_ev, fcf_mc = datos['fcf_yield_ev'], datos['fcf_yield_mc']
+    per_ltm, per_ntm = datos['per_ltm'], datos['per_ntm']
+    solv = datos['ratio_solvencia']
+    ebitda, capex = datos['debug_ebitda_ttm'], datos['debug_capex_ttm']
+    payout = datos['payout_ratio']
+
+    ref_solv = refs['Ref_Solvencia_Mediana']
+    ref_ltm, ref_ntm = refs['Ref_PER_LTM_Mediana'], refs['Ref_PER_NTM_Mediana']
+    ref_fcf = refs['Ref_FCF_Yield_Mediana']
+    ref_yield = refs['Ref_Total_Yield'] / 100
+
+    # --- FASE 0: INTEGRIDAD (independiente de los parámetros) ---
+    criticas = (fcf_ev <= 0) | ((per_ltm <= 0) & (per_ntm <= 0))
+    alerta_anomala = (per_ltm <= 0) & (per_ntm > 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # --- FASE 1: SOLVENCIA ---
+        flujo = ebitda - capex
+        evaluable = flujo > 0
+        a_historico = evaluable & (solv > ref_solv * p['solvencia_mult_historico']) & (solv > p['solvencia_min_alerta'])
+        a_absoluta = evaluable & (solv > p['solvencia_max_absoluta'])
+        f_balance = evaluable & ~a_absoluta & (solv < p['solvencia_balance_fuerte'])
+        a_no_evaluable = ~evaluable & (ebitda > 0) & (flujo <= 0)
+        a_ebitda_neg = ~evaluable & ~a_no_evaluable & (ebitda < 0)
+
+        # --- FASE 2: CALIDAD DEL BENEFICIO ---
+        p_fcf = np.where(fcf_mc > 0, 1 / np.where(fcf_mc > 0, fcf_mc, 1), 99)
+        a_calidad = p_fcf > ref_ltm * p['calidad_mult_alerta']
+        f_calidad = ~a_calidad & (p_fcf < ref_ltm * p['calidad_mult_fuerte'])
+
+        # --- FASE 3: VALORACIÓN ---
+        f_ntm = per_ntm <= ref_ntm * p['per_mult_descuento']
+        a_ntm = ~f_ntm & (per_ntm > ref_ntm * p['per_mult_prima'])
+        f_ltm = (per_ltm <= ref_ltm * p['per_mult_descuento']) & (per_ltm > 0)
+        a_ltm = ~f_ltm & (per_ltm > ref_ltm * p['per_mult_prima']) & (per_ltm > 0)
+        f_fcf = fcf_ev >= ref_fcf
+        f_crecimiento = per_ntm < per_ltm * p['crecimiento_mult']
+        a_deterioro = ~f_crecimiento & (per_ntm > per_ltm * p['deterioro_mult']) & (per_ltm > 0)
+
+        # --- FASE 4: RETORNO AL ACCIONISTA ---
+        total_yield = datos['div_yield'] + datos['buyback_yield']
+        f_yield = total_yield > ref_yield + p['yield_margen_superior']
+        a_yield = ~f_yield & (total_yield < ref_yield * p['yield_mult_bajo'])
+        f_payout = payout < p['payout_saludable']
+        a_payout = ~f_payout & (payout > p['payout_insostenible'])
+
+        # --- FASE 5: PARES ---
+        percentil = refs['Percentil_Pares']
+        f_pares = percentil >= p['pares_percentil_fuerte']
+        a_pares = ~f_pares & (percentil <= p['pares_percentil_debil'])
+
+        # --- SEMÁFORO ---
+        num_fuertes = (f_balance.astype(np.int8) + f_calidad + f_ntm + f_ltm + f_fcf
+                       + f_crecimiento + f_yield + f_payout + f_pares)
+        num_alertas = (alerta_anomala.astype(np.int8) + a_historico + a_absoluta + a_no_evaluable
+                       + a_ebitda_neg + a_calidad + a_ntm + a_ltm + a_deterioro + a_yield + a_payout + a_pares)
+
+        cara = (((per_ltm > ref_ltm * p['per_mult_prima']) | (per_ltm <= 0))
+                & ((per_ntm > ref_ntm * p['per_mult_prima']) | (per_ntm <= 0))
+                & ((fcf_ev < ref_fcf * p['fcf_mult_caro']) | (fcf_ev <= 0))
+                & ((per_ntm >= per_ltm) | (per_ntm <= 0)))
+
+    comprar = (num_alertas <= p['comprar_max_alertas']) & (num_fuertes >= p['comprar_min_fuertes'])
+    neutral = (((num_alertas <= p['neutral_max_alertas']) & (num_fuertes >= p['neutral_min_fuertes']))
+               | ((num_alertas <= p['neutral_ampliado_max_alertas']) & (num_fuertes >= p['neutral_ampliado_min_fuertes'])))
+
+    decision = np.where(comprar, COD_COMPRAR, np.where(neutral, COD_NEUTRAL, COD_DESCARTAR))
+    decision = np.where(criticas | cara, COD_DESCARTAR, decision)
+    return decision.astype(np.int8)
+
+
+def barrido_sensibilidad(snapshots, referencias, rejilla, tamano_bloque=2_000):
+    """
+    Evalúa el Gatekeeper para todos los tickers x todos los juegos de parámetros en una pasada NumPy.
+    La rejilla se procesa por bloques de columnas para acotar la memoria intermedia.
+
+    Devuelve un dict con:
+      - 'tickers': lista de tickers (filas del cubo)
+      - 'cubo': array int8 (T, P) con las decisiones codificadas (ver DECISIONES)
+      - 'rejilla': la rejilla de parámetros usada
+      - 'estabilidad': DataFrame con métricas de estabilidad por ticker
+    """
+    tickers = [t for t in snapshots if snapshots[t]]
+    datos = _matriz_datos(snapshots, tickers)
+    refs = _matriz_referencias(referencias, tickers)
+
+    n_puntos = len(next(iter(rejilla.values())))
+    cubo = np.empty((len(tickers), n_puntos), dtype=np.int8)
+    for inicio in range(0, n_puntos, tamano_bloque):
+        fin = min(inicio + tamano_bloque, n_puntos)
+        bloque = {k: np.asarray(v[inicio:fin], dtype=float)[None, :] for k, v in rejilla.items()}
+        cubo[:, inicio:fin] = gatekeeper_vectorizado(datos, refs, bloque)
+
+    # Decisión con los umbrales por defecto (referencia para medir la estabilidad)
+    base = {k: np.array([[float(v)]]) for k, v in PARAMETROS_GATEKEEPER.items()}
+    decision_base = gatekeeper_vectorizado(datos, refs, base)[:, 0]
+
+    return {
+        "tickers": tickers,
+        "cubo": cubo,
+        "rejilla": rejilla,
+        "estabilidad": metricas_estabilidad(tickers, cubo, decision_base),
+    }
+
+
+def metricas_estabilidad(tickers, cubo, decision_base):
+    """
+    Resumen por ticker del cubo de decisiones:
+      - % de juegos de parámetros que dan cada decisión
+      - Decisión modal y decisión con los parámetros por defecto
+      - Estabilidad: fracción de la rejilla que coincide con la decisión por defecto
+      - Entropía normalizada (0 = siempre la misma decisión, 1 = totalmente repartida)
+    """
+    n_puntos = cubo.shape[1]
+    conteos = np.stack([(cubo == c).sum(axis=1) for c in range(len(DECISIONES))], axis=1)
+    frecuencias = conteos / max(n_puntos, 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropia = -np.nansum(np.where(frecuencias > 0, frecuencias * np.log(frecuencias), 0.0), axis=1)
+    entropia = entropia / np.log(len(DECISIONES))
+
+    estabilidad = frecuencias[np.arange(len(tickers)), decision_base] if len(tickers) else np.array([])
+
+    df = pd.DataFrame({
+        "Ticker": tickers,
+        "Decisión Base": [DECISIONES[c] for c in decision_base],
+        "Decisión Modal": [DECISIONES[c] for c in conteos.argmax(axis=1)] if len(tickers) else [],
+        "% COMPRAR": frecuencias[:, COD_COMPRAR],
+        "% NEUTRAL": frecuencias[:, COD_NEUTRAL],
+        "% DESCARTAR": frecuencias[:, COD_DESCARTAR],
+        "Estabilidad": estabilidad,
+        "Entropía": entropia,
+    })
+    return df.sort_values("Estabilidad").reset_index(drop=True)
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    from Intento3_V1_GateKeeper import ejecutar_gatekeeper
+
+    N_TICKERS, N_PUNTOS = 500, 10_000
+    rng = np.random.default_rng(42)
+
+    # Universo sintético con valores realistas
+    snapshots, refs = {}, {}
+    for k in range(N_TICKERS):
+        ebitda = rng.uniform(-1e8, 5e9)
+        fcf_mc = rng.uniform(-0.02, 0.10)
+        snapshots[f"T{k}"] = {
+            'fcf_yield_ev': rng.uniform(-0.02, 0.09), 'fcf_yield_mc': fcf_mc,
+            'per_ltm': rng.choice([-1.0, rng.uniform(5, 40)]), 'per_ntm': rng.uniform(-5, 40),
+            'ratio_solvencia': rng.uniform(-1, 7), 'debug_ebitda_ttm': ebitda,
+            'debug_capex_ttm': rng.uniform(0, 2e9), 'div_yield': rng.uniform(0, 0.06),
+            'buyback_yield': rng.uniform(-0.01, 0.05),
+            'payout_ratio': rng.uniform(0, 1.5) if fcf_mc > 0 else "N/A",
+        }
+        refs[f"T{k}"] = {
+            'Ref_Solvencia_Mediana': rng.uniform(0.5, 4), 'Ref_PER_LTM_Mediana': rng.uniform(10, 30),
+            'Ref_PER_NTM_Mediana': rng.uniform(10, 30), 'Ref_FCF_Yield_Mediana': rng.uniform(0.02, 0.06),
+            'Ref_Total_Yield': rng.uniform(1, 7),
+        }
+
+    rejilla = generar_rejilla(rangos_por_defecto(0.2), n_puntos=N_PUNTOS)
+
+    t0 = time.perf_counter()
+    resultado = barrido_sensibilidad(snapshots, refs, rejilla)
+    t1 = time.perf_counter()
+    print(f"\n--- 🧪 BARRIDO {N_TICKERS} tickers x {N_PUNTOS} juegos de parámetros: {t1 - t0:.2f}s ---")
+
+    # Comprobación de coherencia con la versión escalar en una muestra
+    discrepancias = 0
+    for j in rng.integers(0, N_PUNTOS, size=20):
+        params = {k: (int(v[j]) if k in PARAMETROS_ENTEROS else float(v[j])) for k, v in rejilla.items()}
+        for fila, t in enumerate(resultado['tickers'][:100]):
+            esperado = ejecutar_gatekeeper(snapshots[t], refs[t], params)['decision']
+            if DECISIONES[resultado['cubo'][fila, j]] != esperado:
+                discrepancias += 1
+    print(f"   > Discrepancias con ejecutar_gatekeeper (muestra): {discrepancias}")
+    print(resultado['estabilidad'].head(10).to_string())
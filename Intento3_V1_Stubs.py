@@ -0,0 +1,404 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Stubs.py
+
+import re
+import sys
+import json
+import time
+import types
+import zlib
+import random
+import functools
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# --- SERVIDOR LOCAL QUE IMITA A LA API REST DE GEMINI ---
+# Permite probar Intento3_V1_Gestor_IA sin red ni API Key real:
+#   GEMINI_API_ENDPOINT=http://127.0.0.1:<puerto>  ->  _configurar_gemini usa este servidor
+# Los dos sustitutos (Gemini y yfinance) admiten un perfil de latencia, errores y límite de peticiones
+# por segundo para las pruebas de carga (ver Intento3_V1_Carga.py).
+
+RESPUESTA_MARKDOWN_EJEMPLO = """### ✅ 1. PUNTOS FUERTES
+- **Calidad del Beneficio y Generación de FCF:** El FCF respalda el beneficio contable.
+- **Dividendos y Recompras:** Retorno total superior a su histórico.
+- **Deuda:** Apalancamiento contenido.
+- **Otros (Noticias/Contexto):** Sin noticias negativas relevantes.
+
+### ⚠️ 2. PUNTOS DÉBILES
+- **Calidad del Beneficio y Generación de FCF:** Sin debilidades relevantes.
+- **Dividendos y Recompras:** Payout exigente.
+- **Deuda:** Sin debilidades relevantes.
+- **Otros (Noticias/Contexto):** Entorno de consumo débil.
+
+### 🏁 3. CONCLUSIÓN FINAL
+- **DECISIÓN:** [COMPRAR]
+- **JUSTIFICACIÓN:** Respuesta simulada por el stub local: calidad a precio razonable con retorno al accionista respaldado por caja.
+"""
+
+RESPUESTA_JSON_EJEMPLO = {
+    "decision": "COMPRAR",
+    "justificacion": "Respuesta simulada por el stub local: calidad a precio razonable con retorno al accionista respaldado por caja.",
+    "puntos_fuertes": [
+        "Calidad del Beneficio y Generación de FCF: El FCF respalda el beneficio contable.",
+        "Dividendos y Recompras: Retorno total superior a su histórico.",
+    ],
+    "puntos_debiles": [
+        "Otros (Noticias/Contexto): Entorno de consumo débil.",
+    ],
+}
+
+
+_PATRON_EMPRESA = re.compile(r"<<<EMPRESA: ([^>\s]+)>>>")
+
+
+def _respuesta_lote(tickers, json_pedido, omitir):
+    """Respuesta a un prompt por lotes (ver Intento3_V1_Gestor_IA): una sección por ticker salvo los de 'omitir'."""
+    if json_pedido:
+        analisis = [{"ticker": t, **RESPUESTA_JSON_EJEMPLO} for t in tickers if t not in omitir]
+        return json.dumps({"analisis": analisis}, ensure_ascii=False)
+    secciones = []
+    for t in tickers:
+        # Un ticker "omitido" recibe una sección sin decisión: el cliente debe repetirlo individualmente
+        cuerpo = "Sin datos suficientes." if t in omitir else RESPUESTA_MARKDOWN_EJEMPLO
+        secciones.append(f"<<<EMPRESA: {t}>>>\n{cuerpo}")
+    return "\n\n".join(secciones)
+
+
+def _estimar_tokens(texto):
+    # Aproximación habitual: ~4 caracteres por token
+    return max(1, len(texto) // 4)
+
+
+def _limitador(por_segundo):
+    """Función permitir() -> bool con una ventana deslizante de 1 s de 'por_segundo' peticiones (None = sin límite)."""
+    instantes, cerrojo = deque(), threading.Lock()
+
+    def permitir():
+        if not por_segundo:
+            return True
+        with cerrojo:
+            ahora = time.monotonic()
+            while instantes and ahora - instantes[0] >= 1.0:
+                instantes.popleft()
+            if len(instantes) >= por_segundo:
+                return False
+            instantes.append(ahora)
+            return True
+    return permitir
+
+
+def _perturbador(dispersion, probabilidad_error, semilla, probabilidad_cuelgue=0.0, segundos_cuelgue=30.0):
+    """
+    Función sorteo(latencia) -> (segundos, fallar): latencia log-normal con mediana 'latencia' y
+    desviación 'dispersion' (0 = fija) y un error con probabilidad 'probabilidad_error'. Reproducible con 'semilla'.
+    Con 'probabilidad_cuelgue' la petición se queda 'segundos_cuelgue' sin responder (cola de latencia extrema).
+    """
+    aleatorio, cerrojo = random.Random(semilla), threading.Lock()
+
+    def sorteo(latencia):
+        with cerrojo:
+            factor = aleatorio.lognormvariate(0, dispersion) if dispersion else 1.0
+            if probabilidad_cuelgue and aleatorio.random() < probabilidad_cuelgue:
+                return segundos_cuelgue, False
+            return latencia * factor, aleatorio.random() < probabilidad_error
+    return sorteo
+
+
+class _ManejadorGemini(BaseHTTPRequestHandler):
+    """
+    Atiende POST /v1beta/models/<modelo>:generateContent, :streamGenerateContent y :countTokens.
+    Devuelve JSON si la petición pide responseMimeType=application/json y Markdown en caso contrario.
+    En streaming envía el texto troceado (array JSON por chunked encoding, como la API REST),
+    esperando 'servidor.retardo_fragmento' segundos antes de cada trozo.
+    """
+    protocol_version = "HTTP/1.1"  # Necesario para Transfer-Encoding: chunked
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        peticion = json.loads(self.rfile.read(longitud) or b"{}")
+        ruta = self.path.split("?")[0]
+        metodo = ruta.rsplit(":", 1)[-1]
+
+        with self.server.cerrojo:
+            self.server.llamadas[metodo] = self.server.llamadas.get(metodo, 0) + 1
+
+        if metodo == "countTokens":
+            self._responder(200, {"totalTokens": _estimar_tokens(json.dumps(peticion, ensure_ascii=False))})
+            return
+
+        if metodo not in ("generateContent", "streamGenerateContent"):
+            self._responder(404, {"error": {"code": 404, "message": f"Método no simulado: {metodo}"}})
+            return
+
+        # Límite de peticiones por segundo de la cuenta: 429 inmediato, como la API real
+        if not self.server.permitir():
+            self._rechazar("limite", 429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).")
+            return
+
+        # Coste fijo por petición (red, cola, arranque del modelo): es lo que amortiza el modo por lotes
+        retardo, fallar = self.server.sorteo(self.server.retardo_peticion)
+        time.sleep(retardo)
+        if fallar:
+            self._rechazar("error", 500, "INTERNAL", "An internal error has occurred.")
+            return
+
+        config = peticion.get("generationConfig", {})
+        json_pedido = config.get("responseMimeType") == "application/json"
+        texto_usuario = json.dumps(peticion.get("contents", []), ensure_ascii=False)
+        tickers_lote = list(dict.fromkeys(_PATRON_EMPRESA.findall(texto_usuario)))
+        if tickers_lote:
+            texto = _respuesta_lote(tickers_lote, json_pedido, self.server.omitir_en_lote)
+        elif json_pedido:
+            texto = json.dumps(RESPUESTA_JSON_EJEMPLO, ensure_ascii=False)
+        else:
+            texto = RESPUESTA_MARKDOWN_EJEMPLO
+
+        texto_entrada = json.dumps(peticion.get("contents", [])) + json.dumps(peticion.get("systemInstruction", {}))
+        uso = {
+            "promptTokenCount": _estimar_tokens(texto_entrada),
+            "candidatesTokenCount": _estimar_tokens(texto),
+            "totalTokenCount": _estimar_tokens(texto_entrada) + _estimar_tokens(texto),
+        }
+
+        if metodo == "streamGenerateContent":
+            self._responder_streaming(texto, uso)
+            return
+
+        # Sin streaming la respuesta llega de golpe tras generar todos los trozos
+        time.sleep(self.server.retardo_fragmento * -(-len(texto) // self.server.tamano_fragmento))
+        self._responder(200, {
+            "candidates": [{"content": {"parts": [{"text": texto}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": uso,
+        })
+
+    def _responder_streaming(self, texto, uso):
+        tamano = self.server.tamano_fragmento
+        trozos = [texto[i:i + tamano] for i in range(0, len(texto), tamano)]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def escribir(datos):
+            self.wfile.write(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+            self.wfile.flush()
+
+        escribir(b"[")
+        for i, trozo in enumerate(trozos):
+            time.sleep(self.server.retardo_fragmento)
+            fragmento = {"candidates": [{"content": {"parts": [{"text": trozo}], "role": "model"}}]}
+            if i == len(trozos) - 1:
+                fragmento["candidates"][0]["finishReason"] = "STOP"
+                fragmento["usageMetadata"] = uso
+            escribir((b"," if i else b"") + json.dumps(fragmento, ensure_ascii=False).encode("utf-8"))
+        escribir(b"]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _rechazar(self, motivo, codigo, estado, mensaje):
+        with self.server.cerrojo:
+            self.server.rechazos[motivo] += 1
+        self._responder(codigo, {"error": {"code": codigo, "message": mensaje, "status": estado}})
+
+    def _responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # El cliente abandonó la petición (p.ej. plazo agotado)
+
+    def log_message(self, *args):
+        pass  # Silenciamos el log por petición
+
+
+def iniciar_stub_gemini(puerto=0, retardo_fragmento=0.05, tamano_fragmento=80, retardo_peticion=0.0,
+                        omitir_en_lote=(), dispersion_retardo=0.0, probabilidad_error=0.0, limite_por_segundo=None,
+                        semilla=0, probabilidad_cuelgue=0.0, segundos_cuelgue=30.0):
+    """
+    Arranca el stub de Gemini en un hilo en segundo plano.
+    'retardo_peticion' es la latencia (mediana) de cada petición; 'omitir_en_lote' son tickers cuya sección
+    de un prompt por lotes se devuelve sin decisión (para probar la vuelta a llamadas individuales).
+    Perfil de carga: 'dispersion_retardo' (desviación log-normal de la latencia), 'probabilidad_error' (HTTP 500)
+    y 'limite_por_segundo' (HTTP 429 por encima de esa tasa de peticiones de generación).
+    'probabilidad_cuelgue' deja una petición 'segundos_cuelgue' sin responder (para probar plazos y coberturas).
+    Devuelve (servidor, url). 'servidor.llamadas' cuenta las peticiones por método y
+    'servidor.rechazos' las respuestas 'limite' (429) y 'error' (500).
+    """
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _ManejadorGemini)
+    servidor.daemon_threads = True
+    servidor.retardo_fragmento = retardo_fragmento
+    servidor.tamano_fragmento = tamano_fragmento
+    servidor.retardo_peticion = retardo_peticion
+    servidor.omitir_en_lote = set(omitir_en_lote)
+    servidor.sorteo = _perturbador(dispersion_retardo, probabilidad_error, semilla, probabilidad_cuelgue, segundos_cuelgue)
+    servidor.permitir = _limitador(limite_por_segundo)
+    servidor.llamadas = {}
+    servidor.rechazos = {"limite": 0, "error": 0}
+    servidor.cerrojo = threading.Lock()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}"
+
+
+# --- SUSTITUTO LOCAL DE YFINANCE ---
+# Módulo falso que se instala en sys.modules["yfinance"]. Todos los módulos importan yfinance dentro de las
+# funciones que lo usan, así que desde ese momento el proveedor Yahoo y las noticias trabajan contra él.
+# Cada acceso a yf.Ticker (info, fast_info, history(), estados trimestrales, news) cuenta como una petición
+# HTTP, con su latencia, errores y límite por segundo. Los datos son sintéticos y estables por ticker.
+# No simula yf.download (refresco de cotizaciones en bloque).
+
+_CONCEPTOS_SINTETICOS = {
+    "quarterly_financials": {"Net Income": (-1e8, 6e8), "EBITDA": (2e8, 1e9)},
+    "quarterly_cashflow": {"Operating Cash Flow": (1e8, 8e8), "Capital Expenditure": (-3e8, -1e7),
+                           "Repurchase Of Capital Stock": (-2e8, 0), "Issuance Of Capital Stock": (0, 5e7)},
+    "quarterly_balance_sheet": {"Total Debt": (1e9, 5e9), "Cash And Cash Equivalents": (1e8, 2e9)},
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _fechas_sinteticas(hoy):
+    # Generar rangos de fechas con pandas es caro (decenas de ms): las rejillas diaria y trimestral
+    # se construyen una vez al día, no en cada petición simulada
+    return pd.bdate_range(end=hoy, periods=1260), pd.date_range(end=hoy, periods=5, freq="QE")[::-1]
+
+
+def _dato_sintetico(ticker, recurso):
+    """Respuesta sintética de yfinance para 'recurso', siempre la misma para el mismo ticker."""
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    precio, acciones, bpa, dividendo = rng.uniform(20, 200), rng.uniform(1e8, 1e9), rng.uniform(1, 10), rng.uniform(0, 5)
+    if recurso == "fast_info":
+        return {"last_price": precio, "market_cap": precio * acciones}
+    if recurso == "info":
+        return {"forwardPE": precio / bpa, "dividendYield": dividendo / precio * 100, "ebitda": rng.uniform(2e8, 1e9)}
+    if recurso == "history":
+        fechas, _ = _fechas_sinteticas(pd.Timestamp.today().normalize())
+        return pd.DataFrame({"Close": precio * np.exp(np.cumsum(rng.normal(0, 0.01, len(fechas))))}, index=fechas)
+    if recurso == "news":
+        return [{"content": {"title": f"{ticker}: titular simulado {k}"}} for k in range(3)]
+    _, trimestres = _fechas_sinteticas(pd.Timestamp.today().normalize())
+    conceptos = _CONCEPTOS_SINTETICOS[recurso]
+    return pd.DataFrame([rng.uniform(bajo, alto, len(trimestres)) for bajo, alto in conceptos.values()],
+                        index=list(conceptos), columns=trimestres)
+
+
+def instalar_stub_yahoo(latencia=0.1, dispersion=0.0, probabilidad_error=0.0, limite_por_segundo=None, semilla=0,
+                        probabilidad_cuelgue=0.0, segundos_cuelgue=30.0):
+    """
+    Sustituye yfinance por el módulo simulado. 'latencia' es la mediana en segundos de cada petición,
+    'dispersion' su desviación log-normal, 'probabilidad_error' la de un error HTTP 500 y 'limite_por_segundo'
+    la tasa a partir de la cual se responde "Too Many Requests" (como yfinance con Yahoo).
+    'probabilidad_cuelgue' deja una petición colgada 'segundos_cuelgue' (para probar plazos y coberturas).
+    Devuelve el módulo: 'stub.llamadas' cuenta peticiones por recurso y 'stub.rechazos' los 'limite' y 'error'.
+    Se retira con desinstalar_stub_yahoo(stub).
+    """
+    stub = types.ModuleType("yfinance")
+    stub.__version__ = "stub"
+    stub.llamadas, stub.rechazos = {}, {"limite": 0, "error": 0}
+    stub._previo = sys.modules.get("yfinance")
+    cerrojo = threading.Lock()
+    permitir = _limitador(limite_por_segundo)
+    sorteo = _perturbador(dispersion, probabilidad_error, semilla, probabilidad_cuelgue, segundos_cuelgue)
+
+    def peticion(ticker, recurso):
+        with cerrojo:
+            stub.llamadas[recurso] = stub.llamadas.get(recurso, 0) + 1
+        if not permitir():
+            with cerrojo:
+                stub.rechazos["limite"] += 1
+            raise RuntimeError("Too Many Requests. Rate limited. Try after a while.")
+        retardo, fallar = sorteo(latencia)
+        time.sleep(retardo)
+        if fallar:
+            with cerrojo:
+                stub.rechazos["error"] += 1
+            raise RuntimeError(f"HTTP Error 500: Internal Server Error ({ticker}, {recurso})")
+        return _dato_sintetico(ticker, recurso)
+
+    class Ticker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        def history(self, period="1mo", **kwargs):
+            return peticion(self.ticker, "history")
+
+    for recurso in ("info", "fast_info", "news") + tuple(_CONCEPTOS_SINTETICOS):
+        setattr(Ticker, recurso, property(lambda self, r=recurso: peticion(self.ticker, r)))
+
+    stub.Ticker = Ticker
+    sys.modules["yfinance"] = stub
+    return stub
+
+
+def desinstalar_stub_yahoo(stub):
+    """Devuelve a sys.modules el yfinance que hubiera antes de instalar_stub_yahoo."""
+    if stub._previo is not None:
+        sys.modules["yfinance"] = stub._previo
+    else:
+        sys.modules.pop("yfinance", None)
+
+
+# ==========================================
+# BLOQUE DE PRUEBA
+# ==========================================
+if __name__ == "__main__":
+    import os
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stub local de la API de Gemini")
+    parser.add_argument("--puerto", type=int, default=0)
+    parser.add_argument("--servir", action="store_true", help="Mantener el servidor arrancado")
+    args = parser.parse_args()
+
+    servidor, url = iniciar_stub_gemini(args.puerto)
+    print(f"\n--- 🧪 STUB GEMINI escuchando en {url} ---")
+
+    if args.servir:
+        print(f"   > Exporta GEMINI_API_ENDPOINT={url} antes de lanzar la app. Ctrl+C para parar.")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            servidor.shutdown()
+    else:
+        os.environ["GEMINI_API_ENDPOINT"] = url
+        from Intento3_V1_Gestor_IA import generar_analisis_gemini
+
+        datos = {'precio': 60.0, 'per_ltm': 18.0, 'per_ntm': 16.5, 'div_yield': 0.03, 'buyback_yield': 0.02,
+                 'fcf_yield_mc': 0.05, 'payout_ratio': 0.6, 'fcf_yield_ev': 0.045, 'ratio_solvencia': 2.1,
+                 'noticias': ["Titular de ejemplo"]}
+        informe = {'decision': "COMPRAR", 'puntos_fuertes': ["✅ Ejemplo"], 'alertas': [], 'alertas_criticas': []}
+
+        for estructurado in (False, True):
+            for streaming in (False, True):
+                primer_fragmento = []
+                t0 = time.perf_counter()
+                al_recibir = (lambda _: primer_fragmento or primer_fragmento.append(time.perf_counter() - t0)) if streaming else None
+                texto, _, decision, justificacion = generar_analisis_gemini("clave-falsa", "TEST", datos, informe,
+                                                                            modo_estructurado=estructurado,
+                                                                            al_recibir_fragmento=al_recibir)
+                total = time.perf_counter() - t0
+                ttft = f", primer fragmento {primer_fragmento[0]:.3f}s" if primer_fragmento else ""
+                print(f"   > estructurado={estructurado} streaming={streaming}: {decision} (total {total:.3f}s{ttft})")
+        print(f"     Justificación: {justificacion[:80]}...")
+        print(f"   > Llamadas recibidas: {servidor.llamadas}")
+
+        # Modo por lotes: 10 empresas en lotes de 5, con una sección ilegible que se repite individualmente
+        from Intento3_V1_Gestor_IA import generar_analisis_gemini_lote
+        servidor.llamadas.clear()
+        servidor.omitir_en_lote = {"T3"}
+        peticiones = [(f"T{k}", dict(datos), informe) for k in range(10)]
+        t0 = time.perf_counter()
+        resultados = generar_analisis_gemini_lote("clave-falsa", peticiones, tamano_lote=5)
+        print(f"   > Lotes: {len(resultados)} análisis con {servidor.llamadas} en {time.perf_counter() - t0:.3f}s")
+        servidor.shutdown()
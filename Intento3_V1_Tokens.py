@@ -0,0 +1,163 @@
+# NOMBRE DEL FICHERO: Intento3_V1_Tokens.py
+
+import math
+import functools
+import contextvars
+import pandas as pd
+
+# --- 1. PRECIOS (USD por millón de tokens) ---
+# Tarifas públicas de referencia; actualizar si cambian. El razonamiento interno se factura como salida.
+PRECIOS_POR_MILLON = {
+    'gemini-3-flash-preview': {"entrada": 0.50, "salida": 3.00},
+    'gemini-2.5-flash': {"entrada": 0.30, "salida": 2.50},
+    'gemini-2.5-flash-lite': {"entrada": 0.10, "salida": 0.40},
+}
+
+
+# --- 2. TOKENIZADOR ENCHUFABLE ---
+def estimar_tokens_caracteres(texto):
+    """
+    Estimación local sin dependencias: ~4 caracteres por token (aproximación habitual para Gemini).
+    """
+    if not texto:
+        return 0
+    return math.ceil(len(texto) / 4)
+
+
+# Por contexto (hilo): cada sesión de Streamlit ejecuta su script en su propio hilo y puede usar
+# un tokenizador distinto (el de Gemini va ligado a la API Key de la sesión)
+_tokenizador_activo = contextvars.ContextVar("tokenizador_activo", default=estimar_tokens_caracteres)
+
+# Tiempo máximo de cada llamada a countTokens
+PLAZO_RECUENTO_SEGUNDOS = 10
+
+
+def configurar_tokenizador(funcion):
+    """
+    Sustituye el tokenizador local por cualquier función texto -> nº de tokens
+    (p.ej. tokenizador_gemini(), un tokenizador de terceros, etc.). None restaura el estimador por defecto.
+    Solo afecta al hilo actual.
+    """
+    _tokenizador_activo.set(funcion or estimar_tokens_caracteres)
+
+
+def contar_tokens(texto):
+    """Cuenta tokens con el tokenizador activo."""
+    return _tokenizador_activo.get()(texto)
+
+
+def tokenizador_gemini(modelo):
+    """
+    Tokenizador exacto del proveedor (una llamada a countTokens por texto distinto; los repetidos,
+    como las instrucciones del sistema, se recuerdan).
+    'modelo' es un genai.GenerativeModel ya configurado. Si la llamada falla, recurre a la estimación local.
+    """
+    @functools.lru_cache(maxsize=1024)
+    def _contar_proveedor(texto):
+        return modelo.count_tokens(texto, request_options={"timeout": PLAZO_RECUENTO_SEGUNDOS}).total_tokens
+
+    def _contar(texto):
+        if not texto:
+            return 0
+        try:
+            return _contar_proveedor(texto)
+        except Exception as e:
+            print(f"Aviso: countTokens no disponible ({e}); se usa la estimación local.")
+            return estimar_tokens_caracteres(texto)
+    return _contar
+
+
+# --- 3. RECORTE DEL PROMPT SEGÚN PRESUPUESTO ---
+def compactar_espacios(texto):
+    """
+    Elimina la sangría y las líneas en blanco repetidas (no aportan nada al modelo y cuestan tokens).
+    """
+    lineas = [linea.strip() for linea in texto.strip().split("\n")]
+    compactas = []
+    for linea in lineas:
+        if linea or (compactas and compactas[-1]):
+            compactas.append(linea)
+    return "\n".join(compactas)
+
+
+def ajustar_prompt_a_presupuesto(construir_prompt, noticias, presupuesto):
+    """
+    Ajusta el prompt de usuario al presupuesto de tokens.
+    'construir_prompt(noticias, compacto)' devuelve el prompt para una lista de noticias.
+
+    Orden de recorte: 1) compactar espacios, 2) quitar noticias empezando por las más antiguas (final de la lista).
+    Devuelve (prompt, recorte) con recorte = {"compactado", "noticias_eliminadas", "excede_presupuesto"}.
+    """
+    recorte = {"compactado": False, "noticias_eliminadas": 0, "excede_presupuesto": False}
+    prompt = construir_prompt(noticias, False)
+    if presupuesto is None or contar_tokens(prompt) <= presupuesto:
+        return prompt, recorte
+
+    recorte["compactado"] = True
+    n = len(noticias)
+    prompt = construir_prompt(noticias, True)
+    while contar_tokens(prompt) > presupuesto and n > 0:
+        n -= 1
+        prompt = construir_prompt(noticias[:n], True)
+
+    recorte["noticias_eliminadas"] = len(noticias) - n
+    recorte["excede_presupuesto"] = contar_tokens(prompt) > presupuesto
+    return prompt, recorte
+
+
+def presupuesto_disponible(presupuesto_ticker, presupuesto_run, registros, tickers=1):
+    """
+    Presupuesto de tokens de entrada para el siguiente ticker: el menor entre el límite por ticker
+    y lo que queda del límite de la ejecución (ya consumido = entrada + salida de los registros previos),
+    repartido entre 'tickers' si van juntos en una misma petición (modo por lotes).
+    En los límites de entrada, 0 o None significa "sin límite".
+
+    Devuelve None si no hay ningún límite; si no, los tokens que quedan, que pueden ser 0 o negativos
+    cuando la ejecución ya ha agotado su presupuesto (ver presupuesto_agotado).
+    """
+    limites = []
+    if presupuesto_ticker:
+        limites.append(presupuesto_ticker)
+    if presupuesto_run:
+        consumido = sum(r["tokens_entrada"] + r["tokens_salida"] for r in registros)
+        limites.append((presupuesto_run - consumido) / tickers)
+    return min(limites) if limites else None
+
+
+def presupuesto_agotado(presupuesto, tokens_sistema=0):
+    """
+    True si el presupuesto (de presupuesto_disponible) no llega ni para las instrucciones del sistema:
+    la llamada a la IA se omite en lugar de enviarla sin noticias o por encima del límite.
+    """
+    return presupuesto is not None and presupuesto <= tokens_sistema
+
+
+# --- 4. COSTE E INFORME ---
+def calcular_coste(tokens_entrada, tokens_salida, modelo):
+    precios = PRECIOS_POR_MILLON.get(modelo)
+    if not precios:
+        return 0.0
+    return (tokens_entrada * precios["entrada"] + tokens_salida * precios["salida"]) / 1_000_000
+
+
+def informe_tokens(registros):
+    """
+    Tabla por ticker (tokens de sistema, usuario, salida, fuente del recuento, recortes y coste)
+    y diccionario de totales de la ejecución ('llamadas' = peticiones reales a la IA; 'coste_desperdiciado_usd' =
+    cuotas de lote pagadas sin producir análisis).
+    """
+    df = pd.DataFrame(registros)
+    if df.empty:
+        return df, {"tokens_entrada": 0, "tokens_salida": 0, "coste_usd": 0.0, "llamadas": 0,
+                    "coste_desperdiciado_usd": 0.0}
+
+    totales = {
+        "tokens_entrada": int(df["tokens_entrada"].sum()),
+        "tokens_salida": int(df["tokens_salida"].sum()),
+        "coste_usd": float(df["coste_usd"].sum()),
+        # En el modo por lotes varias filas comparten petición (columna 'lote')
+        "llamadas": int(df["lote"].isna().sum() + df["lote"].nunique()) if "lote" in df else len(df),
+        "coste_desperdiciado_usd": float(df.loc[df["desperdiciado"].eq(True), "coste_usd"].sum())
+                                   if "desperdiciado" in df else 0.0,
+    }
+    return df, totales
@@ -1,15 +1,35 @@
 # NOMBRE DEL FICHERO: Intento3_V1_app.py
 
 import streamlit as st
-import plotly.graph_objects as go
 import pandas as pd
 import time
 import sys
+import os
+import tempfile
 
 # --- IMPORTAMOS MÓDULOS ---
-from Intento3_V1_Obtener_Datos import obtener_datos_financieros
+# Las librerías pesadas (yfinance, google.generativeai, plotly) se importan dentro de las funciones que las usan:
+# la barra lateral se pinta sin esperarlas. Ver Intento3_V1_Arranque.py para medir el arranque.
+from Intento3_V1_Obtener_Datos import (obtener_datos_financieros_con_plazo, obtener_datos_financieros_lote, refrescar_datos_financieros,
+                                       obtener_datos_precalentados)
+from Intento3_V1_Precalentado import PRECALENTADO_TTL_SEGUNDOS, registrar_peticiones, ultimo_precalentado, ttl_precalentado
+from Intento3_V1_Proveedores import DIRECTORIO_VOLCADOS
 from Intento3_V1_GateKeeper import ejecutar_gatekeeper
-from Intento3_V1_Gestor_IA import generar_analisis_gemini
+from Intento3_V1_Gestor_IA import (generar_analisis_gemini, generar_analisis_gemini_lote, tokenizador_exacto,
+                                   DECISIONES_VALIDAS, DECISION_SIN_TIEMPO, TEXTO_SIN_TIEMPO)
+from Intento3_V1_Noticias import lanzar_descarga_noticias
+from Intento3_V1_Incremental import evaluar_cambios, guardar_analisis
+from Intento3_V1_Cache import describir_antiguedad
+from Intento3_V1_Tokens import presupuesto_disponible, informe_tokens, configurar_tokenizador
+from Intento3_V1_Sensibilidad import barrido_sensibilidad, generar_rejilla, rangos_por_defecto
+from Intento3_V1_Embudo import cargar_universo, ejecutar_embudo
+from Intento3_V1_Almacen_Precios import abrir_almacen, guardar_historicos, serie_cierres
+from Intento3_V1_Exportacion import abrir_exportacion, cerrar_exportacion, exportar_fila, fila_exportacion, ruta_exportacion_nueva
+from Intento3_V1_Perfilado import iniciar_perfilado, detener_perfilado, ruta_perfil_nueva
+from Intento3_V1_Memo import contadores_memo, guardar_memo, informe_memo
+from Intento3_V1_Pares import MIN_PARES, NIVELES_PARES, nuevo_registro_pares, actualizar_pares, referencias_pares, estadisticas_pares
+from Intento3_V1_Plazos import PLAZOS_POR_DEFECTO, limite_ejecucion, restante, estadisticas_plazos
+from Intento3_V1_Historial import fila_historial, anadir_ejecucion, abrir_historial, ejecuciones_historial, cambios_ultima_ejecucion
 
 # Configuración de página
 st.set_page_config(page_title="Herramienta TFM", layout="wide")
@@ -32,6 +52,76 @@ with st.sidebar:
             st.warning("⚠️ Introduce tu API Key para activar la IA.")
     
     st.divider()
+
+    # MODO DE DATOS: descarga completa o refresco intradía (fundamentales TTM en caché + precios en bloque)
+    modo_datos = st.radio("Datos financieros", ["📥 Descarga completa", "⚡ Refrescar cotizaciones"],
+                          help="El refresco reutiliza los fundamentales TTM de la última descarga completa y solo pide los precios, en bloque, recalculando los ratios dependientes del precio.")
+    refrescar_cotizaciones = modo_datos.startswith("⚡")
+
+    # PRECALENTADO: snapshots descargados antes de la apertura por Intento3_V1_Precalentado.py
+    usar_precalentado = st.checkbox("♨️ Usar datos precalentados", value=True,
+                                    help=f"Con el mercado cerrado, los tickers con un snapshot en caché escrito después del último cierre (y de menos de {PRECALENTADO_TTL_SEGUNDOS // 3600} h) no se vuelven a descargar. Con el mercado abierto se descargan todos.")
+
+    # FUENTE DE FUNDAMENTALES: Yahoo (ticker a ticker) o volcado local del proveedor (CSV/Parquet, en bloque)
+    fuente_datos = st.radio("Fuente de fundamentales", ["🌐 Yahoo Finance", "🗂️ Volcado local"],
+                            help="El volcado local carga cotizaciones y estados trimestrales de todo el universo en una lectura; los tickers que no estén en el volcado se descargan de Yahoo.")
+    if fuente_datos.startswith("🗂️"):
+        directorio_volcado = st.text_input("Carpeta del volcado", DIRECTORIO_VOLCADOS)
+
+    # MODO ESTRUCTURADO: Gemini responde un JSON con esquema fijo y el Markdown se pinta en local
+    modo_json = st.checkbox("📐 Respuesta IA estructurada (JSON)", value=False,
+                            help="Menos tokens de salida y extracción fiable de la decisión y la justificación.")
+
+    # STREAMING: el análisis se va pintando según lo genera Gemini
+    modo_streaming = st.checkbox("⚡ Mostrar la respuesta IA en tiempo real", value=True)
+
+    # LOTES: varias empresas por petición a Gemini (las instrucciones del sistema se envían una vez por lote)
+    modo_lotes = st.checkbox("📦 Agrupar los análisis IA en lotes", value=False,
+                             help="Menos peticiones y tokens de entrada. Los análisis se pintan al terminar el recorrido (sin streaming).")
+    if modo_lotes:
+        tamano_lote = st.slider("Empresas por petición", 2, 10, 5)
+
+    # REANÁLISIS INCREMENTAL: solo se llama a la IA si la decisión, algún ratio o las noticias cambian
+    modo_incremental = st.checkbox("♻️ Reutilizar análisis IA si no hay cambios relevantes", value=True)
+    if modo_incremental:
+        factor_tolerancia = st.slider("Tolerancia de cambio en ratios (x veces la por defecto)", 0.5, 5.0, 1.0, step=0.5)
+
+    # PRESUPUESTO DE TOKENS (0 = sin límite): si se supera se recortan espacios y noticias del prompt
+    with st.expander("🧮 Presupuesto de tokens IA"):
+        presupuesto_ticker = int(st.number_input("Máx. tokens de entrada por ticker", 0, 1_000_000, 0, step=500))
+        presupuesto_run = int(st.number_input("Máx. tokens por ejecución", 0, 100_000_000, 0, step=10_000))
+        recuento_exacto = st.checkbox("Recuento exacto con countTokens de Gemini", value=False,
+                                      help="Sin marcar, los tokens de los prompts se estiman en local (~4 caracteres por token). Marcado, cada texto distinto cuesta una llamada a countTokens.")
+
+    # MODO PARES: medianas Ref_* y percentil calculados en vivo entre las empresas del mismo subsector/sector
+    modo_pares = st.checkbox("👥 Comparar con los pares del sector", value=False,
+                             help="Sustituye las medianas del Excel por las de los pares con snapshot (caché del día y tickers analizados) y añade al Gatekeeper el percentil de la empresa frente a ellos.")
+
+    # MODO SENSIBILIDAD: barrido de umbrales del Gatekeeper sobre los tickers analizados
+    modo_sensibilidad = st.checkbox("🎛️ Barrido de sensibilidad del Gatekeeper", value=False,
+                                    help="La amplitud y el número de juegos de parámetros se ajustan junto a los resultados.")
+
+    # EXPORTACIÓN: detalle por ticker (ratios, diferencias con referencias, Gatekeeper e IA) a Excel y Parquet
+    modo_exportar = st.checkbox("💾 Exportar el detalle por ticker (Excel y Parquet)", value=False,
+                                help="Cada ticker se escribe en cuanto termina: aunque la ejecución se interrumpa, el fichero contiene lo ya analizado.")
+
+    # PERFILADO: CPU (cProfile + pilas muestreadas) y memoria (tracemalloc) de la próxima ejecución
+    modo_perfilado = st.checkbox("🔬 Perfilar la próxima ejecución (CPU y memoria)", value=False,
+                                 help="Guarda un perfil de CPU (pstats y pilas plegadas para flamegraph) y una instantánea de tracemalloc, con un resumen de los puntos calientes. La ejecución se ralentiza un poco.")
+
+    # PLAZOS: tiempo máximo por llamada y por ejecución; un ticker sin tiempo se queda con lo que haya (caché o Gatekeeper)
+    with st.expander("⏱️ Plazos"):
+        plazo_yahoo = st.number_input("Máx. segundos por descarga de Yahoo", 1, 600, int(PLAZOS_POR_DEFECTO["yahoo"]))
+        plazo_ia = st.number_input("Máx. segundos por análisis IA", 1, 600, int(PLAZOS_POR_DEFECTO["gemini"]))
+        plazo_run = st.number_input("Máx. minutos por ejecución (0 = sin límite)", 0, 1_440, 0)
+        cubrir_lentas = st.checkbox("Duplicar llamadas lentas (cobertura p95)", value=True,
+                                    help="Si una descarga tarda más que el 95% de las recientes (o la mitad de su plazo) se lanza una copia y gana la primera respuesta (como mucho ~10% de llamadas extra). Las peticiones a la IA no se duplican: cada copia se factura.")
+
+    # CRIBADO EN EMBUDO: universo amplio (CSV/Excel con columna Ticker) filtrado por niveles de coste creciente
+    with st.expander("🔻 Cribado en embudo"):
+        fichero_universo = st.file_uploader("Universo (CSV o Excel con columna 'Ticker')", type=["csv", "xlsx"],
+                                            help="Si no se sube ningún fichero se criba el universo de 'Referencias.xlsx'.")
+        hilos_embudo = st.slider("Descargas en paralelo", 1, 16, 8)
     
 # --- TÍTULO PRINCIPAL ---
 st.title("📊 Análisis Fundamental Automatizado (Quality Value)")
@@ -79,7 +169,328 @@ seleccion = st.sidebar.multiselect(
     key="empresas_seleccionadas" 
 )
 
-if st.button("🚀 Ejecutar Análisis"):
+# --- PINTADO DE RESULTADOS POR TICKER ---
+# Se usan tanto durante la ejecución como al repintar de memoria (st.session_state) tras cualquier interacción.
+color_map = {"COMPRAR": "green", "NEUTRAL/PRECAUCIÓN": "orange", "DESCARTAR": "red"}
+
+
+# Función auxiliar para formatear visualización
+def formatear_ratio_visual(valor):
+    if valor == sys.float_info.max or valor == 0:
+        return "N/A"
+    return f"{valor:.2f}x"               
+
+
+def pintar_informe_algoritmo(ticker, datos, fila_ref, informe, cierres):
+    """KPIs, gráfico de precio y decisión del Gatekeeper de un ticker (se usa en la ejecución y al repintar de memoria)."""
+    # --- HACK CSS PARA REDUCIR ESPACIOS VERTICALES EN VISUALIZACIÓN DE KPIs---
+    st.markdown("""
+    <style>
+        /* 1. Reducir el margen inferior de los títulos H4 (####) */
+        h4 {
+            margin-bottom: 0.1rem !important;
+            padding-bottom: 0rem !important;
+        }
+        
+        /* 2. Reducir el espacio de los divisores (st.divider) */
+        hr {
+            margin-top: 0.5rem !important;
+            margin-bottom: 0.5rem !important;
+        }
+        
+        /* 3. (Opcional) Ajustar el padding interno de los contenedores con borde */
+        div[data-testid="stVerticalBlockBorderWrapper"] > div {
+            gap: 0.5rem; /* Reduce el hueco entre elementos dentro de la caja */
+        }
+    </style>
+    """, unsafe_allow_html=True)
+    
+                    
+    # --- VISUALIZACIÓN DE KPIs MEJORADA ---
+
+    with st.expander(f"Análisis por Algoritmo de {ticker}", expanded=True):
+
+        st.markdown("### 📊 Tablero de Control Financiero")
+
+        # Creamos dos grandes columnas principales para dividir la pantalla
+        # Izquierda: Métricas Fundamentales | Derecha: Gráfico de Precio
+        col_izq, col_der = st.columns([1.2, 1.8], gap="medium")
+
+        # --- COLUMNA IZQUIERDA: MÉTRICAS FUNDAMENTALES ---
+        with col_izq:
+            # --- GRUPO 1: VALORACIÓN Y PRECIO ---
+            # Usamos st.container(border=True) para crear una "Caja" visual
+            with st.container(border=True):
+                st.markdown("#### 🏷️ Precio y Ratios de Valoración")
+                
+                st.divider() # Línea separadora interna
+                
+                # Sub-columnas dentro de la tarjeta
+                c1, c2 = st.columns(2)
+                
+                c1.metric(
+                    "Precio Actual",
+                    f"${datos['precio']:.2f}",
+                    help="Precio de cierre más reciente"
+                )
+                
+
+                # Ratio de Solvencia
+                val_solvencia = datos['ratio_solvencia']
+                
+                # Verificamos si es un número (int o float) para poder restar
+                if isinstance(val_solvencia, (int, float)):
+                    delta_solvencia = val_solvencia - fila_ref['Ref_Solvencia_Mediana']
+                    delta_str = f"{delta_solvencia:.1f}x vs Ref"
+                    val_str = formatear_ratio_visual(val_solvencia)
+                else:
+                    # Si es "N/A", no calculamos delta
+                    delta_str = "N/A"
+                    val_str = "N/A"
+                c2.metric(
+                    "Solvencia", 
+                    val_str, 
+                    delta=delta_str,
+                    delta_color="inverse", # Menos deuda suele ser mejor
+                    help="Deuda Neta / (EBITDA - Capex)"
+                )
+                
+                st.divider() # Línea separadora interna
+                
+                c3, c4 = st.columns(2)
+                
+                # PER Actual
+                if datos['per_ltm'] is not None and datos['per_ltm'] >= 0:
+                    per_ltm_val = f"{datos['per_ltm']:.2f}x"
+                    delta_per = f"{datos['per_ltm'] - fila_ref['Ref_PER_LTM_Mediana']:.1f}x vs Ref"
+                else:
+                    delta_per = "N/A"
+                    per_ltm_val = "N/A"
+                c3.metric(
+                    "PER (LTM)",
+                    per_ltm_val,
+                    delta=delta_per,
+                    delta_color="inverse",
+                    help="PER últimos 12 meses"
+                )
+                
+                # PER Estimado
+                delta_est = datos['per_ntm'] - fila_ref['Ref_PER_NTM_Mediana']
+                c4.metric(
+                    "PER (NTM)", 
+                    formatear_ratio_visual(datos['per_ntm']), 
+                    delta=f"{delta_est:.1f}x vs Ref",
+                    delta_color="inverse",
+                    help="PER estimado próximos 12 meses"
+                )
+
+            # --- GRUPO 2: RETORNO AL ACCIONISTA ---
+            with st.container(border=True):
+                st.markdown("#### 💰 Retorno y Flujos (Yields)")
+                
+                st.divider() # Línea separadora interna
+
+                # Fila 1 de Yields
+                y1, y2, y3 = st.columns(3)
+                
+                delta_div = datos['div_yield'] - (fila_ref['Ref_Div_Yield_Mediana']/100)
+                y1.metric(
+                    "Dividend Yield", 
+                    f"{datos['div_yield']:.2%}", 
+                    delta=f"{delta_div:.2%} vs Ref",
+                    help="Rendimiento por dividendos."
+                )
+                
+                delta_buy = datos['buyback_yield'] - (fila_ref['Ref_Buyback_Yield_Mediana']/100)
+                y2.metric(
+                    "Buyback Yield", 
+                    f"{datos['buyback_yield']:.2%}", 
+                    delta=f"{delta_buy:.2%} vs Ref",
+                    help="Rendimiento por recompras de acciones."
+                )
+
+                delta_total = datos['total_yield'] - (fila_ref['Ref_Total_Yield']/100)
+                y3.metric(
+                    "Total Yield", 
+                    f"{datos['total_yield']:.2%}", 
+                    delta=f"{delta_total:.2%} vs Ref",
+                    help="Rendimiento total al accionista: Dividendo + Recompras"
+                )
+                
+                st.divider() # Línea separadora interna
+                
+                # Fila 2 de Yields (FCF y Total)
+                y4, y5 = st.columns(2)
+                
+                delta_fcf_ev = datos['fcf_yield_ev'] - (fila_ref['Ref_FCF_Yield_Mediana']/100)
+                y4.metric(
+                    "FCF Yield (EV)", 
+                    f"{datos['fcf_yield_ev']:.2%}", 
+                    delta=f"{delta_fcf_ev:.2%} vs Ref",
+                    help="Free Cash Flow / Enterprise Value: indica la rentabilidad del flujo de caja libre respecto al valor total de la empresa."
+                )                      
+
+                delta_fcf_mc = datos['fcf_yield_mc'] - datos['total_yield']
+                y5.metric(
+                    "FCF Yield (MC)",
+                    f"{datos['fcf_yield_mc']:.2%}",
+                    delta=f"{delta_fcf_mc:.2%} vs Total Yield",
+                    help="Free Cash Flow / Market Capitalization: se compara con Total Yield para saber si el retorno está respaldado por caja."
+                )
+
+        # --- COLUMNA DERECHA: GRÁFICO PROFESIONAL CON PLOTLY ---
+        with col_der:
+            with st.container(border=True):
+                st.markdown("#### 📈 Evolución del Precio (5 años)")
+                
+                if cierres is None or cierres.dropna().empty:
+                    cierres = pd.Series(dtype="float64") # Volcado sin histórico: gráfico vacío
+                
+                # Usamos Plotly en lugar de st.line_chart para que sea interactivo (se importa al pintar el primer gráfico)
+                import plotly.graph_objects as go
+                fig = go.Figure()
+                
+                # Línea de precio
+                fig.add_trace(go.Scatter(
+                    x=cierres.index, 
+                    y=cierres,
+                    mode='lines',
+                    name='Precio',
+                    connectgaps=True, # El almacén alinea todos los tickers: días sin cotización de este ticker = NaN
+                    line=dict(color='#00FF00' if cierres.empty or cierres.iloc[-1] >= cierres.iloc[0] else '#FF0000', width=2),
+                    hovertemplate = "$%{y:.2f}"
+                ))
+                
+                # Configuración del diseño "Dark Mode Friendly"
+                fig.update_layout(
+                    height=450,
+                    margin=dict(l=20, r=20, t=30, b=20),
+                    paper_bgcolor='rgba(0,0,0,0)', # Fondo transparente
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    xaxis=dict(showgrid=False),
+                    yaxis=dict(showgrid=True, gridcolor='rgba(128,128,128,0.2)'),
+                    hovermode="x unified"
+                )
+                
+                st.plotly_chart(fig, use_container_width=True, key=f"grafico_{ticker}")
+        # -------------------------------------------------------              
+
+    # C. GATEKEEPER (resultado ya calculado)
+        # Pintar Resultado Gatekeeper
+        color = color_map.get(informe['decision'], "gray")
+        
+        st.markdown(f"### 🤖 Decisión Algorítmica: :{color}[**{informe['decision']}**]")
+        st.info(f"**Lógica:** {informe['motivo_principal']}")
+        st.info(f"Puntos Fuertes y Alertas a continuación detalladas.")
+
+        # VISUALIZACIÓN DE PUNTOS FUERTES Y ALERTAS ---
+        st.markdown("---") # Separador horizontal
+        
+        # Creamos 2 columnas para ponerlos frente a frente
+        col_pros, col_cons = st.columns(2)
+
+        with col_pros:
+            st.subheader("✅ Puntos Fuertes")
+            if informe['puntos_fuertes']:
+                for punto in informe['puntos_fuertes']:
+                    # Opción A: Cajas verdes (muy visual)
+                    st.success(f"📍 {punto}")
+            else:
+                st.markdown("_No hay puntos fuertes destacados._")
+
+        with col_cons:
+            st.subheader("⚠️ Alertas Detectadas")
+            if informe['alertas']:
+                for alerta in informe['alertas']:
+                    # Opción B: Cajas rojas (destaca el riesgo)
+                    st.error(f"🚩 {alerta}")
+            else:
+                st.markdown("_No hay alertas moderadas._")
+            if informe['alertas_criticas']:
+                for alerta in informe['alertas_criticas']:
+                    st.error(f"🚨 Alerta Crítica: {alerta}")
+            else:
+                st.markdown("_No hay alertas críticas._")
+        
+        st.markdown("---")
+        # -------------------------------------------------------     
+
+
+def pintar_cabecera(ticker):
+    col_logo, col_titulo = st.columns([1, 10])
+    with col_titulo:
+        # 1. Recuperamos los datos del Excel de forma segura antes de pintar
+        try:
+            # Filtramos el dataframe global para sacar la fila de este ticker
+            datos_ref = df_refs[df_refs['Ticker'] == ticker].iloc[0]
+            sector = datos_ref['Sector']
+            subsector = datos_ref['Subsector']
+        except:
+            sector = "No definido"
+            subsector = "No definido"
+
+        # 2. Pintamos el Título Principal (Grande)
+        st.subheader(f"Análisis de {mapa_nombres.get(ticker, ticker)}")
+        
+        # 3. Pintamos el Subtítulo (Más pequeño y gris)
+        # Usamos HTML para ajustar el margen superior negativo (-15px) y pegarlo al título
+        st.markdown(f"""
+        <div style='margin-top: -15px; margin-bottom: 10px; font-size: 16px; color: #a0a0a0;'>
+            <b>Sector:</b> {sector} <span style='margin: 0 10px;'>|</span> <b>Subsector:</b> {subsector}
+        </div>
+        """, unsafe_allow_html=True)
+
+
+def mostrar_analisis_ia(marcador_ia, contenedor_ia, analisis_texto, prompt_debug, decision_ia):
+    # 1. Mostramos el análisis normal (sustituye al texto parcial)
+    marcador_ia.markdown(analisis_texto)
+    with contenedor_ia:
+        color2 = color_map.get(decision_ia, "gray")
+        st.markdown(f"### 🤖 Decisión IA: :{color2}[**{decision_ia}**]")
+
+        # 2. Mostramos el Prompt oculto en un desplegable (SOLO DEBUG)
+        if prompt_debug:
+            with st.expander("🛠️ Ver Prompt técnico enviado a Gemini (Debug)"):
+                st.caption("Este es el texto exacto que se envió a la IA:")
+                st.code(prompt_debug, language="markdown")
+
+
+def pintar_ticker_guardado(ticker, resultado):
+    """Repinta de memoria el bloque de un ticker de la última ejecución: sin descargas ni llamadas a Gemini."""
+    st.markdown(f"---") # Separador visual
+    pintar_cabecera(ticker)
+
+    with st.expander(f"Ver informe detallado de {ticker}", expanded=True):
+        if resultado.get("error"):
+            st.error(resultado["error"])
+            return
+
+        informe = resultado["informe"]
+        pintar_informe_algoritmo(ticker, resultado["datos"], resultado["fila_ref"], informe, resultado["cierres"])
+
+        with st.expander(f"Análisis con IA de {ticker}", expanded=True):
+            if informe['decision'] == "DESCARTAR":
+                st.warning("⛔ El análisis de IA se ha omitido...")
+            elif resultado["analisis"] is not None:
+                st.divider()
+                st.markdown("### 🧠 Análisis Cualitativo (IA)")
+                marcador_ia = st.empty()
+                for aviso in resultado["avisos_ia"]:
+                    st.caption(aviso)
+                analisis_texto, prompt_debug, decision_ia, _ = resultado["analisis"]
+                mostrar_analisis_ia(marcador_ia, st.container(), analisis_texto, prompt_debug, decision_ia)
+
+
+ejecutar_analisis = st.button("🚀 Ejecutar Análisis")
+
+# Perfilado de una ejecución interrumpida (otro widget relanzó el script a mitad): se detiene sin guardar
+perfilador_abandonado = st.session_state.pop("perfilador_activo", None)
+if perfilador_abandonado is not None:
+    detener_perfilado(perfilador_abandonado)
+
+if ejecutar_analisis:
+    if modo_perfilado:
+        st.session_state["perfilador_activo"] = iniciar_perfilado()
     
     if not gemini_api_key:
         st.warning("⚠️ Por favor, introduce tu API Key de Gemini en la barra lateral para activar el análisis cualitativo.")
@@ -88,343 +499,303 @@ if st.button("🚀 Ejecutar Análisis"):
     barra = st.progress(0)
     i = 0
     lista_resultados = [] # <--- AQUÍ GUARDAREMOS LOS DATOS    
+    resultados_ticker = {} # Todo lo pintado por ticker (datos, informe, análisis IA): se repinta de memoria tras cada interacción
+    snapshots_run = {} # Datos brutos por ticker (para el barrido de sensibilidad)
+    caducados_run = set() # Tickers servidos con el snapshot en caché (plazo de Yahoo agotado o refresco sin precio)
+    registros_tokens = [] # Consumo de tokens de cada llamada a la IA
+    historicos_descargados = {} # Históricos de 5 años recién descargados (se vuelcan al almacén de precios al final)
+    almacen_precios = abrir_almacen() # Cierres mapeados en memoria para los gráficos sin descarga completa
+    registrar_peticiones(seleccion) # Demanda por ticker: el precalentado empieza por los más pedidos
+    contadores_memo_inicio = contadores_memo() # Aciertos de la memoización del TTM de esta ejecución
+    limite_run = limite_ejecucion(plazo_run * 60) # Instante máximo de la ejecución (None = sin límite)
+    configurar_tokenizador(tokenizador_exacto(gemini_api_key) if recuento_exacto and gemini_api_key else None)
 
-    for ticker in seleccion:
-        st.markdown(f"---") # Separador visual
-                
-        col_logo, col_titulo = st.columns([1, 10])
-        with col_titulo:
-            # 1. Recuperamos los datos del Excel de forma segura antes de pintar
-            try:
-                # Filtramos el dataframe global para sacar la fila de este ticker
-                datos_ref = df_refs[df_refs['Ticker'] == ticker].iloc[0]
-                sector = datos_ref['Sector']
-                subsector = datos_ref['Subsector']
-            except:
-                sector = "No definido"
-                subsector = "No definido"
-
-            # 2. Pintamos el Título Principal (Grande)
-            st.subheader(f"Análisis de {mapa_nombres.get(ticker, ticker)}")
-            
-            # 3. Pintamos el Subtítulo (Más pequeño y gris)
-            # Usamos HTML para ajustar el margen superior negativo (-15px) y pegarlo al título
-            st.markdown(f"""
-            <div style='margin-top: -15px; margin-bottom: 10px; font-size: 16px; color: #a0a0a0;'>
-                <b>Sector:</b> {sector} <span style='margin: 0 10px;'>|</span> <b>Subsector:</b> {subsector}
-            </div>
-            """, unsafe_allow_html=True)
-            
-        with st.expander(f"Ver informe detallado de {ticker}", expanded=True):
-            
-            # A. Referencias Excel
-            try:
-                fila_ref = df_refs[df_refs['Ticker'] == ticker].iloc[0]
-            except:
-                st.error(f"El ticker {ticker} no está en el Excel de referencias.")
-                continue
-            
-            # B. OBTENER DATOS (TTM)
-            with st.spinner(f"📥 Descargando datos financieros y noticias..."):
-                datos = obtener_datos_financieros(ticker)
-                
-            if datos:
+    # Refresco intradía: una sola descarga de precios para todo el universo seleccionado
+    datos_precargados = {}
+    if refrescar_cotizaciones:
+        with st.spinner("⚡ Refrescando cotizaciones en bloque..."):
+            datos_precargados, caducados_run = refrescar_datos_financieros(seleccion)
+        n_refrescados = sum(1 for d in datos_precargados.values() if d) - len(caducados_run)
+        st.caption(f"⚡ {n_refrescados}/{len(seleccion)} tickers recalculados con fundamentales en caché; el resto requiere descarga completa.")
+        if caducados_run:
+            st.warning(f"⏱️ Sin cotización para {len(caducados_run)} tickers: se usa su último snapshot en caché ({', '.join(sorted(caducados_run))}).")
 
-                # Función auxiliar para formatear visualización
-                def formatear_ratio_visual(valor):
-                    if valor == sys.float_info.max or valor == 0:
-                        return "N/A"
-                    return f"{valor:.2f}x"               
+    # Volcado local: los tickers aún sin datos se cargan del proveedor de ficheros en bloque
+    if fuente_datos.startswith("🗂️"):
+        pendientes = [t for t in seleccion if not datos_precargados.get(t)]
+        try:
+            with st.spinner(f"🗂️ Cargando {len(pendientes)} tickers del volcado local..."):
+                cargados = obtener_datos_financieros_lote(pendientes, proveedor="ficheros", directorio=directorio_volcado)
+            datos_precargados.update({t: d for t, d in cargados.items() if d})
+            st.caption(f"🗂️ {sum(1 for d in cargados.values() if d)}/{len(pendientes)} tickers cargados del volcado '{directorio_volcado}'; el resto se descarga de Yahoo.")
+        except Exception as e:
+            st.warning(f"⚠️ No se pudo leer el volcado local ({e}); se descarga de Yahoo.")
 
-            
-                # --- HACK CSS PARA REDUCIR ESPACIOS VERTICALES EN VISUALIZACIÓN DE KPIs---
-                st.markdown("""
-                <style>
-                    /* 1. Reducir el margen inferior de los títulos H4 (####) */
-                    h4 {
-                        margin-bottom: 0.1rem !important;
-                        padding-bottom: 0rem !important;
-                    }
-                    
-                    /* 2. Reducir el espacio de los divisores (st.divider) */
-                    hr {
-                        margin-top: 0.5rem !important;
-                        margin-bottom: 0.5rem !important;
-                    }
-                    
-                    /* 3. (Opcional) Ajustar el padding interno de los contenedores con borde */
-                    div[data-testid="stVerticalBlockBorderWrapper"] > div {
-                        gap: 0.5rem; /* Reduce el hueco entre elementos dentro de la caja */
-                    }
-                </style>
-                """, unsafe_allow_html=True)
-                
-                                
-                # --- VISUALIZACIÓN DE KPIs MEJORADA ---
+    # Precalentado: los tickers aún sin datos se sirven de la caché si se escribieron después del último cierre
+    # (el mercado no ha abierto desde entonces: sus precios siguen vigentes)
+    ttl_calientes = ttl_precalentado()
+    if usar_precalentado and ttl_calientes > 0:
+        pendientes = [t for t in seleccion if not datos_precargados.get(t)]
+        calientes = obtener_datos_precalentados(pendientes, ttl=ttl_calientes)
+        if calientes:
+            datos_precargados.update(calientes)
+            _, antiguedad_precalentado = ultimo_precalentado()
+            cuando = f" (último precalentado {describir_antiguedad(antiguedad_precalentado)})" if antiguedad_precalentado is not None else ""
+            st.caption(f"♨️ {len(calientes)}/{len(pendientes)} tickers servidos desde la caché precalentada{cuando}.")
 
-                with st.expander(f"Análisis por Algoritmo de {ticker}", expanded=True):
+    # Pares: registro del universo de referencias, sembrado con todos los snapshots frescos de la caché
+    # (precalentado o ejecuciones anteriores) y con los ya cargados; cada ticker del recorrido lo actualiza
+    registro_pares = None
+    if modo_pares:
+        registro_pares = nuevo_registro_pares(df_refs)
+        actualizar_pares(registro_pares, obtener_datos_precalentados(df_refs['Ticker'], ttl=PRECALENTADO_TTL_SEGUNDOS))
+        actualizar_pares(registro_pares, datos_precargados)
 
-                    st.markdown("### 📊 Tablero de Control Financiero")
+    pendientes_ia = [] # Modo lotes: análisis IA aplazados hasta el final del recorrido
 
-                    # Creamos dos grandes columnas principales para dividir la pantalla
-                    # Izquierda: Métricas Fundamentales | Derecha: Gráfico de Precio
-                    col_izq, col_der = st.columns([1.2, 1.8], gap="medium")
+    # Exportación en streaming: una fila por ticker en cuanto termina (ver Intento3_V1_Exportacion.py)
+    exportador = abrir_exportacion(ruta_exportacion_nueva()) if modo_exportar else None
+    rutas_exportacion = []
 
-                    # --- COLUMNA IZQUIERDA: MÉTRICAS FUNDAMENTALES ---
-                    with col_izq:
-                        # --- GRUPO 1: VALORACIÓN Y PRECIO ---
-                        # Usamos st.container(border=True) para crear una "Caja" visual
-                        with st.container(border=True):
-                            st.markdown("#### 🏷️ Precio y Ratios de Valoración")
-                            
-                            st.divider() # Línea separadora interna
-                            
-                            # Sub-columnas dentro de la tarjeta
-                            c1, c2 = st.columns(2)
-                            
-                            c1.metric(
-                                "Precio Actual",
-                                f"${datos['precio']:.2f}",
-                                help="Precio de cierre más reciente"
-                            )
-                            
+    def exportar_ticker(ticker_exportado, *args, **kwargs):
+        if exportador:
+            exportar_fila(exportador, fila_exportacion(ticker_exportado, *args, **kwargs))
 
-                            # Ratio de Solvencia
-                            val_solvencia = datos['ratio_solvencia']
-                            
-                            # Verificamos si es un número (int o float) para poder restar
-                            if isinstance(val_solvencia, (int, float)):
-                                delta_solvencia = val_solvencia - fila_ref['Ref_Solvencia_Mediana']
-                                delta_str = f"{delta_solvencia:.1f}x vs Ref"
-                                val_str = formatear_ratio_visual(val_solvencia)
-                            else:
-                                # Si es "N/A", no calculamos delta
-                                delta_str = "N/A"
-                                val_str = "N/A"
-                            c2.metric(
-                                "Solvencia", 
-                                val_str, 
-                                delta=delta_str,
-                                delta_color="inverse", # Menos deuda suele ser mejor
-                                help="Deuda Neta / (EBITDA - Capex)"
-                            )
-                            
-                            st.divider() # Línea separadora interna
-                            
-                            c3, c4 = st.columns(2)
-                            
-                            # PER Actual
-                            if datos['per_ltm'] is not None and datos['per_ltm'] >= 0:
-                                per_ltm_val = f"{datos['per_ltm']:.2f}x"
-                                delta_per = f"{datos['per_ltm'] - fila_ref['Ref_PER_LTM_Mediana']:.1f}x vs Ref"
-                            else:
-                                delta_per = "N/A"
-                                per_ltm_val = "N/A"
-                            c3.metric(
-                                "PER (LTM)",
-                                per_ltm_val,
-                                delta=delta_per,
-                                delta_color="inverse",
-                                help="PER últimos 12 meses"
-                            )
-                            
-                            # PER Estimado
-                            delta_est = datos['per_ntm'] - fila_ref['Ref_PER_NTM_Mediana']
-                            c4.metric(
-                                "PER (NTM)", 
-                                formatear_ratio_visual(datos['per_ntm']), 
-                                delta=f"{delta_est:.1f}x vs Ref",
-                                delta_color="inverse",
-                                help="PER estimado próximos 12 meses"
-                            )
-
-                        # --- GRUPO 2: RETORNO AL ACCIONISTA ---
-                        with st.container(border=True):
-                            st.markdown("#### 💰 Retorno y Flujos (Yields)")
-                            
-                            st.divider() # Línea separadora interna
+    try:
+        for ticker in seleccion:
+            st.markdown(f"---") # Separador visual
+            pintar_cabecera(ticker)
 
-                            # Fila 1 de Yields
-                            y1, y2, y3 = st.columns(3)
-                            
-                            delta_div = datos['div_yield'] - (fila_ref['Ref_Div_Yield_Mediana']/100)
-                            y1.metric(
-                                "Dividend Yield", 
-                                f"{datos['div_yield']:.2%}", 
-                                delta=f"{delta_div:.2%} vs Ref",
-                                help="Rendimiento por dividendos."
-                            )
-                            
-                            delta_buy = datos['buyback_yield'] - (fila_ref['Ref_Buyback_Yield_Mediana']/100)
-                            y2.metric(
-                                "Buyback Yield", 
-                                f"{datos['buyback_yield']:.2%}", 
-                                delta=f"{delta_buy:.2%} vs Ref",
-                                help="Rendimiento por recompras de acciones."
-                            )
-
-                            delta_total = datos['total_yield'] - (fila_ref['Ref_Total_Yield']/100)
-                            y3.metric(
-                                "Total Yield", 
-                                f"{datos['total_yield']:.2%}", 
-                                delta=f"{delta_total:.2%} vs Ref",
-                                help="Rendimiento total al accionista: Dividendo + Recompras"
-                            )
-                            
-                            st.divider() # Línea separadora interna
-                            
-                            # Fila 2 de Yields (FCF y Total)
-                            y4, y5 = st.columns(2)
-                            
-                            delta_fcf_ev = datos['fcf_yield_ev'] - (fila_ref['Ref_FCF_Yield_Mediana']/100)
-                            y4.metric(
-                                "FCF Yield (EV)", 
-                                f"{datos['fcf_yield_ev']:.2%}", 
-                                delta=f"{delta_fcf_ev:.2%} vs Ref",
-                                help="Free Cash Flow / Enterprise Value: indica la rentabilidad del flujo de caja libre respecto al valor total de la empresa."
-                            )                      
-
-                            delta_fcf_mc = datos['fcf_yield_mc'] - datos['total_yield']
-                            y5.metric(
-                                "FCF Yield (MC)",
-                                f"{datos['fcf_yield_mc']:.2%}",
-                                delta=f"{delta_fcf_mc:.2%} vs Total Yield",
-                                help="Free Cash Flow / Market Capitalization: se compara con Total Yield para saber si el retorno está respaldado por caja."
-                            )
-
-                    # --- COLUMNA DERECHA: GRÁFICO PROFESIONAL CON PLOTLY ---
-                    with col_der:
-                        with st.container(border=True):
-                            st.markdown("#### 📈 Evolución del Precio (5 años)")
-                            
-                            hist = datos['history']
-                            
-                            # Usamos Plotly en lugar de st.line_chart para que sea interactivo
-                            fig = go.Figure()
-                            
-                            # Línea de precio
-                            fig.add_trace(go.Scatter(
-                                x=hist.index, 
-                                y=hist['Close'],
-                                mode='lines',
-                                name='Precio',
-                                line=dict(color='#00FF00' if hist['Close'].iloc[-1] >= hist['Close'].iloc[0] else '#FF0000', width=2),
-                                hovertemplate = "$%{y:.2f}"
-                            ))
-                            
-                            # Configuración del diseño "Dark Mode Friendly"
-                            fig.update_layout(
-                                height=450,
-                                margin=dict(l=20, r=20, t=30, b=20),
-                                paper_bgcolor='rgba(0,0,0,0)', # Fondo transparente
-                                plot_bgcolor='rgba(0,0,0,0)',
-                                xaxis=dict(showgrid=False),
-                                yaxis=dict(showgrid=True, gridcolor='rgba(128,128,128,0.2)'),
-                                hovermode="x unified"
-                            )
-                            
-                            st.plotly_chart(fig, use_container_width=True)
-                    # -------------------------------------------------------              
+            with st.expander(f"Ver informe detallado de {ticker}", expanded=True):
+            
+                # A. Referencias Excel
+                try:
+                    fila_ref = df_refs[df_refs['Ticker'] == ticker].iloc[0]
+                except:
+                    st.error(f"El ticker {ticker} no está en el Excel de referencias.")
+                    resultados_ticker[ticker] = {"error": f"El ticker {ticker} no está en el Excel de referencias."}
+                    exportar_ticker(ticker, motivo="No está en el Excel de referencias.")
+                    continue
+            
+                # B. OBTENER DATOS (TTM): del refresco de cotizaciones, del volcado o del precalentado si existen, si no descarga completa
+                datos = datos_precargados.get(ticker)
+                descarga_completa = datos is None
+                if descarga_completa:
+                    with st.spinner(f"📥 Descargando datos financieros..."):
+                        datos, antiguedad_datos = obtener_datos_financieros_con_plazo(ticker, plazo=plazo_yahoo, limite=limite_run,
+                                                                                      cubrir=cubrir_lentas)
+                    if antiguedad_datos is not None:
+                        # Plazo agotado: se sigue con el último snapshot en caché (sin guardar su histórico)
+                        st.warning(f"⏱️ Yahoo no respondió a tiempo: datos de la caché ({describir_antiguedad(antiguedad_datos)}).")
+                        descarga_completa = False
+                        caducados_run.add(ticker)
+                
+                if datos:
+                    snapshots_run[ticker] = datos
+                    if descarga_completa:
+                        historicos_descargados[ticker] = datos['history']
+
+                    # Modo pares: las referencias pasan a ser las medianas en vivo de sus pares (con este snapshot incluido)
+                    if registro_pares is not None:
+                        actualizar_pares(registro_pares, {ticker: datos})
+                        fila_ref = referencias_pares(registro_pares, fila_ref)
 
-                # C. GATEKEEPER (Lógica Matemática)
+                    # C. GATEKEEPER (Lógica Matemática)
+                    # Se calcula antes de pintar para lanzar ya, en segundo plano, la descarga de noticias:
+                    # solo la necesitan los tickers que llegarán a la IA y se solapa con el pintado de KPIs y gráfico.
                     informe = ejecutar_gatekeeper(datos, fila_ref)
-                    
-                    # Pintar Resultado Gatekeeper
-                    color_map = {"COMPRAR": "green", "NEUTRAL/PRECAUCIÓN": "orange", "DESCARTAR": "red"}
-                    color = color_map.get(informe['decision'], "gray")
-                    
-                    st.markdown(f"### 🤖 Decisión Algorítmica: :{color}[**{informe['decision']}**]")
-                    st.info(f"**Lógica:** {informe['motivo_principal']}")
-                    st.info(f"Puntos Fuertes y Alertas a continuación detalladas.")
+                    futuro_noticias = None
+                    if informe['decision'] != "DESCARTAR" and gemini_api_key:
+                        futuro_noticias = lanzar_descarga_noticias(ticker)
 
-                    # VISUALIZACIÓN DE PUNTOS FUERTES Y ALERTAS ---
-                    st.markdown("---") # Separador horizontal
-                    
-                    # Creamos 2 columnas para ponerlos frente a frente
-                    col_pros, col_cons = st.columns(2)
-
-                    with col_pros:
-                        st.subheader("✅ Puntos Fuertes")
-                        if informe['puntos_fuertes']:
-                            for punto in informe['puntos_fuertes']:
-                                # Opción A: Cajas verdes (muy visual)
-                                st.success(f"📍 {punto}")
-                        else:
-                            st.markdown("_No hay puntos fuertes destacados._")
-
-                    with col_cons:
-                        st.subheader("⚠️ Alertas Detectadas")
-                        if informe['alertas']:
-                            for alerta in informe['alertas']:
-                                # Opción B: Cajas rojas (destaca el riesgo)
-                                st.error(f"🚩 {alerta}")
-                        else:
-                            st.markdown("_No hay alertas moderadas._")
-                        if informe['alertas_criticas']:
-                            for alerta in informe['alertas_criticas']:
-                                st.error(f"🚨 Alerta Crítica: {alerta}")
-                        else:
-                            st.markdown("_No hay alertas críticas._")
-                    
-                    st.markdown("---")
-                    # -------------------------------------------------------     
+                    # Cierres para el gráfico: refresco -> almacén columnar (vista sin copia); descarga completa -> histórico recién bajado
+                    cierres = None if descarga_completa else serie_cierres(almacen_precios, ticker)
+                    if cierres is None and datos['history'] is not None:
+                        cierres = datos['history']['Close']
+                    pintar_informe_algoritmo(ticker, datos, fila_ref, informe, cierres)
+                    resultado_ticker = {"datos": datos, "fila_ref": fila_ref, "informe": informe, "cierres": cierres,
+                                        "analisis": None, "avisos_ia": []}
+                    resultados_ticker[ticker] = resultado_ticker
 
                     barra.progress((i + 0.5) / len(seleccion)) # Mitad del progreso hasta aquí
 
-                with st.expander(f"Análisis con IA de {ticker}", expanded=True):
-                    # --- INICIALIZAMOS VARIABLES AQUÍ ---
-                    # Esto asegura que existan siempre, pase lo que pase en los if/else de abajo
-                    texto_justificacion_final = "" 
-                    decision_ia = "N/A" 
-                # D. ANÁLISIS IA (GEMINI)
-                    if informe['decision'] != "DESCARTAR" and gemini_api_key:
-                        st.divider()
-                        st.markdown("### 🧠 Análisis Cualitativo (IA)")
+                    with st.expander(f"Análisis con IA de {ticker}", expanded=True):
+                        # --- INICIALIZAMOS VARIABLES AQUÍ ---
+                        # Esto asegura que existan siempre, pase lo que pase en los if/else de abajo
+                        texto_justificacion_final = "" 
+                        decision_ia = "N/A" 
+                    # D. ANÁLISIS IA (GEMINI)
+                        if informe['decision'] != "DESCARTAR" and gemini_api_key:
+                            st.divider()
+                            st.markdown("### 🧠 Análisis Cualitativo (IA)")
                         
-                        with st.spinner("Generando análisis con Gemini..."):
-                            # 0. Desempaquetamos los valores
-                            analisis_texto, prompt_debug, decision_ia, justificacion_ia = generar_analisis_gemini(gemini_api_key, ticker, datos, informe)
-                            
-                            # 1. Mostramos el análisis normal
-                            st.markdown(analisis_texto)
-                            color2 = color_map.get(decision_ia, "gray")
-                            st.markdown(f"### 🤖 Decisión IA: :{color2}[**{decision_ia}**]")
-                            
-                            # 2. Mostramos el Prompt oculto en un desplegable (SOLO DEBUG)
-                            if prompt_debug:
-                                with st.expander("🛠️ Ver Prompt técnico enviado a Gemini (Debug)"):
-                                    st.caption("Este es el texto exacto que se envió a la IA:")
-                                    st.code(prompt_debug, language="markdown")
-                            
-                            # 3. Si Algoritmo O IA dicen COMPRAR, guardamos la justificación
-                            condicion_compra = (informe['decision'] == "COMPRAR") or (decision_ia == "COMPRAR")
+                            # Noticias descargadas en segundo plano (solo para los tickers que llegan aquí)
+                            with st.spinner("📰 Recuperando noticias recientes..."):
+                                try:
+                                    datos['noticias'] = futuro_noticias.result(timeout=min(PLAZOS_POR_DEFECTO["noticias"], restante(limite_run)))
+                                except TimeoutError:
+                                    datos['noticias'] = [] # Sin noticias antes que esperar
+
+                            with st.spinner("Generando análisis con Gemini..."):
+                                # Hueco donde se va pintando la respuesta en streaming
+                                marcador_ia = st.empty()
+
+                                def pintar_parcial(texto_parcial):
+                                    if modo_json:
+                                        marcador_ia.code(texto_parcial, language="json")
+                                    else:
+                                        marcador_ia.markdown(texto_parcial + " ▌")
+
+                                # ¿Ha cambiado algo material desde el último análisis guardado?
+                                cambios = evaluar_cambios(ticker, datos, informe, factor_tolerancia) if modo_incremental else None
+
+                                en_cola = False
+
+                                if cambios and not cambios['reanalizar']:
+                                    # 0. Reutilizamos el análisis guardado (sin llamada a la IA)
+                                    analisis_texto, prompt_debug, decision_ia, justificacion_ia = cambios['analisis']
+                                    resultado_ticker["avisos_ia"].append(f"♻️ Análisis IA reutilizado ({describir_antiguedad(cambios['antiguedad'])}): sin cambios materiales en decisión, ratios ni noticias.")
+                                elif restante(limite_run) <= 0:
+                                    # 0. Ejecución sin tiempo: el ticker se queda con la decisión del Gatekeeper
+                                    analisis_texto, prompt_debug, decision_ia, justificacion_ia = (
+                                        TEXTO_SIN_TIEMPO, None, DECISION_SIN_TIEMPO, "")
+                                elif modo_lotes:
+                                    # 0. Se aplaza: se analizará junto con otras empresas en una sola petición
+                                    en_cola = True
+                                    marcador_ia.caption("📦 En cola para el análisis IA por lotes...")
+                                    if cambios:
+                                        resultado_ticker["avisos_ia"].append("🔄 Nuevo análisis IA: " + "; ".join(cambios['motivos']))
+                                else:
+                                    # 0. Desempaquetamos los valores
+                                    registro_tokens = {}
+                                    analisis_texto, prompt_debug, decision_ia, justificacion_ia = generar_analisis_gemini(
+                                        gemini_api_key, ticker, datos, informe,
+                                        modo_estructurado=modo_json,
+                                        al_recibir_fragmento=pintar_parcial if modo_streaming else None,
+                                        presupuesto_tokens=presupuesto_disponible(presupuesto_ticker, presupuesto_run, registros_tokens),
+                                        registro_tokens=registro_tokens,
+                                        plazo_segundos=min(plazo_ia, restante(limite_run))
+                                    )
+                                    if registro_tokens:
+                                        registros_tokens.append(registro_tokens)
+
+                                    # Guardamos el análisis para futuras ejecuciones (nunca los errores, plazos ni presupuestos agotados)
+                                    if decision_ia in DECISIONES_VALIDAS:
+                                        guardar_analisis(ticker, datos, informe, (analisis_texto, prompt_debug, decision_ia, justificacion_ia))
+                                    if cambios:
+                                        resultado_ticker["avisos_ia"].append("🔄 Nuevo análisis IA: " + "; ".join(cambios['motivos']))
                             
-                            if condicion_compra:
-                                texto_justificacion_final = justificacion_ia
-                            else:
-                                texto_justificacion_final = "" # O un guion "-" si prefieres
+                                for aviso in resultado_ticker["avisos_ia"]:
+                                    st.caption(aviso)
+                                contenedor_ia = st.container() # Decisión IA y prompt (debajo del análisis)
+                                if en_cola:
+                                    decision_ia = "⏳ EN COLA"
+                                    pendientes_ia.append({"ticker": ticker, "datos": datos, "informe": informe,
+                                                          "marcador": marcador_ia, "contenedor": contenedor_ia})
+                                else:
+                                    # 1-2. Análisis, decisión IA y prompt de depuración
+                                    resultado_ticker["analisis"] = (analisis_texto, prompt_debug, decision_ia, justificacion_ia)
+                                    mostrar_analisis_ia(marcador_ia, contenedor_ia, analisis_texto, prompt_debug, decision_ia)
+
+                                    # 3. Si Algoritmo O IA dicen COMPRAR, guardamos la justificación
+                                    condicion_compra = (informe['decision'] == "COMPRAR") or (decision_ia == "COMPRAR")
+
+                                    if condicion_compra:
+                                        texto_justificacion_final = justificacion_ia
+                                    else:
+                                        texto_justificacion_final = "" # O un guion "-" si prefieres
                                     
-                    elif informe['decision'] == "DESCARTAR":
-                        st.warning("⛔ El análisis de IA se ha omitido...")
-                        decision_ia = "DESCARTAR"
-
-                # --- CAPTURA DE DATOS PARA LA TABLA RESUMEN ---
-                lista_resultados.append({
-                    "Ticker": ticker,
-                    "Yield Total": f"{datos['total_yield']:.2%}", # Formateamos a porcentaje
-                    "Decisión Algoritmo": informe['decision'],
-                    "Decisión IA": decision_ia,
-                    "Justificación": texto_justificacion_final
-                })
+                        elif informe['decision'] == "DESCARTAR":
+                            st.warning("⛔ El análisis de IA se ha omitido...")
+                            decision_ia = "DESCARTAR"
+
+                    # --- CAPTURA DE DATOS PARA LA TABLA RESUMEN ---
+                    lista_resultados.append({
+                        "Ticker": ticker,
+                        "Yield Total": f"{datos['total_yield']:.2%}", # Formateamos a porcentaje
+                        "Decisión Algoritmo": informe['decision'],
+                        "Decisión IA": decision_ia,
+                        "Justificación": texto_justificacion_final
+                    })
+                    if registro_pares is not None:
+                        lista_resultados[-1]["Pares"] = fila_ref['Percentil_Pares']
+                    if decision_ia != "⏳ EN COLA": # Los de la cola se exportan al completarse su lote
+                        analisis = resultado_ticker["analisis"]
+                        exportar_ticker(ticker, fila_ref, datos, informe, decision_ia, analisis[3] if analisis else None)
                 
-            else:
-                st.error(f"❌ Error al descargar datos de {ticker}.")
+                else:
+                    st.error(f"❌ Error al descargar datos de {ticker}.")
+                    resultados_ticker[ticker] = {"error": f"❌ Error al descargar datos de {ticker}."}
+                    exportar_ticker(ticker, fila_ref, motivo="Error al descargar los datos financieros.")
+
+                i += 1
+                barra.progress((i) / len(seleccion))
+                if descarga_completa:
+                    time.sleep(1) # Respeto a la API
+
+        # Modo lotes: análisis IA aplazados, agrupados en peticiones de 'tamano_lote' empresas
+        if pendientes_ia:
+            fila_resumen = {fila["Ticker"]: fila for fila in lista_resultados}
+            por_ticker = {p["ticker"]: p for p in pendientes_ia}
+
+            def completar_ticker(ticker_ia, resultado):
+                pendiente = por_ticker[ticker_ia]
+                analisis_texto, prompt_debug, decision_ia, justificacion_ia = resultado
+                mostrar_analisis_ia(pendiente["marcador"], pendiente["contenedor"], analisis_texto, prompt_debug, decision_ia)
+                resultados_ticker[ticker_ia]["analisis"] = resultado
+                if decision_ia in DECISIONES_VALIDAS:
+                    guardar_analisis(ticker_ia, pendiente["datos"], pendiente["informe"], resultado)
+                fila = fila_resumen[ticker_ia]
+                fila["Decisión IA"] = decision_ia
+                fila["Justificación"] = justificacion_ia if "COMPRAR" in (pendiente["informe"]['decision'], decision_ia) else ""
+                exportar_ticker(ticker_ia, resultados_ticker[ticker_ia]["fila_ref"], pendiente["datos"], pendiente["informe"],
+                                decision_ia, justificacion_ia)
+
+            with st.spinner(f"📦 Analizando {len(pendientes_ia)} empresas con Gemini en lotes de {tamano_lote}..."):
+                generar_analisis_gemini_lote(
+                    gemini_api_key,
+                    [(p["ticker"], p["datos"], p["informe"]) for p in pendientes_ia],
+                    modo_estructurado=modo_json,
+                    tamano_lote=tamano_lote,
+                    presupuesto_ticker=presupuesto_ticker,
+                    presupuesto_run=presupuesto_run,
+                    registros_tokens=registros_tokens,
+                    al_completar_ticker=completar_ticker,
+                    plazo_segundos=plazo_ia, limite=limite_run
+                )
+    finally:
+        # También si la ejecución se interrumpe (rerun, st.stop, error): los ficheros quedan válidos con lo ya escrito
+        if exportador:
+            rutas_exportacion = cerrar_exportacion(exportador)
+
+    # Una sola escritura por ejecución en el almacén de precios (lo leen los refrescos y otros procesos)
+    if historicos_descargados:
+        try:
+            guardar_historicos(historicos_descargados)
+        except Exception as e:
+            print(f"Aviso: no se pudo actualizar el almacén de precios: {e}")
+    guardar_memo() # Lo memoizado sobrevive a reinicios y lo comparten el precalentado y el embudo
+
+    # Historial: ratios y decisiones de cada ticker analizado, para ver qué ha cambiado entre ejecuciones
+    # (sin los snapshots caducados: no son una foto de este instante)
+    try:
+        # Solo la decisión de la IA cuando se le preguntó (los descartes del Gatekeeper no llegan a ella)
+        decisiones_ia = {t: r["analisis"][2] for t, r in resultados_ticker.items() if r.get("analisis")}
+        anadir_ejecucion([fila_historial(t, datos_t, resultados_ticker[t]["informe"], decisiones_ia.get(t))
+                          for t, datos_t in snapshots_run.items() if t not in caducados_run])
+    except Exception as e:
+        print(f"Aviso: no se pudo actualizar el historial: {e}")
 
-            i += 1
-            barra.progress((i) / len(seleccion))
-            time.sleep(1) # Respeto a la API
+    # Resultados de la ejecución en la sesión: sobreviven a cualquier interacción posterior con la página
+    st.session_state["ultima_ejecucion"] = {"instante": time.time(), "tickers": resultados_ticker,
+                                           "resumen": lista_resultados, "registros_tokens": registros_tokens,
+                                           "snapshots": snapshots_run, "rutas_exportacion": rutas_exportacion,
+                                           "pares": {nivel: estadisticas_pares(registro_pares, nivel) for nivel in NIVELES_PARES}
+                                                    if registro_pares is not None else None,
+                                           "memo": informe_memo(contadores_memo_inicio), "plazos": estadisticas_plazos()}
 
 # --- VISUALIZACIÓN DE LA TABLA RESUMEN FINAL ---
+def pintar_resumen(lista_resultados):
     if lista_resultados:
         st.markdown("---")
         st.header("📋 Resumen Ejecutivo")
@@ -449,6 +820,8 @@ if st.button("🚀 Ejecutar Análisis"):
         # 3. MODIFICACIÓN 1: MOSTRAR TABLA LIMPIA (Sin columna Justificación)
         # Seleccionamos solo las columnas que queremos ver arriba
         cols_visualizar = ["Ticker", "Yield Total", "Decisión Algoritmo", "Decisión IA"]
+        if "Pares" in df_resumen.columns: # Solo en modo pares
+            cols_visualizar.insert(2, "Pares")
         
         st.dataframe(
             df_resumen[cols_visualizar].style.map(estilo_decision, subset=['Decisión Algoritmo', 'Decisión IA']),
@@ -457,6 +830,8 @@ if st.button("🚀 Ejecutar Análisis"):
             column_config={
                 "Ticker": st.column_config.TextColumn("Ticker", width="small"),
                 "Yield Total": st.column_config.TextColumn("Yield Total", width="small"),
+                "Pares": st.column_config.NumberColumn("Percentil Pares", format="%.0f", width="small",
+                                                       help="Percentil compuesto frente a su subsector/sector (100 = la mejor)"),
                 "Decisión Algoritmo": st.column_config.TextColumn("Algoritmo", width="medium"),
                 "Decisión IA": st.column_config.TextColumn("Analista IA", width="medium"),
             }
@@ -506,3 +881,228 @@ if st.button("🚀 Ejecutar Análisis"):
     else:
 
         st.info("No hay resultados para mostrar en el resumen.")
+
+# --- CONSUMO DE TOKENS Y COSTE DE LA EJECUCIÓN ---
+def pintar_consumo_tokens(registros_tokens):
+    if registros_tokens:
+        df_tokens, totales_tokens = informe_tokens(registros_tokens)
+        with st.expander("🧮 Consumo de tokens y coste de la ejecución", expanded=False):
+            t1, t2, t3, t4 = st.columns(4)
+            t1.metric("Llamadas IA", totales_tokens['llamadas'])
+            t2.metric("Tokens de entrada", f"{totales_tokens['tokens_entrada']:,}")
+            t3.metric("Tokens de salida", f"{totales_tokens['tokens_salida']:,}")
+            t4.metric("Coste estimado", f"${totales_tokens['coste_usd']:.4f}")
+            if totales_tokens['coste_desperdiciado_usd']:
+                st.caption(f"♻️ ${totales_tokens['coste_desperdiciado_usd']:.4f} corresponden a secciones de lotes sin "
+                           "interpretar (filas con desperdiciado=True), que se han repetido ticker a ticker.")
+            st.dataframe(df_tokens, use_container_width=True, hide_index=True)
+
+# --- MEMOIZACIÓN DE LA ETAPA TTM ---
+def pintar_memo(df_memo):
+    if df_memo is not None and not df_memo.empty:
+        with st.expander("🧠 Memoización del TTM", expanded=False):
+            st.caption("Un acierto reutiliza el TTM calculado para los mismos estados trimestrales en esta u otra "
+                       "ejecución; solo se recalculan los tickers que cambian.")
+            st.dataframe(df_memo, use_container_width=True, hide_index=True,
+                         column_config={"% aciertos": st.column_config.ProgressColumn("% aciertos", format="percent",
+                                                                                      min_value=0, max_value=1)})
+
+# --- CAMBIOS DESDE LA ÚLTIMA EJECUCIÓN (HISTORIAL) ---
+# Fragmento: cambiar la ejecución de referencia solo relanza esta sección
+@st.fragment
+def pintar_cambios(tickers_run):
+    historial = abrir_historial()
+    if historial is None or not tickers_run:
+        return
+    anteriores = ejecuciones_historial(historial).iloc[1:] # La primera es la más reciente (esta ejecución)
+    with st.expander("🕑 Cambios desde la última ejecución", expanded=True):
+        col_referencia, col_filtro = st.columns([3, 1])
+        opciones = [None] + list(anteriores.itertuples(index=False))
+        referencia = col_referencia.selectbox(
+            "Comparar con", opciones,
+            format_func=lambda e: "La ejecución anterior de cada ticker" if e is None
+                                  else f"{e.instante:%Y-%m-%d %H:%M} ({e.tickers} tickers)")
+        solo_decisiones = col_filtro.toggle("Solo cambios de decisión", value=False)
+
+        cambios = cambios_ultima_ejecucion(historial, tickers_run, referencia.instante if referencia else None,
+                                           solo_cambios_decision=solo_decisiones)
+        if cambios.empty:
+            st.caption("Sin cambios de decisión." if solo_decisiones else "Estos tickers no tienen ejecuciones anteriores en el historial.")
+            return
+        st.caption(f"{int(cambios['cambia_decision'].sum())} de {len(cambios)} tickers cambian de decisión (algoritmo o IA).")
+        cambios = cambios.sort_values("cambia_decision", ascending=False, kind="stable") # Primero los que cambian de decisión
+        vista = pd.DataFrame({
+            "Desde": cambios["instante_antes"],
+            "Algoritmo antes": cambios["decision_algoritmo_antes"], "Algoritmo ahora": cambios["decision_algoritmo_ahora"],
+            "IA antes": cambios["decision_ia_antes"], "IA ahora": cambios["decision_ia_ahora"],
+            "Δ Precio": cambios["Δ precio"], "Δ PER LTM": cambios["Δ per_ltm"],
+            "Δ Total Yield": cambios["Δ total_yield"] * 100, "Δ FCF Yield EV": cambios["Δ fcf_yield_ev"] * 100,
+            "Δ Alertas críticas": cambios["Δ alertas_criticas"],
+        })
+        st.dataframe(vista, use_container_width=True,
+                     column_config={"Desde": st.column_config.DatetimeColumn("Desde", format="YYYY-MM-DD HH:mm"),
+                                    "Δ Precio": st.column_config.NumberColumn(format="%+.2f"),
+                                    "Δ PER LTM": st.column_config.NumberColumn(format="%+.2f"),
+                                    "Δ Total Yield": st.column_config.NumberColumn(format="%+.2f pp"),
+                                    "Δ FCF Yield EV": st.column_config.NumberColumn(format="%+.2f pp"),
+                                    "Δ Alertas críticas": st.column_config.NumberColumn(format="%+d")})
+
+# --- PLAZOS Y COBERTURAS DE LAS LLAMADAS EXTERNAS ---
+def pintar_plazos(df_plazos):
+    if df_plazos is not None and not df_plazos.empty:
+        with st.expander("⏱️ Latencia, coberturas y plazos agotados", expanded=False):
+            st.caption("Acumulado del proceso. Una cobertura es la copia lanzada cuando una llamada supera el p95 de las "
+                       "recientes; 'Ganadas por la copia' son las que respondió antes la copia.")
+            st.dataframe(df_plazos, use_container_width=True, hide_index=True)
+
+# --- BARRIDO DE SENSIBILIDAD DEL GATEKEEPER ---
+# Fragmento: mover sus controles solo relanza esta sección (el resto de la página no se repinta)
+@st.fragment
+def pintar_sensibilidad(ejecucion):
+    st.markdown("---")
+    st.header("🎛️ Sensibilidad de la Decisión Algorítmica")
+
+    col_amplitud, col_puntos = st.columns(2)
+    amplitud_barrido = col_amplitud.slider("Amplitud del barrido (± %)", 5, 50, 20) / 100
+    puntos_barrido = int(col_puntos.number_input("Juegos de parámetros", 100, 50_000, 10_000, step=1_000))
+
+    # Se guarda el último barrido con la ejecución: repintar con los mismos controles no lo recalcula
+    clave_barrido = (amplitud_barrido, puntos_barrido)
+    if ejecucion.get("barrido", {}).get("clave") != clave_barrido:
+        with st.spinner(f"Evaluando {puntos_barrido:,} juegos de umbrales..."):
+            inicio_barrido = time.perf_counter()
+            rejilla = generar_rejilla(rangos_por_defecto(amplitud_barrido), n_puntos=puntos_barrido)
+            # Las referencias usadas en la ejecución (en modo pares, las de sus pares con su percentil)
+            referencias_run = {t: r["fila_ref"] for t, r in ejecucion["tickers"].items() if "fila_ref" in r}
+            barrido = barrido_sensibilidad(ejecucion["snapshots"], referencias_run, rejilla)
+            ejecucion["barrido"] = {"clave": clave_barrido, "n_tickers": len(barrido['tickers']),
+                                    "estabilidad": barrido['estabilidad'],
+                                    "segundos": time.perf_counter() - inicio_barrido}
+    barrido = ejecucion["barrido"]
+
+    st.caption(f"{barrido['n_tickers']} tickers x {puntos_barrido:,} juegos de parámetros (± {amplitud_barrido:.0%}) en {barrido['segundos']:.2f}s. "
+               "Estabilidad = % de la rejilla que mantiene la decisión con los umbrales por defecto.")
+    st.dataframe(
+        barrido['estabilidad'],
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "% COMPRAR": st.column_config.ProgressColumn("% COMPRAR", format="percent", min_value=0, max_value=1),
+            "% NEUTRAL": st.column_config.ProgressColumn("% NEUTRAL", format="percent", min_value=0, max_value=1),
+            "% DESCARTAR": st.column_config.ProgressColumn("% DESCARTAR", format="percent", min_value=0, max_value=1),
+            "Estabilidad": st.column_config.ProgressColumn("Estabilidad", format="percent", min_value=0, max_value=1),
+            "Entropía": st.column_config.NumberColumn("Entropía", format="%.2f"),
+        }
+    )
+
+# --- DESCARGA DE LAS EXPORTACIONES ---
+def pintar_descargas(rutas, clave):
+    for columna, ruta in zip(st.columns(max(1, len(rutas))), rutas):
+        if os.path.exists(ruta):
+            with open(ruta, "rb") as f:
+                columna.download_button(f"⬇️ {os.path.basename(ruta)}", f.read(), file_name=os.path.basename(ruta),
+                                        key=f"descarga_{clave}_{os.path.splitext(ruta)[1]}", use_container_width=True)
+
+# --- MEDIANAS Y CUARTILES DE LOS PARES ---
+def pintar_pares(tablas_pares):
+    with st.expander("👥 Medianas y cuartiles de los pares", expanded=False):
+        st.caption("Empresas con snapshot en la caché del día o analizadas en la ejecución. "
+                   f"Los grupos con menos de {MIN_PARES} datos de una métrica no tienen cuartiles (se usa el sector o el Excel).")
+        for pestana, (nivel, tabla) in zip(st.tabs(list(tablas_pares)), tablas_pares.items()):
+            with pestana:
+                st.dataframe(tabla, use_container_width=True)
+
+# --- PERFIL DE CPU Y MEMORIA DE LA EJECUCIÓN ---
+def pintar_perfil(perfil):
+    with st.expander("🔬 Perfil de la ejecución", expanded=True):
+        st.caption(f"{perfil['segundos']}s perfilados · {perfil['muestras']} muestras de pila · "
+                   f"pico de memoria trazada: {perfil['pico_memoria_mb']} MB")
+        col_cpu, col_memoria = st.columns(2)
+        with col_cpu:
+            st.markdown("**CPU: tiempo propio por función**")
+            st.dataframe(perfil["cpu"], use_container_width=True, hide_index=True)
+        with col_memoria:
+            st.markdown("**Memoria viva por línea (tracemalloc)**")
+            st.dataframe(perfil["memoria"], use_container_width=True, hide_index=True)
+        pintar_descargas(perfil["rutas"], "perfil")
+        st.caption("`.pstats`: snakeviz o pstats · `.collapsed`: flamegraph.pl, speedscope o inferno · "
+                   "`.tracemalloc`: tracemalloc.Snapshot.load")
+
+# --- RESULTADOS DE LA ÚLTIMA EJECUCIÓN ---
+# Cualquier widget relanza el script: fuera del botón, los resultados se repintan de memoria
+# (st.session_state) en milisegundos, sin volver a descargar datos ni llamar a Gemini.
+ejecucion = st.session_state.get("ultima_ejecucion")
+if ejecucion is not None:
+    if not ejecutar_analisis:
+        st.caption(f"💾 Resultados de la última ejecución ({describir_antiguedad(time.time() - ejecucion['instante'])}). "
+                   "Pulsa 'Ejecutar Análisis' para actualizarlos.")
+        for ticker, resultado in ejecucion["tickers"].items():
+            pintar_ticker_guardado(ticker, resultado)
+
+    pintar_resumen(ejecucion["resumen"])
+    pintar_cambios(list(ejecucion["snapshots"]))
+    if ejecucion.get("pares") is not None:
+        pintar_pares(ejecucion["pares"])
+    pintar_descargas(ejecucion["rutas_exportacion"], "ejecucion")
+    pintar_consumo_tokens(ejecucion["registros_tokens"])
+    pintar_memo(ejecucion.get("memo"))
+    pintar_plazos(ejecucion.get("plazos"))
+    if modo_sensibilidad and ejecucion["snapshots"]:
+        pintar_sensibilidad(ejecucion)
+
+    # El perfilado se cierra tras pintar los resultados: el coste de Streamlit también forma parte de la ejecución
+    if ejecutar_analisis and "perfilador_activo" in st.session_state:
+        with st.spinner("🔬 Guardando el perfil..."):
+            ejecucion["perfil"] = detener_perfilado(st.session_state.pop("perfilador_activo"), ruta_perfil_nueva())
+    if ejecucion.get("perfil"):
+        pintar_perfil(ejecucion["perfil"])
+
+# --- CRIBADO EN EMBUDO ---
+st.markdown("---")
+if st.button("🔻 Ejecutar Embudo"):
+    try:
+        if fichero_universo is not None:
+            # cargar_universo distingue CSV/Excel por la extensión del nombre
+            sufijo = ".csv" if fichero_universo.name.lower().endswith(".csv") else ".xlsx"
+            with tempfile.NamedTemporaryFile(suffix=sufijo, delete=False) as tmp:
+                tmp.write(fichero_universo.getvalue())
+            df_universo = cargar_universo(tmp.name)
+            os.remove(tmp.name)
+        else:
+            df_universo = cargar_universo("Referencias.xlsx")
+    except Exception as e:
+        st.error(f"⚠️ No se pudo leer el universo: {e}")
+        st.stop()
+
+    st.header("🔻 Cribado en Embudo")
+    with st.status(f"Cribando {len(df_universo)} tickers...", expanded=True) as estado_embudo:
+        usar_volcado = fuente_datos.startswith("🗂️")
+        exportador_embudo = abrir_exportacion(ruta_exportacion_nueva("embudo")) if modo_exportar else None
+        try:
+            resultado_embudo = ejecutar_embudo(df_universo, api_key=gemini_api_key or None, max_hilos=hilos_embudo,
+                                               modo_estructurado=True, al_progresar=st.write,
+                                               proveedor="ficheros" if usar_volcado else "yahoo",
+                                               opciones_proveedor={"directorio": directorio_volcado} if usar_volcado else None,
+                                               al_completar_ticker=(lambda fila: exportar_fila(exportador_embudo, fila))
+                                               if exportador_embudo else None,
+                                               modo_pares=modo_pares)
+        finally:
+            rutas_embudo = cerrar_exportacion(exportador_embudo) if exportador_embudo else []
+        estado_embudo.update(label="Cribado completado", state="complete", expanded=False)
+    # Solo se conserva lo que se pinta (no los snapshots de todo el universo)
+    st.session_state["ultimo_embudo"] = {"embudo": resultado_embudo['embudo'], "resultados": resultado_embudo['resultados'],
+                                         "rutas_exportacion": rutas_embudo}
+elif "ultimo_embudo" in st.session_state:
+    st.header("🔻 Cribado en Embudo")
+
+resultado_embudo = st.session_state.get("ultimo_embudo")
+if resultado_embudo is not None:
+    df_embudo = resultado_embudo['embudo']
+    columnas_embudo = st.columns(len(df_embudo))
+    for columna, fila in zip(columnas_embudo, df_embudo.itertuples()):
+        columna.metric(fila.Nivel, f"{fila.Pasan} / {fila.Entran}", f"-{fila.Descartados} · {fila.Segundos:.1f}s",
+                       delta_color="off")
+    st.dataframe(df_embudo, use_container_width=True, hide_index=True)
+    st.dataframe(resultado_embudo['resultados'].sort_values("Nivel alcanzado", ascending=False),
+                 use_container_width=True, hide_index=True)
+    pintar_descargas(resultado_embudo['rutas_exportacion'], "embudo")